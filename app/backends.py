@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+
+def parse_routes(text):
+    """
+    'genres=Anime>anime; seriesType=anime>anime; network=BBC One>uk' to [(json field, value, backend name)].
+    A rule matches when the lookup payload's field equals the value, or contains it for list fields like genres.
+    """
+    routes = []
+    for rule in (text or '').split(';'):
+        if not rule.strip():
+            continue
+        condition, _, name = rule.rpartition('>')
+        field, _, value = condition.partition('=')
+        if not (field.strip() and value.strip() and name.strip()):
+            raise ValueError('Bad route {!r}, expected field=value>backend'.format(rule))
+        routes.append((field.strip(), value.strip().lower(), name.strip()))
+    return routes
+
+
+def library_path(path, name, shared):
+    """Each backend mirrors into its own database when the library is kept on disk"""
+    if path == ':memory:' or not shared:
+        return path
+    root, extension = os.path.splitext(path)
+    return '{}-{}{}'.format(root, name, extension)
+
+
+class Backend(object):
+    """One Sonarr instance and the local state mirrored from it"""
+
+    def __init__(self, name, api, library=None, episodes=None, commands=None):
+        self.name = name
+        self.api = api
+        self.library = library
+        self.episodes = episodes
+        self.commands = commands  # CommandWatcher for the commands queued on the instance
+
+    def __repr__(self):
+        return 'Backend({!r})'.format(self.name)
+
+
+class Gathered(object):
+    """Results of one call fanned out to every backend, failed names the backends that errored or timed out"""
+
+    def __init__(self):
+        self.results = []  # [(backend, result)] in registry order
+        self.failed = []  # [(backend name, reason)]
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def note(self):
+        """Footer for a message built from partial results, '' when every backend answered"""
+        if not self.failed:
+            return ''
+        return '\n_No answer from {}_'.format(', '.join('{} ({})'.format(name, reason) for name, reason in self.failed))
+
+
+class Backends(object):
+    """
+    Registry of Sonarr instances.
+    Reads are fanned out to every backend at once and merged, so a command takes as long as the slowest backend
+    rather than the sum of them, adds are routed to one backend by rules on the show being added.
+    Every backend has its own max_workers threads, so a hanging instance only ever ties up its own.
+    """
+
+    def __init__(self, backends, routes=(), timeout=10, max_workers=4):
+        if not backends:
+            raise ValueError('At least one backend is required')
+        self.backends = list(backends)
+        self.routes = list(routes)
+        self.timeout = timeout
+        self._pools = dict((backend.name, ThreadPoolExecutor(max_workers=max_workers,
+                                                             thread_name_prefix='backend-{}'.format(backend.name)))
+                           for backend in self.backends)
+        self._stuck = dict((backend.name, set()) for backend in self.backends)  # timed out calls still running
+        self._lock = threading.Lock()
+        for field, value, name in self.routes:
+            if name not in self.names():
+                raise ValueError('Route {}={} points at unknown backend {}'.format(field, value, name))
+
+    def __iter__(self):
+        return iter(self.backends)
+
+    def __len__(self):
+        return len(self.backends)
+
+    @property
+    def default(self):
+        """The first backend, used when no route matches and by single instance commands"""
+        return self.backends[0]
+
+    def names(self):
+        return [backend.name for backend in self.backends]
+
+    def get(self, name):
+        for backend in self.backends:
+            if backend.name == name:
+                return backend
+        return None
+
+    def gather(self, call, timeout=None):
+        """
+        Run call(backend) on every backend concurrently, waiting at most timeout seconds for each.
+        A backend whose earlier calls timed out and are still running is not called again until they finish.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        gathered = Gathered()
+        futures = []
+        for backend in self.backends:
+            if self.busy(backend):
+                gathered.failed.append((backend.name, 'still busy'))
+            else:
+                futures.append((backend, self._pools[backend.name].submit(call, backend)))
+        wait([future for _, future in futures], timeout=timeout)
+        for backend, future in futures:
+            if not future.done():
+                if not future.cancel():
+                    # running calls cannot be cancelled, the backend is skipped until this one returns
+                    self._hold(backend, future)
+                log.warning('Backend {} timed out after {}s'.format(backend.name, timeout))
+                gathered.failed.append((backend.name, 'timed out'))
+            elif future.exception() is not None:
+                log.warning('Backend {} failed'.format(backend.name), exc_info=future.exception())
+                gathered.failed.append((backend.name, 'failed'))
+            else:
+                gathered.results.append((backend, future.result()))
+        return gathered
+
+    def busy(self, backend):
+        with self._lock:
+            return bool(self._stuck[backend.name])
+
+    def _hold(self, backend, future):
+        with self._lock:
+            self._stuck[backend.name].add(future)
+
+        def release(done):
+            with self._lock:
+                self._stuck[backend.name].discard(done)
+        future.add_done_callback(release)
+
+    def route(self, show, requested=None):
+        """Backend a show should be added to: the one asked for by name, else the first matching rule"""
+        if requested:
+            return self.get(requested)
+        for field, value, name in self.routes:
+            actual = show.get(field)
+            if isinstance(actual, (list, tuple)):
+                matched = value in [str(item).lower() for item in actual]
+            else:
+                matched = actual is not None and str(actual).lower() == value
+            if matched:
+                return self.get(name)
+        return self.default
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=False)
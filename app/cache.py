@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# seconds each endpoint group stays fresh, 0 disables caching for the group
+DEFAULT_TTLS = {
+    'profile': 3600,
+    'rootfolder': 3600,
+    'system_status': 300,
+    'series': 60,
+    'series_id': 60,
+    'lookup': 600,
+}
+
+# groups whose payloads change when the library is mutated
+LIBRARY_GROUPS = ('series', 'series_id', 'lookup')
+
+
+class CacheEntry(object):
+    __slots__ = ('group', 'response', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, group, response, expires):
+        self.group = group
+        self.response = response
+        self.expires = expires
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+    def validators(self):
+        """Conditional request headers for revalidating a stale entry"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """
+    Size bounded LRU of GET responses keyed by url with a TTL per endpoint group.
+    Stale entries are kept so they can be revalidated with ETag/Last-Modified when Sonarr sends them.
+    """
+
+    def __init__(self, ttls=None, max_entries=256, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def enabled(self, group):
+        return self.ttls.get(group, 0) > 0
+
+    def lookup(self, key):
+        """Returns (entry, fresh), entry is None when nothing is cached for key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            fresh = entry.expires > self.clock()
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry, fresh
+
+    def peek(self, key):
+        """lookup() without counting a hit or miss or touching the LRU order"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry, entry is not None and entry.expires > self.clock()
+
+    def store(self, group, key, response):
+        # read the body now so every hit can decode it without touching the connection
+        response.content
+        entry = CacheEntry(group, response, self.clock() + self.ttls[group])
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return response
+
+    def refresh(self, key):
+        """Mark a stale entry fresh again after a 304 from Sonarr"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.expires = self.clock() + self.ttls[entry.group]
+            self.revalidated += 1
+            return entry.response
+
+    def invalidate(self, *groups):
+        """Drop every entry in the given groups, all entries when no group is given"""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if not groups or entry.group in groups]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+        log.debug('Invalidated {} cached responses for {}'.format(len(keys), groups or 'all groups'))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
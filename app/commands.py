@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+
+class Command(object):
+    __slots__ = ('name', 'handler', 'help', 'exact', 'inline')
+
+    def __init__(self, name, handler, help=None, exact=False, inline=False):
+        self.name = name
+        self.handler = handler
+        self.help = help
+        self.exact = exact
+        self.inline = inline  # runs in the process reading Slack even when commands go to worker processes
+
+
+class CommandRouter(object):
+    """
+    Registry of bot commands compiled into one regular expression.
+    A command is its name followed by optional arguments, the longest name wins so `add shows` is never read as
+    `add show` with an `s` argument. Handlers are called handler(bot, channel, args, sender), exact commands
+    only match without arguments.
+
+        commands = CommandRouter()
+
+        @commands.command('get shows', 'Posts subscribed shows')
+        def get_shows_command(self, channel, args, sender):
+            ...
+    """
+
+    def __init__(self):
+        self.commands = []
+        self._pattern = None
+
+    def command(self, name, help=None, exact=False, inline=False):
+        """Decorator registering a handler, usable on Bot methods and on plain functions taking the bot first"""
+        def register(handler):
+            self.add(name, handler, help=help, exact=exact, inline=inline)
+            return handler
+        return register
+
+    def add(self, name, handler, help=None, exact=False, inline=False):
+        self.remove(name)
+        self.commands.append(Command(name.lower(), handler, help, exact, inline))
+        self._pattern = None
+
+    def remove(self, name):
+        self.commands = [command for command in self.commands if command.name != name.lower()]
+        self._pattern = None
+
+    def compile(self):
+        ordered = sorted(self.commands, key=lambda command: -len(command.name))
+        self._groups = dict(('c{}'.format(index), command) for index, command in enumerate(ordered))
+        alternatives = '|'.join('(?P<c{}>{})'.format(index, r'\s+'.join(re.escape(word)
+                                                                          for word in command.name.split()))
+                                for index, command in enumerate(ordered))
+        # only the name is matched, group c<n> is then the last one closed and names the command
+        self._pattern = re.compile(r'\s*(?:{})(?:\s+|$)'.format(alternatives), re.IGNORECASE)
+        return self._pattern
+
+    def match(self, text):
+        """(Command, args) for a command text, (None, None) when nothing matches"""
+        if not self.commands:
+            return None, None
+        pattern = self._pattern or self.compile()
+        found = pattern.match(text)
+        if found is None:
+            return None, None
+        command = self._groups[found.lastgroup]
+        args = text[found.end():].strip()
+        if command.exact and args:
+            return None, None
+        return command, args
+
+    def dispatch(self, bot, channel, text, sender):
+        """Run the handler for text, returns the command name or None when it is not a command"""
+        command, args = self.match(text)
+        if command is None:
+            return None
+        command.handler(bot, channel, args, sender)
+        return command.name
+
+    def help(self):
+        """[(name, help)] in registration order, commands registered without help are hidden"""
+        return [(command.name, command.help) for command in self.commands if command.help]
+
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+FINISHED = ('completed', 'failed', 'aborted', 'cancelled', 'orphaned')
+
+
+def command_state(command):
+    """v3 reports status, v2 state"""
+    return (command.get('status') or command.get('state') or '').lower()
+
+
+class CommandWatcher(object):
+    """
+    Waits for queued Sonarr commands to finish and calls on_done(command) with the final command.
+    Every poll is one GET /command for all watched commands, only commands that left that list (finished ones)
+    are read one by one. Polls start every interval seconds and back off to max_interval while nothing finishes,
+    the thread only runs while something is watched.
+    """
+
+    def __init__(self, api, interval=2, max_interval=30, timeout=1800, clock=time.monotonic):
+        self.api = api
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.watched = {}  # command id -> (on_done, deadline)
+        self.polls = 0
+        self._added = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.watched)
+
+    def watch(self, command, on_done):
+        if command_state(command) in FINISHED:
+            on_done(command)
+            return
+        with self._condition:
+            self.watched[command['id']] = (on_done, self.clock() + self.timeout)
+            self._added = self._thread is not None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='sonarr-commands', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def poll(self):
+        """Settle finished & timed out commands, returns whether any finished"""
+        with self._condition:
+            watched = dict(self.watched)
+        if not watched:
+            return False
+        self.polls += 1
+        running = dict((command['id'], command) for command in self.api.get_commands())
+        finished = []
+        for command_id in watched:
+            command = running.get(command_id)
+            if command is None:
+                # finished commands drop out of the list
+                command = self.api.get_command(command_id)
+            if command_state(command) in FINISHED:
+                finished.append(command)
+        now = self.clock()
+        with self._condition:
+            done = [(self.watched.pop(command['id'])[0], command) for command in finished
+                    if command['id'] in self.watched]
+            for command_id, (on_done, deadline) in list(self.watched.items()):
+                if deadline <= now:
+                    del self.watched[command_id]
+                    done.append((on_done, {'id': command_id, 'state': 'timeout'}))
+        for on_done, command in done:
+            try:
+                on_done(command)
+            except Exception:
+                log.warning('Command callback failed', exc_info=True)
+        return bool(done)
+
+    def _work(self):
+        delay = self.interval
+        while True:
+            with self._condition:
+                if not self.watched:
+                    self._thread = None
+                    return
+                self._condition.wait(delay)
+                if self._added:
+                    # a new command gets polled from the short interval again, not right after it was queued
+                    self._added = False
+                    delay = self.interval
+                    continue
+            try:
+                finished = self.poll()
+            except Exception:
+                log.warning('Polling Sonarr commands failed', exc_info=True)
+                finished = False
+            delay = self.interval if finished else min(delay * 2, self.max_interval)
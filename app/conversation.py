@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class Pending(object):
+    """A conversation step waiting on the next message from one user in one channel"""
+    __slots__ = ('handler', 'state', 'expires')
+
+    def __init__(self, handler, state, expires):
+        self.handler = handler
+        self.state = state
+        self.expires = expires
+
+
+class Conversations(object):
+    """
+    Expiring table of conversations waiting on a reply, keyed by (user, channel).
+    Claiming a reply is a single dict pop, expiry is driven by a heap so it never scans the table.
+    """
+
+    def __init__(self, ttl=60, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._pending = {}
+        self._deadlines = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def expect(self, user, channel, handler, state=None, ttl=None):
+        """Route the next message from user in channel to handler(output, state)"""
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._pending[(user, channel)] = Pending(handler, state, expires)
+            heapq.heappush(self._deadlines, (expires, next(self._counter), (user, channel)))
+
+    def claim(self, user, channel):
+        """Remove and return the pending step for user in channel, None if nothing is waiting"""
+        with self._lock:
+            pending = self._pending.pop((user, channel), None)
+        if pending is None or pending.expires <= self.clock():
+            return None
+        return pending
+
+    def cancel(self, user, channel):
+        with self._lock:
+            return self._pending.pop((user, channel), None)
+
+    def expired(self, everything=False):
+        """Remove and return [(key, pending)] for every step whose reply window has passed, or all of them"""
+        now = float('inf') if everything else self.clock()
+        result = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                expires, _, key = heapq.heappop(self._deadlines)
+                pending = self._pending.get(key)
+                # skip heap entries for steps that were claimed or replaced since
+                if pending is not None and pending.expires == expires:
+                    del self._pending[key]
+                    result.append((key, pending))
+        return result
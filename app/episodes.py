@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import threading
+from array import array
+
+log = logging.getLogger(__name__)
+
+# series fields that change whenever Sonarr touches a series' episodes
+SIGNATURE_FIELDS = ('lastInfoSync', 'episodeCount', 'episodeFileCount', 'totalEpisodeCount', 'monitored')
+
+
+def air_ordinal(episode):
+    air_date = episode.get('airDate')
+    if not air_date:
+        return 0
+    return datetime.date(int(air_date[:4]), int(air_date[5:7]), int(air_date[8:10])).toordinal()
+
+
+class EpisodeBlock(object):
+    """All episodes of one series stored column-wise in arrays instead of a list of dicts"""
+    __slots__ = ('ids', 'seasons', 'numbers', 'air', 'has_file', 'monitored', 'titles')
+
+    def __init__(self, episodes):
+        self.ids = array('l', [episode['id'] for episode in episodes])
+        self.seasons = array('h', [episode.get('seasonNumber', 0) for episode in episodes])
+        self.numbers = array('h', [episode.get('episodeNumber', 0) for episode in episodes])
+        self.air = array('l', [air_ordinal(episode) for episode in episodes])
+        self.has_file = bytearray(1 if episode.get('hasFile') else 0 for episode in episodes)
+        self.monitored = bytearray(1 if episode.get('monitored') else 0 for episode in episodes)
+        self.titles = tuple(episode.get('title', '') for episode in episodes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, index):
+        return {
+            'id': self.ids[index],
+            'seasonNumber': self.seasons[index],
+            'episodeNumber': self.numbers[index],
+            'airDate': datetime.date.fromordinal(self.air[index]) if self.air[index] else None,
+            'hasFile': bool(self.has_file[index]),
+            'monitored': bool(self.monitored[index]),
+            'title': self.titles[index],
+        }
+
+
+class EpisodeStore(object):
+    """
+    In-memory episode store with per-series and per-air-date indexes.
+    sync() only re-fetches episodes for series whose lastInfoSync or episode counts changed.
+    """
+
+    def __init__(self, sonarr):
+        self.sonarr = sonarr
+        self.blocks = {}  # series id -> EpisodeBlock
+        self.titles = {}  # series id -> series title
+        self.signatures = {}  # series id -> tuple of SIGNATURE_FIELDS
+        self.by_air_date = {}  # ordinal -> set of series ids airing that day
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self.fetches = 0
+        self.synced = False  # until a first sync completes the store cannot tell missing from not loaded yet
+
+    def __len__(self):
+        return sum(len(block) for block in self.blocks.values())
+
+    # SYNC
+    def sync(self, series):
+        """Bring the store in line with a /series listing, returns the ids of series whose episodes were fetched"""
+        if not self._sync_lock.acquire(False):
+            # a sync is already running, changes are picked up by the next one
+            return []
+        try:
+            current = dict((show['id'], show) for show in series)
+            changed = [series_id for series_id, show in current.items()
+                       if self.signatures.get(series_id) != self.signature(show)]
+            for series_id in set(self.blocks) - set(current):
+                self.drop(series_id)
+            for series_id in changed:
+                episodes = self.sonarr.get_episodes_by_series_id(series_id)
+                self.fetches += 1
+                self.load(current[series_id], episodes)
+            if changed:
+                log.debug('Episode store refreshed {} of {} series'.format(len(changed), len(current)))
+            self.synced = True
+            return changed
+        finally:
+            self._sync_lock.release()
+
+    @staticmethod
+    def signature(show):
+        return tuple(show.get(field) for field in SIGNATURE_FIELDS)
+
+    def load(self, show, episodes):
+        block = EpisodeBlock(episodes)
+        with self._lock:
+            self._unindex(show['id'])
+            self.blocks[show['id']] = block
+            self.titles[show['id']] = show['title']
+            self.signatures[show['id']] = self.signature(show)
+            for ordinal in set(block.air):
+                if ordinal:
+                    self.by_air_date.setdefault(ordinal, set()).add(show['id'])
+
+    def drop(self, series_id):
+        with self._lock:
+            self._unindex(series_id)
+            self.blocks.pop(series_id, None)
+            self.titles.pop(series_id, None)
+            self.signatures.pop(series_id, None)
+
+    def _unindex(self, series_id):
+        block = self.blocks.get(series_id)
+        if block is None:
+            return
+        for ordinal in set(block.air):
+            airing = self.by_air_date.get(ordinal)
+            if airing is not None:
+                airing.discard(series_id)
+                if not airing:
+                    del self.by_air_date[ordinal]
+
+    def mark_downloaded(self, series_id, episode_ids):
+        """Apply a Download webhook without waiting for the next sync"""
+        with self._lock:
+            block = self.blocks.get(series_id)
+            if block is None:
+                return
+            wanted = set(episode_ids)
+            for index, episode_id in enumerate(block.ids):
+                if episode_id in wanted:
+                    block.has_file[index] = 1
+
+    # QUERIES
+    def airing(self, start, end=None):
+        """Episodes airing from start up to and including end as [(series title, episode)] by date"""
+        end = end or start
+        result = []
+        with self._lock:
+            for ordinal in range(start.toordinal(), end.toordinal() + 1):
+                for series_id in self.by_air_date.get(ordinal, ()):
+                    block = self.blocks[series_id]
+                    for index, air in enumerate(block.air):
+                        if air == ordinal:
+                            result.append((self.titles[series_id], block.row(index)))
+        result.sort(key=lambda item: (item[1]['airDate'], item[0], item[1]['seasonNumber'], item[1]['episodeNumber']))
+        return result
+
+    def missing(self, series_id, today=None):
+        """Monitored episodes of series_id that have aired but have no file, by season & episode"""
+        today = (today or datetime.date.today()).toordinal()
+        with self._lock:
+            block = self.blocks.get(series_id)
+            if block is None:
+                return []
+            return [block.row(index) for index in range(len(block))
+                    if block.monitored[index] and not block.has_file[index] and 0 < block.air[index] < today]
+
+    def find_series(self, title):
+        """Series id for a title, exact match first then the shortest title containing it"""
+        title = title.lower()
+        with self._lock:
+            matches = [(len(name), series_id) for series_id, name in self.titles.items() if title in name.lower()]
+            exact = [series_id for series_id, name in self.titles.items() if name.lower() == title]
+        if exact:
+            return exact[0]
+        return min(matches)[1] if matches else None
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    tvdb_id INTEGER,
+    title TEXT NOT NULL,
+    title_lower TEXT NOT NULL,
+    monitored INTEGER NOT NULL,
+    seasons TEXT NOT NULL,
+    status TEXT,
+    episode_count INTEGER,
+    episode_file_count INTEGER,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_series_title ON series (title_lower);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_series_tvdb ON series (tvdb_id);
+CREATE INDEX IF NOT EXISTS ix_series_monitored ON series (monitored);
+'''
+# bumped whenever the series columns change, an older mirror is dropped and rebuilt by the next refresh
+SCHEMA_VERSION = 2
+COLUMNS = ('id', 'tvdb_id', 'title', 'title_lower', 'monitored', 'seasons', 'status', 'episode_count',
+           'episode_file_count', 'fingerprint')
+INSERT = 'INSERT OR REPLACE INTO series VALUES ({})'.format(', '.join('?' * len(COLUMNS)))
+
+# kind is added, removed, monitored, unmonitored, season_monitored, season_unmonitored, status or episodes,
+# detail the season number, new status or number of new episodes
+Change = namedtuple('Change', 'kind series_id title detail')
+
+
+def like_pattern(query):
+    """LIKE pattern matching titles containing query, wildcards in the query are literal"""
+    return '%{}%'.format(query.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+
+
+def monitored_seasons(show):
+    return [season['seasonNumber'] for season in show.get('seasons', []) if season['monitored']]
+
+
+def series_row(show):
+    """Flatten a Sonarr series object into the columns we keep"""
+    seasons = ','.join(str(number) for number in monitored_seasons(show))
+    monitored = 1 if show.get('monitored') else 0
+    status = show.get('status')
+    episode_count, episode_file_count = show.get('episodeCount'), show.get('episodeFileCount')
+    fingerprint = hashlib.sha1('{}|{}|{}|{}|{}|{}'.format(show['title'], monitored, seasons, status, episode_count,
+                                                          episode_file_count).encode('utf-8')).hexdigest()
+    return (show['id'], show.get('tvdbId'), show['title'], show['title'].lower(), monitored, seasons, status,
+            episode_count, episode_file_count, fingerprint)
+
+
+def season_set(seasons):
+    return set(int(number) for number in seasons.split(',') if number)
+
+
+def diff(old, new):
+    """Changes between two series rows, either may be None for an added or removed series"""
+    if old is None:
+        return [Change('added', new[0], new[2], None)]
+    if new is None:
+        return [Change('removed', old[0], old[2], None)]
+    before, after = dict(zip(COLUMNS, old)), dict(zip(COLUMNS, new))
+    series_id, title = after['id'], after['title']
+    changes = []
+    if before['monitored'] != after['monitored']:
+        changes.append(Change('monitored' if after['monitored'] else 'unmonitored', series_id, title, None))
+    old_seasons, new_seasons = season_set(before['seasons']), season_set(after['seasons'])
+    changes.extend(Change('season_monitored', series_id, title, number)
+                   for number in sorted(new_seasons - old_seasons))
+    changes.extend(Change('season_unmonitored', series_id, title, number)
+                   for number in sorted(old_seasons - new_seasons))
+    if before['status'] != after['status'] and after['status']:
+        changes.append(Change('status', series_id, title, after['status']))
+    if (after['episode_count'] or 0) > (before['episode_count'] or 0):
+        changes.append(Change('episodes', series_id, title, after['episode_count'] - (before['episode_count'] or 0)))
+    return changes
+
+
+def describe_change(change):
+    """Chat line for a Change"""
+    if change.kind == 'added':
+        return 'Added `{}`'.format(change.title)
+    if change.kind == 'removed':
+        return 'Removed `{}`'.format(change.title)
+    if change.kind == 'monitored':
+        return '`{}` is now monitored'.format(change.title)
+    if change.kind == 'unmonitored':
+        return '`{}` is no longer monitored'.format(change.title)
+    if change.kind == 'season_monitored':
+        return 'Season {} of `{}` now monitored'.format(change.detail, change.title)
+    if change.kind == 'season_unmonitored':
+        return 'Season {} of `{}` no longer monitored'.format(change.detail, change.title)
+    if change.kind == 'status':
+        return '`{}` is now {}'.format(change.title, change.detail)
+    if change.kind == 'episodes':
+        return '{} new episode{} listed for `{}`'.format(change.detail, '' if change.detail == 1 else 's',
+                                                         change.title)
+    return '`{}` changed'.format(change.title)
+
+
+class Library(object):
+    """
+    Local SQLite mirror of the Sonarr series list.
+    Reads never touch Sonarr, refresh only rewrites rows whose fingerprint changed and reports what changed
+    to watchers. refresh_series re-reads single series, so webhook events don't cost a full /series download.
+    A follower reads a mirror on disk that another process keeps fresh (WAL lets it read while that one writes),
+    it never refreshes from Sonarr on its own.
+    """
+
+    def __init__(self, sonarr, path=':memory:', max_age=300, clock=time.monotonic, follower=False):
+        self.sonarr = sonarr
+        self.max_age = max_age
+        self.clock = clock
+        self.follower = follower
+        self.refreshed_at = None
+        self.listeners = []
+        self.watchers = []
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        if path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+        if not follower and self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS series')
+            self._db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self._db.executescript(SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM series').fetchone()[0]
+
+    # SYNC
+    def subscribe(self, listener):
+        """listener(series) is called with the full series list after every refresh"""
+        self.listeners.append(listener)
+
+    def watch(self, watcher):
+        """watcher(changes) is called with the [Change] found by a refresh, the first fill of the mirror is silent"""
+        self.watchers.append(watcher)
+
+    def refresh(self):
+        """Pull /series and apply only added, changed & removed rows, returns the number of rows written"""
+        series = self.sonarr.get_series()
+        rows = [series_row(show) for show in series]
+        changed, removed, changes = self.apply(rows)
+        log.debug('Library refreshed, {} changed and {} removed of {} series'
+                  .format(len(changed), len(removed), len(rows)))
+        for listener in self.listeners:
+            listener(series)
+        self.notify(changes)
+        return len(changed) + len(removed)
+
+    def refresh_series(self, series_ids):
+        """Re-read only these series, one /series/{id} each, a series Sonarr no longer has is removed"""
+        wanted = set(series_ids)
+        if not wanted:
+            return 0
+        rows = []
+        for series_id in wanted:
+            show = self.sonarr.get_series_by_series_id(series_id)
+            if isinstance(show, dict) and 'id' in show:  # a 404 body is {'message': 'NotFound'}
+                rows.append(series_row(show))
+        changed, removed, changes = self.apply(rows, wanted)
+        self.notify(changes)
+        return len(changed) + len(removed)
+
+    def apply(self, rows, wanted=None):
+        """
+        Write rows whose fingerprint changed and delete the wanted ids missing from rows, every known series is
+        wanted when wanted is None. Returns (changed rows, removed ids, [Change]).
+        """
+        with self._lock, self._db:
+            if wanted is None:
+                known = dict((row[0], row) for row in self._db.execute('SELECT * FROM series'))
+            else:
+                known = dict((row[0], row) for row in self._db.execute(
+                    'SELECT * FROM series WHERE id IN ({})'.format(', '.join('?' * len(wanted))), list(wanted)))
+            changed = [row for row in rows if row[-1] != (known.get(row[0]) or (None,))[-1]]
+            removed = set(known) - set(row[0] for row in rows)
+            self._db.executemany(INSERT, changed)
+            self._db.executemany('DELETE FROM series WHERE id = ?', [(series_id,) for series_id in removed])
+            first_fill = wanted is None and self.refreshed_at is None and not known
+            if wanted is None:
+                self.refreshed_at = self.clock()
+        if first_fill:
+            return changed, removed, []
+        changes = [change for row in changed for change in diff(known.get(row[0]), row)]
+        changes.extend(change for series_id in sorted(removed) for change in diff(known[series_id], None))
+        return changed, removed, changes
+
+    def notify(self, changes):
+        if not changes:
+            return
+        for watcher in self.watchers:
+            try:
+                watcher(changes)
+            except Exception:
+                log.warning('Library watcher failed', exc_info=True)
+
+    def ensure_fresh(self):
+        if self.follower:
+            return
+        if self.refreshed_at is None or self.clock() - self.refreshed_at > self.max_age:
+            self.refresh()
+
+    def upsert(self, show):
+        """Apply a single series returned by add_series/upd_series"""
+        with self._lock, self._db:
+            self._db.execute(INSERT, series_row(show))
+
+    def remove(self, series_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM series WHERE id = ?', (series_id,))
+
+    # QUERIES
+    def shows(self, query=None, monitored_only=False):
+        """Returns [(title, [monitored season numbers])] ordered by title, optionally filtered by title"""
+        self.ensure_fresh()
+        sql = 'SELECT title, seasons FROM series WHERE 1'
+        params = []
+        if query:
+            sql += " AND title_lower LIKE ? ESCAPE '\\'"
+            params.append(like_pattern(query))
+        if monitored_only:
+            sql += ' AND monitored = 1'
+        sql += ' ORDER BY title_lower'
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [(title, [int(number) for number in seasons.split(',') if number]) for title, seasons in rows]
+
+    def find_by_title(self, query):
+        """Returns (id, title) of the series titled query, else the shortest title containing it, or None"""
+        self.ensure_fresh()
+        with self._lock:
+            return self._db.execute("SELECT id, title FROM series WHERE title_lower LIKE ? ESCAPE '\\' "
+                                    "ORDER BY title_lower != ?, length(title_lower), title_lower LIMIT 1",
+                                    (like_pattern(query), query.lower())).fetchone()
+
+    def find_by_tvdb(self, tvdb_id):
+        """Returns (id, title) of the series with tvdb_id if it is already in the library"""
+        self.ensure_fresh()
+        with self._lock:
+            return self._db.execute('SELECT id, title FROM series WHERE tvdb_id = ?', (tvdb_id,)).fetchone()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lookups (
+    term TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_lookups_used ON lookups (used);
+'''
+
+
+def normalize(term):
+    return ' '.join(term.lower().split())
+
+
+class LookupStore(object):
+    """
+    SQLite backed cache of series lookup response bodies that survives restarts.
+    Bodies are stored zlib compressed, entries expire ttl seconds after they were stored and the least recently
+    used ones are evicted once the compressed bodies exceed max_bytes. The database runs in WAL mode with a busy
+    timeout so several bot processes can share one file.
+    """
+
+    def __init__(self, path, ttl=86400, max_bytes=64 * 1024 * 1024, touch_after=60, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.touch_after = touch_after  # hits only rewrite the last used time once it is this old
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM lookups').fetchone()[0]
+
+    def get(self, term):
+        """The stored body for term, None when it is missing or expired"""
+        now = self.clock()
+        with self._lock:
+            row = self._db.execute('SELECT body, stored, used FROM lookups WHERE term = ?',
+                                   (normalize(term),)).fetchone()
+            if row is None or row[1] + self.ttl <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[2] > self.touch_after:
+                self._db.execute('UPDATE lookups SET used = ? WHERE term = ?', (now, normalize(term)))
+        return zlib.decompress(row[0])
+
+    def put(self, term, body):
+        # lookup bodies are a few KB, a small window & memLevel keep deflate's state at 64KB instead of 256KB
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 13, 6)
+        body = compressor.compress(body) + compressor.flush()
+        now = self.clock()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?)',
+                                 (normalize(term), body, len(body), now, now))
+                self._evict(now)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _evict(self, now):
+        self._db.execute('DELETE FROM lookups WHERE stored <= ?', (now - self.ttl,))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM lookups').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for term, size in self._db.execute('SELECT term, size FROM lookups ORDER BY used').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM lookups WHERE term = ?', (term,))
+            total -= size
+            evicted += 1
+        log.debug('Evicted {} stored lookups'.format(evicted))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM lookups')
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM lookups').fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
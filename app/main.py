@@ -1,86 +1,508 @@
 #!/usr/bin/env python
 
+import atexit
 import logging
 import settings
+import datetime
+import functools
+import hashlib
+import itertools
+import json
+import os
 import pprint
+import re
+import tempfile
 import time
-import configparser
+from concurrent.futures import ThreadPoolExecutor
 from slackclient import SlackClient
-from sonarr import SonarrAPI
+from backends import Backend, Backends, library_path, parse_routes
+from cache import LIBRARY_GROUPS
+from commandwatch import CommandWatcher, command_state
+from commands import CommandRouter
+from conversation import Conversations
+from episodes import EpisodeStore, air_ordinal
+from library import Library, describe_change
+from lookupstore import LookupStore
+from metrics import MetricsServer, default_registry
+from models import Series
+from outbound import Outbound
+from posters import PosterServer, PosterStore
+from queuetracker import QueueTracker
+from recur import Scheduler
+from search import TitleIndex
+from webhook import WebhookReceiver
+from runtime import Runtime
+from sonarr import SonarrAPI, SonarrError
+from workers import WorkerPool
 
 log = logging.getLogger(__name__)
 
+# slack commands & definitions, handlers are registered on it by the @commands.command decorators below
+commands = CommandRouter()
+
+
 class Bot(object):
+    commands = commands
 
-    def __init__(self):
+    def __init__(self, slack_client=None, worker=False):
         # slack things
-        self.slack_client = SlackClient(settings.SLACK_KEY)
+        self.slack_client = slack_client or SlackClient(settings.SLACK_KEY)
         self.bot_name = settings.BOT_NAME
-        self.connection = self.connect_to_slack()
+        self.outbound = Outbound(self.slack_client).start()
+        # the RTM connection is opened by the runtime, only our own user id is needed before events are parsed
+        self.connection = False
         self.bot_id = self.get_bot_id()
         self.at_bot = '<@{}>'.format(self.bot_id)
-        self.websocket_delay = 1 # 1 second delay between reading from firehose
-        self.listen_time = 10 # bot will listen for number of seconds difference between websocket_delay & listen_time
-
-        # slack commands & definitions
-        self.help_command = 'help'
-        self.get_shows_command = 'get shows'
-        self.get_shows_definition = 'Posts message showing which shows & seasons are already subscribed in Sonarr'
-        self.add_show_command = 'add show'
-        self.add_show_definition = 'Adds show to sonarr'
-
-        # sonarr things
-        self.sonarrAPI = SonarrAPI(host_url=settings.SONARR_HOST_URL, api_key=settings.SONARR_API_KEY)
+        self.listen_time = 10 # seconds the bot waits for a user to respond
+        self.conversations = Conversations(ttl=self.listen_time)
+        self.show_range = [1, 4] # more shows than this and the user is asked to refine the search
+
+        self.history_limit = [10, 50] # default & maximum number of grabs posted
+
+        # scheduled job state
+        self.low_disks = set()
+        self.subscribed_channels = set([settings.NOTIFY_CHANNEL]) if settings.NOTIFY_CHANNEL else set()
+
+        # sonarr things, one backend per instance, the first one also serves single instance commands
+        self.title_index = TitleIndex()
+        self.batch_pool = ThreadPoolExecutor(max_workers=settings.BATCH_WORKERS)
+        self.lookup_store = LookupStore(settings.LOOKUP_CACHE_DB, ttl=settings.LOOKUP_CACHE_TTL,
+                                        max_bytes=int(settings.LOOKUP_CACHE_MAX_MB * 1024 * 1024)) \
+            if settings.LOOKUP_CACHE_DB else None
+        self.posters = PosterStore(settings.POSTER_DIR, width=settings.POSTER_WIDTH,
+                                   max_bytes=int(settings.POSTER_CACHE_MAX_MB * 1024 * 1024)) \
+            if settings.POSTER_BASE_URL else None
+        backends = []
+        for name, host_url, api_key in settings.SONARR_BACKENDS:
+            api = SonarrAPI(host_url=host_url, api_key=api_key,
+                            pool_size=settings.SONARR_POOL_SIZE,
+                            connect_timeout=settings.SONARR_CONNECT_TIMEOUT,
+                            read_timeout=settings.SONARR_READ_TIMEOUT,
+                            retries=settings.SONARR_RETRIES,
+                            cache_size=settings.SONARR_CACHE_SIZE,
+                            lookup_store=self.lookup_store)
+            # worker processes read the front's mirror, refreshing it & diffing changes from it stay the front's
+            library = Library(api, path=library_path(settings.LIBRARY_DB, name, len(settings.SONARR_BACKENDS) > 1),
+                              max_age=settings.LIBRARY_MAX_AGE, follower=worker)
+            episodes = EpisodeStore(api)
+            library.subscribe(self.title_index.add_all)
+            if not worker:
+                # a worker's store never syncs, its episode queries go to Sonarr instead of a sync per process
+                library.subscribe(functools.partial(self.sync_episodes, episodes))
+            backend = Backend(name, api, library, episodes, CommandWatcher(api))
+            if not worker:
+                library.watch(functools.partial(self.post_changes, backend))
+            backends.append(backend)
+        self.backends = Backends(backends, routes=parse_routes(settings.SONARR_ROUTES),
+                                 timeout=settings.SONARR_BACKEND_TIMEOUT)
+        self.sonarrAPI = self.backends.default.api
+        self.library = self.backends.default.library
+        self.episodes = self.backends.default.episodes
+        self.queue_tracker = QueueTracker(self.queue_items, self.outbound, fast=settings.QUEUE_POLL_FAST,
+                                          idle=settings.QUEUE_POLL_INTERVAL, step=settings.QUEUE_PROGRESS_STEP)
+
+        # metrics
+        self.metrics = default_registry()
+        self.metrics.describe('bot_command_seconds', 'Time to handle a command, conversation replies excluded')
+        self.metrics.gauge('sonarr_cache_entries', lambda: self.cache_stats()['entries'])
+        self.metrics.gauge('sonarr_cache_hits', lambda: self.cache_stats()['hits'])
+        self.metrics.gauge('sonarr_cache_misses', lambda: self.cache_stats()['misses'])
+        self.metrics.gauge('sonarr_requests_collapsed',
+                           lambda: sum(backend.api.flight.collapsed for backend in self.backends),
+                           'Sonarr GETs served by an identical request already in flight')
+        self.metrics.gauge('bot_conversations_pending', lambda: len(self.conversations))
+        if self.lookup_store is not None:
+            self.metrics.gauge('lookup_store_hits', lambda: self.lookup_store.hits)
+            self.metrics.gauge('lookup_store_misses', lambda: self.lookup_store.misses)
+        if self.posters is not None:
+            self.metrics.gauge('poster_store_hits', lambda: self.posters.hits)
+            self.metrics.gauge('poster_store_fetched', lambda: self.posters.fetched, 'Posters downloaded & downsized')
+        self.metrics.gauge('queue_polls', lambda: self.queue_tracker.polls, 'Download queue reads')
+        self.metrics.gauge('queue_message_updates', lambda: self.queue_tracker.updates,
+                           'Queue messages edited in place rather than posted again')
+        self.metrics.gauge('library_series', lambda: sum(len(backend.library) for backend in self.backends))
+        self.metrics.gauge('episode_store_episodes', lambda: sum(len(backend.episodes) for backend in self.backends))
 
     def connect_to_slack(self):
-        if self.slack_client.rtm_connect():
+        # rtm.connect rather than rtm.start, the team state (every user & channel) is never used
+        if self.slack_client.rtm_connect(with_team_state=False):
             log.info("{} connected and running!".format(self.bot_name))
-            return True
+            self.connection = True
         else:
             log.warning('{} not connected to slack :('.format(self.bot_name))
-            return False
+            self.connection = False
+        return self.connection
+
+    def instance_label(self, backend):
+        """' [name]' suffix for lines merged from several instances, '' with a single instance"""
+        return ' [{}]'.format(backend.name) if len(self.backends) > 1 else ''
 
-    def get_shows(self, channel):
-        """Post what shows are already available"""
+    def get_shows(self, channel, query=None):
+        """Post what shows are already available, served from the local library mirror of every instance"""
         log.debug('retrieving shows...')
-        series = self.sonarrAPI.get_series()
-        shows = {}
-        for show in series:
-            title = show['title']
-            seasons = []
-            for season in show['seasons']:
-                if season['monitored']:
-                    seasons.append(season['seasonNumber'])
-            shows[title] = seasons
+        gathered = self.backends.gather(lambda backend: backend.library.shows(query=query))
+        shows = sorted(((title, seasons, self.instance_label(backend)) for backend, result in gathered
+                        for title, seasons in result), key=lambda show: show[0].lower())
+        if not shows:
+            message = 'No subscribed shows match `{}`'.format(query) if query else 'No subscribed shows yet'
+            self.outbound.post(channel, message + gathered.note())
+            return
         # message generator
-        block = '\n'.join([key + ' - Seasons: ' + ', '.join([str(number) for number in value]) for key, value in shows.items()])
-        message = "Already Subscribed to:\n```{}```".format(block)
-        log.debug('get show message sent to slack: {}'.format(message))
+        block = '\n'.join([key + ' - Seasons: ' + ', '.join([str(number) for number in value]) + label
+                           for key, value, label in shows])
+        message = "Already Subscribed to:\n```{}```".format(block) + gathered.note()
+        log.debug('get show message of {} shows sent to slack'.format(len(shows)))
 
         # post to slack
-        self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
+        self.outbound.post(channel, message)
 
     @staticmethod
-    def sonarr_response_handler(response):
-        shows = []
-        if type(response) is list and len(response) > 1:
-            for show in response:
-                shows.append(show['title'])
+    def episode_label(series_title, episode):
+        return '{} S{:02d}E{:02d} - {}'.format(series_title, episode.get('seasonNumber', 0),
+                                              episode.get('episodeNumber', 0), episode.get('title', ''))
+
+    def get_history(self, channel, count):
+        """Post the most recent grabs, Sonarr filters the history so one page usually holds them all"""
+        count = max(1, min(count, self.history_limit[1]))
+        grabs = itertools.islice(self.sonarrAPI.iter_history(event_type='grabbed', page_size=max(count, 50)), count)
+        block = ['{} ({})'.format(self.episode_label(record['series']['title'], record['episode']),
+                                  record['quality']['quality']['name']) for record in grabs]
+        if block:
+            message = "Last {} grabs:\n```{}```".format(len(block), '\n'.join(block))
         else:
-            shows.append(response[0]['title'])
-        return shows
+            message = 'Nothing has been grabbed yet'
+        self.outbound.post(channel, message)
+
+    def sync_episodes(self, episodes, series):
+        """Refresh an instance's episode store in the background after its library refreshed"""
+        def sync():
+            try:
+                episodes.sync(series)
+            except Exception:
+                log.warning('Episode store sync failed', exc_info=True)
+        self.batch_pool.submit(sync)
+
+    def get_airing(self, channel):
+        """Post episodes airing today, served from the episode store"""
+        today = datetime.date.today()
+        gathered = self.backends.gather(lambda backend: self.calendar_block(backend, today, today))
+        block = [line for backend, lines in gathered for line in lines]
+        message = "Airing today:\n```{}```".format('\n'.join(block)) if block else 'Nothing airing today'
+        self.outbound.post(channel, message + gathered.note())
+
+    def get_missing(self, channel, query=None):
+        """Post episodes that aired in the last week without a file, or every missing episode of one show"""
+        if query:
+            found = [missing for backend in self.backends
+                     for missing in [self.missing_episodes(backend, query)] if missing is not None]
+            if not found:
+                self.outbound.post(channel, 'No subscribed shows match `{}`'.format(query))
+                return
+            title, episodes = found[0]
+            block = [self.episode_label(title, episode) for episode in episodes]
+            message = "Missing from {}:\n```{}```".format(title, '\n'.join(block)) if block else \
+                'Nothing missing from {}'.format(title)
+            self.outbound.post(channel, message)
+            return
+
+        now = datetime.datetime.utcnow()
+        missing = self.sonarrAPI.iter_wanted_missing(since=now - datetime.timedelta(days=7), until=now)
+        block = [self.episode_label(episode['series']['title'], episode) for episode in missing]
+        if block:
+            message = "Missing this week:\n```{}```".format('\n'.join(block))
+        else:
+            message = 'Nothing missing this week'
+        self.outbound.post(channel, message)
 
     @staticmethod
-    def get_sonarr_poster(response, show_number):
-        show = response[show_number]
-        image_url = ''
-        for image in show['images']:
-            if image['coverType'] == 'poster':
-                image_url = image['url']
-        if len(image_url) > 0:
-            return image_url
+    def missing_episodes(backend, query):
+        """(title, missing episodes) of the show matching query on one instance, None when it has no such show"""
+        backend.library.ensure_fresh()
+        episodes = backend.episodes
+        if episodes.synced:
+            series_id = episodes.find_series(query)
+            return None if series_id is None else (episodes.titles[series_id], episodes.missing(series_id))
+        # the store is still loading, read the show's episodes from Sonarr meanwhile
+        found = backend.library.find_by_title(query)
+        if found is None:
+            return None
+        series_id, title = found
+        today = datetime.date.today().toordinal()
+        missing = [episode for episode in backend.api.get_episodes_by_series_id(series_id)
+                   if episode.get('monitored') and not episode.get('hasFile') and 0 < air_ordinal(episode) < today]
+        return title, sorted(missing, key=lambda episode: (episode.get('seasonNumber', 0),
+                                                          episode.get('episodeNumber', 0)))
+
+    def calendar_block(self, backend, start, end):
+        """Episode lines airing from start to end for one instance, from its episode store once it has synced"""
+        backend.library.ensure_fresh()
+        if backend.episodes.synced:
+            return [self.episode_label(title, episode) + self.instance_label(backend)
+                    for title, episode in backend.episodes.airing(start, end)]
+        calendar = backend.api.get_calendar(start, end + datetime.timedelta(days=1))
+        return [self.episode_label(episode['series']['title'], episode) + self.instance_label(backend)
+                for episode in calendar if start.toordinal() <= air_ordinal(episode) <= end.toordinal()]
+
+    def post_calendar(self, channel):
+        """Nightly digest of episodes airing today and tomorrow"""
+        today = datetime.date.today()
+        gathered = self.backends.gather(
+            lambda backend: self.calendar_block(backend, today, today + datetime.timedelta(days=1)))
+        block = [line for backend, lines in gathered for line in lines]
+        if not block:
+            return
+        message = "Airing today & tomorrow:\n```{}```".format('\n'.join(block)) + gathered.note()
+        self.outbound.post(channel, message)
+
+    def queue_items(self):
+        """[(key, label, QueueItem)] over every instance for the queue tracker, None when one could not be read"""
+        gathered = self.backends.gather(lambda backend: backend.api.get_queue(typed=True))
+        if gathered.failed:
+            return None
+        return [((backend.name, item.id),
+                 self.episode_label(item.series_title, item.episode) + self.instance_label(backend), item)
+                for backend, items in gathered for item in items]
+
+    def check_diskspace(self, channel, min_free_percent):
+        """Alert once when a disk drops below min_free_percent free, and again only after it recovers"""
+        for backend, disks in self.backends.gather(lambda backend: backend.api.get_diskspace()):
+            for disk in disks:
+                if not disk.get('totalSpace'):
+                    continue
+                key = (backend.name, disk['path'])
+                free_percent = 100.0 * disk['freeSpace'] / disk['totalSpace']
+                if free_percent < min_free_percent and key not in self.low_disks:
+                    self.low_disks.add(key)
+                    message = 'Low disk space on `{}`{}: {:.1f}% free ({:.1f} GB)'.format(
+                        disk['path'], self.instance_label(backend), free_percent, disk['freeSpace'] / 1024.0 ** 3)
+                    self.outbound.post(channel, message)
+                elif free_percent >= min_free_percent:
+                    self.low_disks.discard(key)
+
+    @staticmethod
+    def describe_event(event):
+        """One line per Sonarr webhook event"""
+        title = (event.get('series') or {}).get('title', 'Unknown series')
+        if event['eventType'] == 'Rename':
+            return 'Renamed files for {}'.format(title)
+        if event['eventType'] == 'Test':
+            return 'Test notification from Sonarr'
+        action = {'Grab': 'Grabbed', 'Download': 'Downloaded'}.get(event['eventType'], event['eventType'])
+        if event.get('isUpgrade'):
+            action = 'Upgraded'
+        episodes = event.get('episodes') or [{}]
+        quality = episodes[0].get('quality') or (event.get('release') or {}).get('quality')
+        labels = [Bot.episode_label(title, episode) for episode in episodes]
+        return '{} {}{}'.format(action, ', '.join(labels), ' ({})'.format(quality) if quality else '')
+
+    def on_webhook_batch(self, events):
+        """Fan a batch of Sonarr webhook events out to every subscribed channel as a single message"""
+        touched = {}  # backend -> ids of series whose counts or files changed
+        for event in events:
+            # instanceName is sent by newer Sonarr versions or set from the webhook url's backend parameter
+            backend = self.backends.get(event.get('instanceName')) or self.backends.default
+            if event['eventType'] == 'Download' and event.get('series'):
+                backend.episodes.mark_downloaded(event['series']['id'],
+                                                 [episode['id'] for episode in event.get('episodes', [])])
+            if event['eventType'] in ('Download', 'Rename') and event.get('series'):
+                touched.setdefault(backend, set()).add(event['series']['id'])
+        for backend, series_ids in touched.items():
+            # cached series payloads are out of date, re-read just these series instead of all of /series
+            backend.api.cache.invalidate('series', 'series_id')
+            try:
+                backend.library.refresh_series(series_ids)
+            except Exception:
+                log.info('Refreshing {} series on {} failed'.format(len(series_ids), backend.name), exc_info=True)
+        if not self.subscribed_channels:
+            return
+        message = '\n'.join(self.describe_event(event) for event in events)
+        for channel in list(self.subscribed_channels):
+            self.outbound.post(channel, message)
+
+    def post_changes(self, backend, changes):
+        """Library watcher, posts what a refresh found changed in Sonarr to the subscribed channels"""
+        if not self.subscribed_channels:
+            return
+        lines = [describe_change(change) for change in changes[:settings.LIBRARY_CHANGES_LIMIT]]
+        if len(changes) > len(lines):
+            lines.append('...and {} more changes'.format(len(changes) - len(lines)))
+        message = 'Library changes{}:\n{}'.format(self.instance_label(backend), '\n'.join(lines))
+        for channel in list(self.subscribed_channels):
+            self.outbound.post(channel, message)
+
+    def stats(self, channel):
+        """Post where time goes, from the metrics registry"""
+        def table(rows):
+            return '\n'.join('{:<28} {:>6} {:>8.0f}ms {:>8.0f}ms'.format(name, count, p50 * 1000, p95 * 1000)
+                             for name, count, p50, p95 in rows) or 'nothing yet'
+
+        heading = '{:<28} {:>6} {:>10} {:>10}'.format('', 'count', 'p50', 'p95')
+        cache = self.cache_stats()
+        lookups = cache['hits'] + cache['misses']
+        message = '\n'.join([
+            'Commands:', '```{}\n{}```'.format(heading, table(self.metrics.summary('bot_command_seconds', 'command'))),
+            'Sonarr:', '```{}\n{}```'.format(heading, table(self.metrics.summary('sonarr_request_seconds', 'method',
+                                                                                  'endpoint'))),
+            'Slack:', '```{}\n{}```'.format(heading, table(self.metrics.summary('slack_send_seconds', 'method'))),
+            'Cache {} entries, {:.0%} hit rate, {} requests coalesced, Slack queue {}, {} conversations waiting'
+            .format(cache['entries'], cache['hits'] / float(lookups) if lookups else 0,
+                    sum(backend.api.flight.collapsed for backend in self.backends), self.outbound.depth(),
+                    len(self.conversations)),
+        ])
+        if self.lookup_store is not None:
+            stored = self.lookup_store.stats()
+            message += '\nStored lookups {} ({:.1f} MB), {} hits, {} misses'.format(
+                stored['entries'], stored['bytes'] / 1024.0 ** 2, stored['hits'], stored['misses'])
+        self.outbound.post(channel, message)
+
+    def cache_stats(self):
+        """Response cache counters summed over every instance"""
+        totals = {}
+        for backend in self.backends:
+            for key, value in backend.api.cache.stats().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def subscribe(self, channel, subscribed):
+        if subscribed:
+            self.subscribed_channels.add(channel)
+            message = 'I will post Sonarr notifications here'
+        else:
+            self.subscribed_channels.discard(channel)
+            message = 'I will stop posting Sonarr notifications here'
+        self.outbound.post(channel, message)
+
+    # BULK OPERATIONS, a handful of requests however many shows or episodes they touch
+    def find_show(self, query):
+        """(backend, series id, title) of the subscribed show best matching query, None when nothing does"""
+        for backend in self.backends:
+            found = backend.library.find_by_title(query)
+            if found:
+                return backend, found[0], found[1]
+        return None
+
+    def run_sonarr_command(self, channel, backend, name, label, **body):
+        """Queue a Sonarr command and post once it finished"""
+        try:
+            command = backend.api.command(name, **body)
+        except SonarrError as error:
+            self.outbound.post(channel, 'Sonarr did not start {}: {}'.format(label, error))
+            return
+        self.outbound.post(channel, 'Started {}{}'.format(label, self.instance_label(backend)))
+        backend.commands.watch(command, functools.partial(self.command_finished, channel, backend, label))
+
+    def command_finished(self, channel, backend, label, command):
+        state = command_state(command)
+        if state == 'completed' and command.get('name') in ('RefreshSeries', 'RescanSeries'):
+            backend.api.cache.invalidate(*LIBRARY_GROUPS)
+            self.batch_pool.submit(backend.library.refresh)
+        message = '{} {}{}'.format(label[0].upper() + label[1:], 'finished' if state == 'completed' else state,
+                                   self.instance_label(backend))
+        self.outbound.post(channel, message)
+
+    def series_command(self, channel, query, name, verb):
+        """RefreshSeries or RescanSeries for one show, or every show on every instance without a query"""
+        if not query:
+            for backend in self.backends:
+                self.run_sonarr_command(channel, backend, name, '{} every show'.format(verb))
+            return
+        found = self.find_show(query)
+        if found is None:
+            self.outbound.post(channel, 'No subscribed shows match `{}`'.format(query))
+            return
+        backend, series_id, title = found
+        self.run_sonarr_command(channel, backend, name, '{} {}'.format(verb, title), seriesId=series_id)
+
+    def search_missing(self, channel, query):
+        """One EpisodeSearch for every monitored episode of a show that aired without a file"""
+        found = self.find_show(query) if query else None
+        if found is None:
+            self.outbound.post(channel, 'No subscribed shows match `{}`'.format(query) if query else
+                               'Which show? e.g. `search missing fargo`')
+            return
+        backend, series_id, title = found
+        today = datetime.date.today().toordinal()
+        missing = [episode['id'] for episode in backend.api.get_episodes_by_series_id(series_id)
+                   if episode.get('monitored') and not episode.get('hasFile') and 0 < air_ordinal(episode) < today]
+        if not missing:
+            self.outbound.post(channel, 'Nothing missing from {}'.format(title))
+            return
+        self.run_sonarr_command(channel, backend, 'EpisodeSearch',
+                                'searching for {} missing episodes of {}'.format(len(missing), title),
+                                episodeIds=missing)
+
+    def unmonitor_ended(self, channel):
+        """Unmonitor every ended show with one series editor request per instance"""
+        def unmonitor(backend):
+            ended = [dict(show, monitored=False) for show in backend.api.get_series()
+                     if show.get('status') == 'ended' and show.get('monitored')]
+            if ended:
+                backend.api.edit_series(ended)
+                backend.library.refresh()
+            return [show['title'] for show in ended]
+
+        gathered = self.backends.gather(unmonitor)
+        block = sorted(title + self.instance_label(backend) for backend, titles in gathered for title in titles)
+        message = "Stopped monitoring {} ended shows:\n```{}```".format(len(block), '\n'.join(block)) if block \
+            else 'No monitored show has ended'
+        self.outbound.post(channel, message + gathered.note())
+
+    def monitor_season(self, channel, args, monitored):
+        """Monitor or unmonitor every episode of a season in one request"""
+        verb = 'monitor' if monitored else 'unmonitor'
+        title, separator, season = args.lower().rpartition(' season ')
+        if not separator or not season.strip().isdigit():
+            self.outbound.post(channel, 'Which season? e.g. `{} fargo season 2`'.format(verb))
+            return
+        found = self.find_show(title.strip())
+        if found is None:
+            self.outbound.post(channel, 'No subscribed shows match `{}`'.format(title.strip()))
+            return
+        backend, series_id, title = found
+        season = int(season)
+        episodes = [episode for episode in backend.api.get_episodes_by_series_id(series_id)
+                    if episode.get('seasonNumber') == season]
+        changed = [episode for episode in episodes if bool(episode.get('monitored')) != monitored]
+        if not episodes:
+            message = '{} has no season {}'.format(title, season)
+        elif not changed:
+            message = 'Every episode of {} season {} is already {}ed'.format(title, season, verb)
         else:
-            return show['images'][0]['url']
+            backend.api.set_episodes_monitored(changed, monitored)
+            message = '{}ed {} episodes of {} season {}'.format(verb.capitalize(), len(changed), title, season)
+        self.outbound.post(channel, message + self.instance_label(backend))
+
+    def schedule(self, scheduler):
+        """Register the bot's recurring jobs, notifications need settings.NOTIFY_CHANNEL"""
+        for backend in self.backends:
+            scheduler.add('library-{}'.format(backend.name), backend.library.refresh,
+                          interval=backend.library.max_age, jitter=10, missed='skip')
+        # the queue job sets its own pace, watches started by the queue command poll it right away
+        scheduler.add('queue', self.queue_tracker.poll, interval=settings.QUEUE_POLL_INTERVAL, adaptive=True,
+                      missed='skip')
+        self.queue_tracker.wake = functools.partial(scheduler.reschedule, 'queue')
+        channel = settings.NOTIFY_CHANNEL
+        if channel:
+            scheduler.add('calendar', self.post_calendar, channel, cron=settings.CALENDAR_CRON)
+            self.queue_tracker.watch(channel, repost=True)
+            scheduler.add('diskspace', self.check_diskspace, channel, settings.DISKSPACE_MIN_FREE_PERCENT,
+                          cron=settings.DISKSPACE_CRON, jitter=30, missed='skip')
+        return scheduler
+
+    @staticmethod
+    def sonarr_response_handler(response):
+        return [show.title for show in response]
+
+    @staticmethod
+    def get_sonarr_poster(response, show_number):
+        return response[show_number].poster
+
+    def poster_url(self, url):
+        """Our thumbnail of a poster when the poster endpoint is set up, the remote url if it is not ready in time"""
+        if self.posters is None or not url:
+            return url
+        name = self.posters.ensure(url, timeout=settings.POSTER_WAIT)
+        return '{}/{}'.format(settings.POSTER_BASE_URL.rstrip('/'), name) if name else url
 
     @staticmethod
     def is_number_between(num, start, end):
@@ -91,181 +513,419 @@ class Bot(object):
         except ValueError:
             return False
 
-    def listen_for_response(self, user_id, channel):
-        log.debug('Listening for responses from user: {} in channel: {}'.format(user_id, channel))
-        for x in range(self.websocket_delay, self.listen_time):
-            output_list = bot.slack_client.rtm_read()
-            if output_list and len(output_list) > 0:
-                for output in output_list:
-                    # print(output)
-                    if 'user' and 'text' in output and output['user'] == user_id and output['channel'] == channel:
-                        return output
-
-            time.sleep(self.websocket_delay)
-        return None
+    def deliver_reply(self, output):
+        """Claim a message for the conversation waiting on its user & channel, returns the step to run or None"""
+        if 'text' not in output or 'user' not in output:
+            return None
+        pending = self.conversations.claim(output['user'], output.get('channel'))
+        if pending is None:
+            return None
+        return functools.partial(pending.handler, output, pending.state)
+
+    def expire_conversations(self, everything=False):
+        """
+        Returns a timeout notice for every conversation whose reply window has passed, on shutdown every
+        conversation still waiting gets a restart notice instead
+        """
+        now = self.conversations.clock()
+        return [functools.partial(self.conversation_timeout if pending.expires <= now else self.conversation_restart,
+                                  channel=key[1], state=pending.state)
+                for key, pending in self.conversations.expired(everything)]
 
-    def get_quality_names(self):
+    def conversation_timeout(self, channel, state):
+        log.info('User did not respond')
+        self.outbound.post(channel, 'No response detected...')
+
+    def conversation_restart(self, channel, state):
+        log.info('Conversation dropped by a restart')
+        self.outbound.post(channel, 'Bot is restarting, please run the command again')
+
+    def get_quality_names(self, backend=None):
         """prompt user to choose a quality profile"""
-        profiles = self.sonarrAPI.get_quality_profiles()
+        profiles = (backend or self.backends.default).api.get_quality_profiles(typed=True)
 
         if len(profiles) == 1:
-            log.debug('One quality profile detected, returned profile {}'.format(profiles[0]['id']))
-            return {profiles[0]['name']: profiles[0]['id']}, len(profiles)
+            log.debug('One quality profile detected, returned profile {}'.format(profiles[0].id))
+            return {profiles[0].name: profiles[0].id}, len(profiles)
 
         elif len(profiles) > 1:
             profile_names = {}
             for profile in profiles:
-                profile_names[profile['name']] = profile['id']
+                profile_names[profile.name] = profile.id
             log.debug('{} profiles found'.format(len(profiles)))
             return profile_names, len(profiles)
         else:
             log.debug('No profiles detected')
+            return {}, 0
+
+    @commands.command('add show', 'Adds show to sonarr, with several instances end with `in <instance>` to pick one')
+    def add_show_interaction(self, channel, args, sender):
+        """Look up the requested show and start the add show conversation"""
+        log.debug('Adding show')
+        show_parameter, requested = self.split_instance(args)
+        response = self.find_series(show_parameter)
+        if not response:
+            message = 'No shows found for `{}`'.format(show_parameter)
+            self.outbound.post(channel, message)
+            return
+
+        # typos & vague titles return many shows, offer the best ranked matches instead of asking to refine
+        response = response[:self.show_range[1]]
+        if self.posters is not None:
+            # downloaded while the user picks, confirm_show then finds the chosen one cached
+            self.posters.prefetch(show.poster for show in response)
+        state = {'channel': channel, 'sender': sender, 'response': response, 'show_number': 0,
+                 'requested': requested}
+
+        # if more than 1 show is returned provide a choice of what to subscribe to
+        if len(response) > 1:
+            log.debug('{} shows found, providing list choice'.format(len(response)))
+            self.offer_shows(state)
+        else:
+            self.confirm_show(state)
 
-    def confirm_show(self, show_number, json, sender):
-        show_list = self.sonarr_response_handler(json)
-        message = 'Do you want to subscribe to `{}`?'.format(show_list[show_number])
-        image_url = self.get_sonarr_poster(json, show_number=show_number)
+    def split_instance(self, text):
+        """'the wire in uk' to ('the wire', 'uk') when uk names an instance, else (text, None)"""
+        title, separator, name = text.rpartition(' in ')
+        names = dict((backend.lower(), backend) for backend in self.backends.names())
+        if separator and len(self.backends) > 1 and name.strip().lower() in names:
+            return title.strip(), names[name.strip().lower()]
+        return text, None
+
+    def find_series(self, query):
+        """
+        Rank shows from the local title index, the remote lookup is only used when nothing matches well.
+        Library titles are indexed too, hits that are all subscribed already still go to the lookup so the
+        other shows with that title can be offered.
+        """
+        shows = self.title_index.search(query, limit=self.show_range[1])
+        if shows and not all(self.subscribed(show['tvdbId']) for show in shows):
+            log.debug('Title index hit for {}'.format(query))
+            return Series.decode(shows)
+        response = self.sonarrAPI.lookup_series(query=query)
+        self.title_index.add_all(response)
+        return Series.decode(self.title_index.order(query, response))
+
+    def subscribed(self, tvdb_id):
+        return any(backend.library.find_by_tvdb(tvdb_id) for backend in self.backends)
+
+    def offer_shows(self, state):
+        """List the shows found and wait for the user to pick one by number"""
+        block = []
+        for index, show in enumerate(self.sonarr_response_handler(state['response'])):
+            block.append('({}) - {}'.format(str(index + 1), show))
+
+        message = 'The following shows were found: \n ```{}```\n ' \
+                  'Respond with the number next to the show to subscribe.'.format('\n'.join(block))
+        # listen before posting, the reply may arrive before post() returns
+        self.conversations.expect(state['sender'], state['channel'], self.choose_show_reply, state)
+        self.outbound.post(state['channel'], message)
+
+    def choose_show_reply(self, output, state):
+        log.debug('range choice add_show() user decision {}'.format(output))
+        if self.is_number_between(output['text'], start=self.show_range[0], end=len(state['response'])):
+            log.debug('User chose valid show number to add: {}'.format(output['text']))
+            state['show_number'] = int(output['text']) - 1
+            self.confirm_show(state)
+        else:
+            # re-try
+            self.offer_shows(state)
+
+    def confirm_show(self, state):
+        """Post the chosen show with its poster and wait for a yes"""
+        show_number = state['show_number']
+        show_list = self.sonarr_response_handler(state['response'])
+        backend = self.backends.route(state['response'][show_number], state.get('requested'))
+        state['backend'] = backend
+        existing = backend.library.find_by_tvdb(state['response'][show_number].tvdb_id)
+        if existing:
+            message = 'Already subscribed to `{}`{}'.format(existing[1], self.instance_label(backend))
+            self.outbound.post(state['channel'], message)
+            return
+        message = 'Do you want to subscribe to `{}`{}?'.format(show_list[show_number], self.instance_label(backend))
+        image_url = self.poster_url(self.get_sonarr_poster(state['response'], show_number=show_number))
         attachment = [
                         {
                         "title": show_list[show_number],
                         "image_url": "{}".format(image_url)
                         }
                     ]
-        self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True, attachments=attachment)
-
-        # listen for response and add show if response is yes
-        user_decision = self.listen_for_response(user_id=sender, channel=channel)
-        log.debug('Add show user decision slack response: {}'.format(user_decision))
+        self.conversations.expect(state['sender'], state['channel'], self.confirm_show_reply, state)
+        self.outbound.post(state['channel'], message, attachments=attachment)
 
-        if user_decision and user_decision['text'].lower() == 'yes':
+    def confirm_show_reply(self, output, state):
+        log.debug('Add show user decision slack response: {}'.format(output))
+        title = state['response'][state['show_number']].title
+        if output['text'].lower() == 'yes':
             log.info('User chose to subscribe')
-            message = 'Subscribing to `{}`...'.format(show_list[show_number])
-            result = True
-        elif user_decision:
-            log.info('User chose not to subscribe')
-            message = 'I did not subscribe to `{}`'.format(show_list[show_number])
-            result = False
+            message = 'Subscribing to `{}`...'.format(title)
+            self.outbound.post(state['channel'], message)
+            self.choose_quality_profile(state)
         else:
-            log.info('User did not respond')
-            message = 'No response detected...'
-            result = False
-
-        self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
-        return result
-
-    def add_show_interaction(self, channel, command, sender):
-        log.debug('Adding show')
-        try:
-        show_parameter = command.split(self.add_show_command)[1]
-        response = self.sonarrAPI.lookup_series(query=show_parameter)
-
-        shows = self.sonarr_response_handler(response)
-
-        # respond based on whether one or multiple shows were returned
-        show_range = [1, 4]
-
-        # if more than 1 show is returned provide a choice of what to subscribe to
-        if 1 < len(shows) <= show_range[1]:
-            log.debug('Less than 4 shows, providing list choice')
-            block = []
-            for index, show in enumerate(shows):
-                block.append('({}) - {}'.format(str(index + 1), show))
-
-            message = 'The following shows were found: \n ```{}```\n ' \
-                      'Respond with the number next to the show to subscribe.'.format('\n'.join(block))
-            self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
-
-            # listen for response and add show if number is returned
-            user_decision = self.listen_for_response(user_id=sender, channel=channel)
-            log.debug('range choice add_show() user decision {}'.format(user_decision))
-            if user_decision and \
-                    self.is_number_between(user_decision['text'], start=show_range[0], end=show_range[1]):
-                log.debug('User chose valid show number to add: {}'.format(user_decision['text']))
-
-                show_number = int(user_decision['text']) - 1
-                result = self.confirm_show(show_number=show_number, json=response, sender=sender)
-            else:
-                # re-try
-                self.add_show_interaction(channel, command, sender)
-
-        elif len(shows) > show_range[1]:
-            block = [x for x in shows]
-            message = 'The following shows were found: \n ```{}```\n Please refine your search.'.format(', '.join(block))
-            # post to slack
-            self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
-            result = False
-            show_number = 0
-
-        else:
-            show_number = 0
-            result = self.confirm_show(show_number=show_number, json=response, sender=sender)
+            log.info('User chose not to subscribe')
+            message = 'I did not subscribe to `{}`'.format(title)
+            self.outbound.post(state['channel'], message)
 
-        # choose quality profile if necessary
-        quality_profiles, profile_count = self.get_quality_names()
+    def choose_quality_profile(self, state):
+        """choose quality profile if necessary"""
+        quality_profiles, profile_count = self.get_quality_names(state['backend'])
 
         if profile_count > 1:
-            # choose profile
+            state['profiles'] = quality_profiles
             message = "Please choose a quality profile to use, here are your options: \n ```{}``` \n " \
                       "paste the name of the profile you choose and I'll select it"\
                         .format(', '.join([key for key, value in quality_profiles.items() ]))
-            self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
-
-            user_decision = self.listen_for_response(user_id=sender, channel=channel)
-            log.info('user chose {}'.format(user_decision))
-
-            if user_decision['text'] in [key for key, value in quality_profiles.items()]:
-                quality_profile_id = quality_profiles[user_decision['text']]
-
-            else:
-                # error message and retry
-                self.slack_client.api_call("chat.postMessage", channel=channel,
-                                           text='invalid entry, try again', as_user=True)
-        else:
+            self.conversations.expect(state['sender'], state['channel'], self.choose_profile_reply, state)
+            self.outbound.post(state['channel'], message)
+        elif profile_count == 1:
             # default to one quality profile if there is only one
-            quality_profile_name = [key for key, value in quality_profiles.items()][0]
-            quality_profile_id = [value for key, value in quality_profiles.items()][0]
+            quality_profile_name, quality_profile_id = list(quality_profiles.items())[0]
             log.debug('Discovered one quality profile: {}'.format(quality_profile_name))
+            self.add_show(state, quality_profile_id)
+        else:
+            self.outbound.post(state['channel'], 'No quality profiles found in Sonarr')
+
+    def choose_profile_reply(self, output, state):
+        log.info('user chose {}'.format(output))
+        if output['text'] in state['profiles']:
+            self.add_show(state, state['profiles'][output['text']])
+        else:
+            # error message and retry
+            self.conversations.expect(state['sender'], state['channel'], self.choose_profile_reply, state)
+            self.outbound.post(state['channel'], 'invalid entry, try again')
 
-        return result, response[show_number], quality_profile_id
-
-    def add_show(self, channel, command, sender):
-        try
-            result, show_dict, quality_profile_id = self.add_show_interaction(channel, command, sender)
-            series_id = show_dict['tvdbId']
-            if result:
-                log.info('Adding {} to Sonarr'.format(show_dict['title']))
-                series_json = self.sonarrAPI.constuct_series_json(tvdbId=series_id, quality_profile=quality_profile_id)
-                self.sonarrAPI.add_series()
-                message = 'Successfully subcribed to {}'.format(show_dict['title'])
-                self.slack_client.api_call("chat.postMessage", channel=channel, text=message, as_user=True)
+    def add_show(self, state, quality_profile_id):
+        show = state['response'][state['show_number']]
+        backend = state['backend']
+        try:
+            log.info('Adding {} to Sonarr {}'.format(show.title, backend.name))
+            series_json = backend.api.series_json(show.to_json(), quality_profile=quality_profile_id)
+            backend.library.upsert(backend.api.add_series(series_json))
+            message = 'Successfully subcribed to {}'.format(show.title)
         except Exception:
             log.info('Show addition error', exc_info=True)
-            continue
+            message = 'Could not subscribe to {}'.format(show.title)
+        self.outbound.post(state['channel'], message)
+
+    def resolve_series(self, query):
+        """find_series for the batch pool, a failed lookup counts as not found"""
+        try:
+            return self.find_series(query)
+        except Exception:
+            log.info('Lookup of {} failed'.format(query), exc_info=True)
+            return []
+
+    @commands.command('add shows', 'Adds several shows at once, separate titles with `;` or new lines '
+                                   'e.g. `add shows atlanta; fargo`')
+    def add_shows_interaction(self, channel, args, sender):
+        """Resolve a list of shows concurrently and confirm them all in one message"""
+        titles = [title.strip() for title in re.split(r'[;\n]', args) if title.strip()]
+        if not titles:
+            self.outbound.post(channel, 'Which shows? e.g. `add shows atlanta; fargo`')
+            return
+
+        shows, missing, existing = [], [], []
+        for title, response in zip(titles, self.batch_pool.map(self.resolve_series, titles)):
+            if not response:
+                missing.append(title)
+                continue
+            backend = self.backends.route(response[0])
+            if backend.library.find_by_tvdb(response[0].tvdb_id):
+                existing.append(response[0].title)
+            elif response[0].tvdb_id not in [show.tvdb_id for show, _ in shows]:
+                shows.append((response[0], backend))
+
+        block = ['({}) - {}{}'.format(index + 1, show.title, self.instance_label(backend))
+                 for index, (show, backend) in enumerate(shows)]
+        notes = []
+        if existing:
+            notes.append('Already subscribed to: {}'.format(', '.join(existing)))
+        if missing:
+            notes.append('No shows found for: {}'.format(', '.join(missing)))
+        if not shows:
+            self.outbound.post(channel, '\n'.join(notes))
+            return
+
+        quality_profiles, profile_count = self.get_quality_names()
+        if not profile_count:
+            self.outbound.post(channel, 'No quality profiles found in Sonarr')
+            return
+        default_profile = list(quality_profiles)[0]
+        message = 'The following shows were found: \n ```{}```\n {}'.format('\n'.join(block), '\n'.join(notes))
+        message += '\nRespond `yes` to subscribe to all of them with quality profile `{}`'.format(default_profile)
+        if profile_count > 1:
+            message += ' or with the name of another profile: {}'.format(', '.join(list(quality_profiles)[1:]))
+        state = {'channel': channel, 'sender': sender, 'shows': shows, 'profiles': quality_profiles,
+                 'default_profile': default_profile}
+        self.conversations.expect(sender, channel, self.confirm_shows_reply, state)
+        self.outbound.post(channel, message)
+
+    def confirm_shows_reply(self, output, state):
+        log.debug('Add shows user decision slack response: {}'.format(output))
+        text = output['text'].strip()
+        if text.lower() == 'yes':
+            self.add_shows(state, state['default_profile'])
+        elif text in state['profiles']:
+            self.add_shows(state, text)
+        else:
+            self.outbound.post(state['channel'], 'I did not subscribe to any of those shows')
+
+    def add_shows(self, state, profile_name):
+        """
+        Submit every add_series call in parallel, root folder & quality profiles are fetched once per instance.
+        Profile ids differ between instances so the chosen profile is matched by name, an instance without it
+        falls back to its first profile.
+        """
+        targets = {}
+        for backend in set(backend for _, backend in state['shows']):
+            profiles = state['profiles'] if backend is self.backends.default else self.get_quality_names(backend)[0]
+            profile_id = profiles.get(profile_name, next(iter(profiles.values()), None))
+            targets[backend] = (backend.api.get_root_folder(typed=True)[0].path, profile_id)
+
+        def add(entry):
+            show, backend = entry
+            root, quality_profile_id = targets[backend]
+            try:
+                series_json = backend.api.series_json(show.to_json(), quality_profile_id, root=root)
+                backend.library.upsert(backend.api.add_series(series_json))
+                return '{} - subscribed{}'.format(show.title, self.instance_label(backend))
+            except Exception:
+                log.info('Show addition error for {}'.format(show.title), exc_info=True)
+                return '{} - failed{}'.format(show.title, self.instance_label(backend))
+
+        results = list(self.batch_pool.map(add, state['shows']))
+        message = 'Subscription results:\n```{}```'.format('\n'.join(results))
+        self.outbound.post(state['channel'], message)
 
     def get_bot_id(self):
-        """get slack user id for bot"""
-        bot_id = None
-        users = self.slack_client.api_call("users.list")
-        for user in users['members']:
-            if user['name'] == self.bot_name:
-                bot_id = user['id']
-                log.debug('Bot_ID found for: {} with id: {}'.format(self.bot_name, bot_id))
-                break
-        if not bot_id: log.debug('Bot_ID not found with name: {}'.format(self.bot_name))
+        """get slack user id for bot, from the identity cache, else auth.test, else a paged search of users"""
+        key = hashlib.sha1('{}|{}'.format(settings.SLACK_KEY, self.bot_name).encode('utf-8')).hexdigest()
+        cache = self.read_identity_cache()
+        bot_id = cache.get(key)
+        if bot_id:
+            log.debug('Bot_ID cached for: {} with id: {}'.format(self.bot_name, bot_id))
+            return bot_id
+
+        identity = self.slack_client.api_call('auth.test')
+        if identity.get('ok'):
+            bot_id = identity['user_id']
+        else:
+            log.debug('auth.test failed: {}, searching users'.format(identity.get('error')))
+            bot_id = next((user['id'] for user in self.iter_users() if user['name'] == self.bot_name), None)
+        if not bot_id:
+            log.debug('Bot_ID not found with name: {}'.format(self.bot_name))
+            return None
+        log.debug('Bot_ID found for: {} with id: {}'.format(self.bot_name, bot_id))
+        cache[key] = bot_id
+        self.write_identity_cache(cache)
         return bot_id
 
-    def help(self):
-        """help command"""
-        methods = {}
-        methods[self.get_shows_command] = self.get_shows_definition
-        methods[self.add_show_command] = self.add_show_definition
+    def iter_users(self, page_size=200):
+        """Workspace members a page at a time, stop iterating and no further pages are requested"""
+        cursor = None
+        while True:
+            response = self.slack_client.api_call('users.list', limit=page_size, cursor=cursor)
+            if not response.get('ok'):
+                log.warning('users.list failed: {}'.format(response.get('error')))
+                return
+            for user in response.get('members', []):
+                yield user
+            cursor = (response.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return
+
+    @staticmethod
+    def read_identity_cache():
+        if not settings.SLACK_IDENTITY_CACHE:
+            return {}
+        try:
+            with open(settings.SLACK_IDENTITY_CACHE) as cache:
+                return json.load(cache)
+        except (IOError, ValueError):
+            return {}
 
+    @staticmethod
+    def write_identity_cache(cache):
+        if not settings.SLACK_IDENTITY_CACHE:
+            return
+        try:
+            with open(settings.SLACK_IDENTITY_CACHE, 'w') as out:
+                json.dump(cache, out)
+        except IOError:
+            log.debug('Could not write {}'.format(settings.SLACK_IDENTITY_CACHE), exc_info=True)
+
+    @commands.command('help')
+    def help(self, channel, args=None, sender=None):
+        """help command"""
         block = []
-        for command, definition in methods.items():
+        for command, definition in self.commands.help():
             block.append("`{}` - {}".format(command, definition))
         response = "Here is what I can do: \n{}".format('\n'.join(block))
 
-        self.slack_client.api_call("chat.postMessage", channel=channel, text=response, as_user=True)
+        self.outbound.post(channel, response)
+
+    @commands.command('get shows', 'Posts message showing which shows & seasons are already subscribed in Sonarr, '
+                                   'add a title to filter e.g. `get shows breaking`')
+    def get_shows_command(self, channel, args, sender):
+        self.get_shows(channel=channel, query=args or None)
+
+    @commands.command('get history', 'Posts the most recent grabs, add a number for more e.g. `get history 50`')
+    def get_history_command(self, channel, args, sender):
+        self.get_history(channel=channel, count=int(args) if args.isdigit() else self.history_limit[0])
+
+    @commands.command('get missing', 'Posts episodes that aired this week but have not been downloaded, '
+                                     'add a title for everything missing from one show e.g. `get missing fargo`')
+    def get_missing_command(self, channel, args, sender):
+        self.get_missing(channel=channel, query=args or None)
+
+    @commands.command('get airing', 'Posts subscribed episodes airing today', exact=True)
+    def get_airing_command(self, channel, args, sender):
+        self.get_airing(channel=channel)
+
+    # subscriptions & queue watches belong to the process running the scheduler & webhooks
+    @commands.command('subscribe', 'Posts Sonarr grab, download, upgrade & rename notifications in this channel',
+                      exact=True, inline=True)
+    def subscribe_command(self, channel, args, sender):
+        self.subscribe(channel=channel, subscribed=True)
+
+    @commands.command('unsubscribe', 'Stops Sonarr notifications in this channel', exact=True, inline=True)
+    def unsubscribe_command(self, channel, args, sender):
+        self.subscribe(channel=channel, subscribed=False)
+
+    @commands.command('queue', 'Shows the download queue in one message kept up to date while it downloads',
+                      exact=True, inline=True)
+    def queue_command(self, channel, args, sender):
+        self.queue_tracker.watch(channel)
+
+    @commands.command('refresh', 'Refreshes show info from TVDB & rescans its files e.g. `refresh fargo`, '
+                                 'every show without a title')
+    def refresh_command(self, channel, args, sender):
+        self.series_command(channel, args, 'RefreshSeries', 'refreshing')
+
+    @commands.command('rescan', 'Rescans the files of a show on disk e.g. `rescan fargo`, every show without a title')
+    def rescan_command(self, channel, args, sender):
+        self.series_command(channel, args, 'RescanSeries', 'rescanning')
+
+    @commands.command('search missing', 'Searches for every missing episode of a show at once '
+                                        'e.g. `search missing fargo`')
+    def search_missing_command(self, channel, args, sender):
+        self.search_missing(channel, args)
+
+    @commands.command('unmonitor ended', 'Stops monitoring every show that has ended', exact=True)
+    def unmonitor_ended_command(self, channel, args, sender):
+        self.unmonitor_ended(channel)
+
+    @commands.command('monitor', 'Monitors every episode of a season e.g. `monitor fargo season 2`')
+    def monitor_command(self, channel, args, sender):
+        self.monitor_season(channel, args, monitored=True)
+
+    @commands.command('unmonitor', 'Stops monitoring every episode of a season e.g. `unmonitor fargo season 2`')
+    def unmonitor_command(self, channel, args, sender):
+        self.monitor_season(channel, args, monitored=False)
+
+    @commands.command('stats', 'Posts command timings, Sonarr & Slack latency and cache & queue depths', exact=True)
+    def stats_command(self, channel, args, sender):
+        self.stats(channel=channel)
 
     def handle_command(self, channel, command, sender):
         """
@@ -274,60 +934,72 @@ class Bot(object):
             returns back what it needs for clarification.
         """
         log.debug('Handling command: {} in channel: {}'.format(command, channel))
-        if command.startswith(self.help_command):
-            self.help()
-        elif command.lower() == self.get_shows_command:
-            self.get_shows(channel=channel)
-
-        elif command.lower().startswith(self.add_show_command):
-            self.add_show(channel=channel, command=command, sender=sender)
-
-        elif command.lower() == 'quality_profiles':
-            self.test_sn_command(channel=channel, command=command, sender=sender)
-
-        else:
-            pass
+        started = time.monotonic()
+        name = self.commands.dispatch(self, channel, command, sender)
+        if name:
+            self.metrics.observe('bot_command_seconds', time.monotonic() - started, command=name)
 
-    def test_sn_command(self, channel, command, sender):
+    def runs_inline(self, command):
+        """Whether a command stays in the front process when the others go to worker processes"""
+        found, args = self.commands.match(command)
+        return found is not None and found.inline
 
-        if command.lower() == 'quality_profiles':
-            log.info('Getting quality profiles')
-            response = self.sonarrAPI.get_quality_profiles()
-            pprint.pprint(response)
-            self.slack_client.api_call("chat.postMessage", channel=channel, text=response, as_user=True)
-        else:
-            log.info('{} command not added yet'.format(command))
-            pass
+    @commands.command('quality_profiles', exact=True)
+    def test_sn_command(self, channel, args, sender):
+        log.info('Getting quality profiles')
+        response = self.sonarrAPI.get_quality_profiles()
+        self.outbound.post(channel, pprint.pformat(response))
 
 
 def parse_slack_output(slack_rtm_output, AT_BOT):
     """
         The Slack Real Time Messaging API is an events firehose.
-        this parsing function returns None unless a message is
+        Yields (command, channel, sender) for every message in the batch
         directed at the Bot, based on its ID.
     """
-    output_list = slack_rtm_output
-    if output_list and len(output_list) > 0:
-        for output in output_list:
-            if output and 'text' in output and AT_BOT in output['text']:
-                # return text after the @ mention, whitespace removed
-                print(output)
-                command = output['text'].split(AT_BOT)[1].strip().lower()
-                channel = output['channel']
-                sender = output['user']
-                return command, channel, sender
+    for output in slack_rtm_output:
+        # typing, presence & read markers make up most of the firehose and carry no text
+        text = output.get('text')
+        if not text or AT_BOT not in text or output.get('type', 'message') != 'message':
+            continue
+        if 'user' not in output or 'channel' not in output:
+            # bot_message & other subtypes mention us without a user to answer
+            continue
+        # return text after the @ mention, whitespace removed
+        log.debug('Command event: {}'.format(output))
+        yield text.partition(AT_BOT)[2].strip(), output['channel'], output['user']
+
 
-    return None, None, None
+def worker_bot():
+    """Bot for a worker process, see settings.BOT_PROCESSES"""
+    atexit.register(settings.configure_logging().stop)
+    return Bot(worker=True)
 
 
 if __name__ == "__main__":
+    atexit.register(settings.configure_logging().stop)
     log.info('Initializing bot')
+    if settings.BOT_PROCESSES and settings.LIBRARY_DB == ':memory:':
+        # workers read the front's library mirror so it has to be a file, spawned workers inherit the environment
+        settings.LIBRARY_DB = os.environ['LIBRARY_DB'] = os.path.join(tempfile.mkdtemp(prefix='sonarr-bot-'),
+                                                                      'library.db')
     bot = Bot()
-
-    while True:
-        command, channel, sender = parse_slack_output(bot.slack_client.rtm_read(), bot.at_bot)
-        if command and channel: bot.handle_command(channel, command, sender)
-        time.sleep(bot.websocket_delay)
+    bot.schedule(Scheduler()).start()
+    services = []
+    if settings.WEBHOOK_PORT:
+        services.append(WebhookReceiver(bot.on_webhook_batch, host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT,
+                                        token=settings.WEBHOOK_TOKEN))
+    if settings.METRICS_PORT:
+        services.append(MetricsServer(host=settings.METRICS_HOST, port=settings.METRICS_PORT))
+    if settings.POSTER_PORT and bot.posters is not None:
+        services.append(PosterServer(bot.posters, host=settings.POSTER_HOST, port=settings.POSTER_PORT))
+    if settings.BOT_PROCESSES:
+        # fill the mirror before workers read it, the scheduled refresh only comes after LIBRARY_MAX_AGE
+        bot.backends.gather(lambda backend: backend.library.refresh())
+    workers = WorkerPool(settings.BOT_PROCESSES, worker_bot, parse_slack_output, threads=settings.BOT_WORKERS,
+                         drain_timeout=settings.BOT_DRAIN_TIMEOUT) if settings.BOT_PROCESSES else None
+    Runtime(bot, parse=parse_slack_output, max_workers=settings.BOT_WORKERS, services=services,
+            workers=workers).run()
 
 
 #screen -dmS sbot bash -c 'python ~/files/code/sonarr_bot/bot.py'
\ No newline at end of file
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# seconds, the prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint(path):
+    """Collapse ids in a request path so /series/12 and /series/13 share one time series"""
+    return ID_SEGMENT.sub('/{id}', path)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for key, value in labels))
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate from the buckets, interpolating linearly inside the bucket the quantile falls in"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                if seen + count >= rank and count:
+                    lower = self.buckets[index - 1] if index else 0.0
+                    upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                    return lower + (upper - lower) * (rank - seen) / count
+                seen += count
+            return self.buckets[-1]
+
+    def samples(self):
+        with self._lock:
+            cumulative, total = [], 0
+            for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+                total += count
+                cumulative.append((bound, total))
+            return cumulative, self.count, self.sum
+
+
+class Registry(object):
+    """
+    Process wide metrics: histograms and counters keyed by name & labels, plus gauges read from callables
+    when rendered. render() produces the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> float
+        self.gauges = {}  # name -> callable returning a number
+        self.help = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def inc(self, name, amount=1, **labels):
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, function, text=None):
+        """function() is called on every render, a failing gauge is skipped"""
+        self.gauges[name] = function
+        if text:
+            self.help[name] = text
+
+    def histogram(self, name, **labels):
+        return self.histograms.get(self.key(name, labels))
+
+    def series(self, name):
+        """[(labels dict, Histogram)] for every label set recorded under name"""
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+        return [(dict(labels), histogram) for (metric, labels), histogram in histograms if metric == name]
+
+    def summary(self, name, *label_names):
+        """[(label values joined by spaces, count, p50 seconds, p95 seconds)] busiest first"""
+        rows = [(' '.join(str(labels.get(label, '')) for label in label_names), histogram.count,
+                 histogram.quantile(0.5), histogram.quantile(0.95)) for labels, histogram in self.series(name)]
+        return sorted(rows, key=lambda row: -row[1])
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            counters = sorted(self.counters.items())
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self.help:
+                    lines.append('# HELP {} {}'.format(name, self.help[name]))
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            cumulative, count, total = histogram.samples()
+            for bound, value in cumulative:
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', le),)), value))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), total))
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for name, function in sorted(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                log.debug('Gauge {} failed'.format(name), exc_info=True)
+                continue
+            header(name, 'gauge')
+            lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_registry():
+    """Shared registry the transport, outbound queue & bot record into"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Registry()
+        return _default
+
+
+class MetricsServer(object):
+    """Serves GET /metrics in the Prometheus text format, runs as a runtime service like the webhook receiver"""
+
+    def __init__(self, registry=None, host='127.0.0.1', port=9464, path='/metrics'):
+        self.registry = registry or default_registry()
+        self.host = host
+        self.port = port
+        self.path = path
+        self.server = None
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2] if self.server else None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        log.info('Serving metrics on {}:{}{}'.format(self.address[0], self.address[1], self.path))
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request_line) != 3 or request_line[1].split('?')[0] != self.path:
+                status, body = '404 Not Found', b''
+            elif request_line[0] != 'GET':
+                status, body = '405 Method Not Allowed', b''
+            else:
+                # gauges may take locks & query SQLite, the event loop keeps serving Slack meanwhile
+                text = await asyncio.get_event_loop().run_in_executor(None, self.registry.render)
+                status, body = '200 OK', text.encode('utf-8')
+            writer.write('HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'.format(status, len(body)).encode() + body)
+            await writer.drain()
+        except Exception:
+            log.warning('Metrics request failed', exc_info=True)
+        finally:
+            writer.close()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib decoder is used without it
+    orjson = None
+
+
+def loads(data):
+    """Decode a response body, orjson when it is installed otherwise the stdlib json module"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+class Model(object):
+    """
+    Base for the Sonarr payload models.
+    FIELDS maps slot names to Sonarr json keys, everything else in the payload (images we never show,
+    statistics, ratings, alternate titles...) is dropped as soon as the model is built.
+    Models can also be read like the payload dict, model['seasonNumber'] or model.get('title'), so code written
+    against the raw json keeps working.
+    """
+    __slots__ = ()
+    FIELDS = ()  # ((slot, json key), ...)
+
+    def __init__(self, **values):
+        for slot in self.__slots__:
+            setattr(self, slot, values.get(slot))
+
+    @classmethod
+    def from_json(cls, raw):
+        model = cls.__new__(cls)
+        for slot, key in cls.FIELDS:
+            setattr(model, slot, raw.get(key))
+        return model
+
+    @classmethod
+    def decode(cls, raw):
+        """A model for a json object, a lazily built sequence of models for a json array"""
+        if isinstance(raw, list):
+            return Models(cls, raw)
+        return cls.from_json(raw)
+
+    def to_json(self):
+        return dict((key, getattr(self, slot)) for slot, key in self.FIELDS)
+
+    def get(self, key, default=None):
+        for slot, name in self.FIELDS:
+            if name == key:
+                value = getattr(self, slot)
+                return default if value is None else value
+        return default
+
+    def __getitem__(self, key):
+        for slot, name in self.FIELDS:
+            if name == key:
+                return getattr(self, slot)
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, slot) == getattr(other, slot)
+                                                 for slot, key in self.FIELDS)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        shown = [slot for slot in ('id', 'title', 'name', 'path') if slot in self.__slots__]
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join('{}={!r}'.format(slot, getattr(self, slot)) for slot in shown))
+
+
+class Models(object):
+    """Read-only sequence over a decoded json array, each element becomes a model on first access"""
+    __slots__ = ('model', '_raw', '_built')
+
+    def __init__(self, model, raw):
+        self.model = model
+        self._raw = raw
+        self._built = [None] * len(raw)
+
+    def __len__(self):
+        return len(self._built)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        built = self._built[index]
+        if built is None:
+            built = self._built[index] = self.model.from_json(self._raw[index])
+            # release the payload, only the fields the model keeps stay alive
+            self._raw[index] = None
+        return built
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __bool__(self):
+        return bool(self._built)
+
+    def __repr__(self):
+        return 'Models({}, {})'.format(self.model.__name__, len(self))
+
+
+class Season(Model):
+    __slots__ = ('number', 'monitored')
+    FIELDS = (('number', 'seasonNumber'), ('monitored', 'monitored'))
+
+
+class Image(Model):
+    __slots__ = ('cover_type', 'url')
+    FIELDS = (('cover_type', 'coverType'), ('url', 'url'))
+
+
+class Series(Model):
+    __slots__ = ('id', 'tvdb_id', 'title', 'title_slug', 'year', 'status', 'monitored', 'path',
+                 'quality_profile_id', 'seasons', 'images', 'last_info_sync', 'episode_count',
+                 'episode_file_count', 'total_episode_count', 'genres', 'network', 'series_type')
+    FIELDS = (('id', 'id'), ('tvdb_id', 'tvdbId'), ('title', 'title'), ('title_slug', 'titleSlug'),
+              ('year', 'year'), ('status', 'status'), ('monitored', 'monitored'), ('path', 'path'),
+              ('quality_profile_id', 'qualityProfileId'), ('seasons', 'seasons'), ('images', 'images'),
+              ('last_info_sync', 'lastInfoSync'), ('episode_count', 'episodeCount'),
+              ('episode_file_count', 'episodeFileCount'), ('total_episode_count', 'totalEpisodeCount'),
+              ('genres', 'genres'), ('network', 'network'), ('series_type', 'seriesType'))
+
+    @classmethod
+    def from_json(cls, raw):
+        model = super(Series, cls).from_json(raw)
+        # seasons carry a statistics block each, only number & monitored are kept
+        model.seasons = tuple(Season.from_json(season) for season in raw.get('seasons') or ())
+        model.images = tuple(Image.from_json(image) for image in raw.get('images') or ())
+        return model
+
+    def to_json(self):
+        data = super(Series, self).to_json()
+        data['seasons'] = [season.to_json() for season in self.seasons]
+        data['images'] = [image.to_json() for image in self.images]
+        return dict((key, value) for key, value in data.items() if value is not None)
+
+    @property
+    def poster(self):
+        """Poster url, the first image when there is no poster, '' without images"""
+        for image in self.images:
+            if image.cover_type == 'poster':
+                return image.url
+        return self.images[0].url if self.images else ''
+
+    def monitored_seasons(self):
+        return [season.number for season in self.seasons if season.monitored]
+
+
+class Episode(Model):
+    __slots__ = ('id', 'series_id', 'season_number', 'episode_number', 'title', 'air_date', 'has_file',
+                 'monitored')
+    FIELDS = (('id', 'id'), ('series_id', 'seriesId'), ('season_number', 'seasonNumber'),
+              ('episode_number', 'episodeNumber'), ('title', 'title'), ('air_date', 'airDate'),
+              ('has_file', 'hasFile'), ('monitored', 'monitored'))
+
+
+class QualityProfile(Model):
+    __slots__ = ('id', 'name')
+    FIELDS = (('id', 'id'), ('name', 'name'))
+
+
+class RootFolder(Model):
+    __slots__ = ('id', 'path', 'free_space')
+    FIELDS = (('id', 'id'), ('path', 'path'), ('free_space', 'freeSpace'))
+
+
+class QueueItem(Model):
+    __slots__ = ('id', 'status', 'size', 'sizeleft', 'series_title', 'episode')
+    FIELDS = (('id', 'id'), ('status', 'status'), ('size', 'size'), ('sizeleft', 'sizeleft'),
+              ('episode', 'episode'))
+
+    @classmethod
+    def from_json(cls, raw):
+        model = super(QueueItem, cls).from_json(raw)
+        # the embedded series is a full series object, only its title is shown
+        model.series_title = (raw.get('series') or {}).get('title')
+        model.episode = Episode.from_json(raw.get('episode') or {})
+        return model
+
+    @property
+    def progress(self):
+        """Percent downloaded"""
+        if not self.size:
+            return 0
+        return 100 * (1 - (self.sizeleft or 0) / float(self.size))
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from metrics import default_registry
+
+log = logging.getLogger(__name__)
+
+# sustained calls per second and burst size per Web API method, see https://api.slack.com/docs/rate-limits
+DEFAULT_RATES = {
+    'chat.postMessage': (1.0, 3),
+    'chat.update': (50 / 60.0, 5),
+    'default': (20 / 60.0, 3),
+}
+# methods Slack limits per channel, every other rate is shared by the whole workspace
+PER_CHANNEL = ('chat.postMessage',)
+# slack truncates messages past 40k characters and renders anything over ~4k poorly
+MAX_LENGTH = 3500
+CODE_FENCE = '```'
+
+
+def chunk_text(text, max_length=MAX_LENGTH):
+    """Split text on line boundaries into pieces no longer than max_length, code blocks are closed & reopened"""
+    if len(text) <= max_length:
+        return [text]
+    # every chunk may need to reopen and close a code block
+    room = max_length - 2 * len(CODE_FENCE)
+    chunks = []
+    current = ''
+    in_code = False
+    for line in text.split('\n'):
+        for piece in [line[i:i + room] for i in range(0, max(len(line), 1), room)]:
+            candidate = piece if not current else current + '\n' + piece
+            if len(candidate) > room and current:
+                chunks.append(current + (CODE_FENCE if in_code else ''))
+                current = (CODE_FENCE if in_code else '') + piece
+            else:
+                current = candidate
+            if piece.count(CODE_FENCE) % 2:
+                in_code = not in_code
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0
+
+    def wait_time(self):
+        """Seconds until a call may be made, 0 when a token is available"""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Honour Retry-After, nothing is sent on this method until it passes"""
+        self.blocked_until = self.clock() + seconds
+        self.tokens = 0
+
+
+class Message(object):
+    __slots__ = ('method', 'channel', 'kwargs', 'futures', 'queued')
+
+    def __init__(self, method, channel, kwargs, queued):
+        self.method = method
+        self.channel = channel
+        self.kwargs = kwargs
+        self.futures = [Future()]
+        self.queued = queued
+
+    def coalescable(self):
+        return self.method == 'chat.postMessage' and set(self.kwargs) <= {'channel', 'text', 'as_user'}
+
+
+class Outbound(object):
+    """
+    Background sender for Slack Web API calls.
+    Calls are queued per channel, adjacent plain messages to a channel are coalesced, oversized text is chunked,
+    and each method is paced by a token bucket that also honours Retry-After on ratelimited responses, posts get
+    one bucket per channel like Slack's own limit.
+    """
+
+    def __init__(self, slack_client, max_length=MAX_LENGTH, rates=None, clock=time.monotonic, metrics=None):
+        self.slack_client = slack_client
+        self.metrics = metrics or default_registry()
+        self.metrics.describe('slack_api_seconds', 'Slack Web API call time')
+        self.metrics.describe('slack_send_seconds', 'Time from queueing a Slack call until it was answered')
+        self.metrics.gauge('slack_outbound_depth', self.depth, 'Slack calls waiting to be sent')
+        self.max_length = max_length
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.clock = clock
+        self.buckets = {}
+        self.queues = {}  # channel -> deque of Message
+        self.ready = deque()  # channels with queued messages, round robin
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = True
+        self._inflight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.ratelimited = 0
+
+    # QUEUEING
+    def post(self, channel, text, **kwargs):
+        """Queue chat.postMessage, returns a Future for the response of the (last) chunk"""
+        kwargs.setdefault('as_user', True)
+        future = None
+        for chunk in chunk_text(text, self.max_length):
+            future = self.call('chat.postMessage', channel=channel, text=chunk, **kwargs)
+        return future
+
+    def call(self, method, channel=None, **kwargs):
+        """Queue any Web API call, calls for the same channel are sent in order"""
+        if channel is not None:
+            kwargs['channel'] = channel
+        message = Message(method, channel, kwargs, self.clock())
+        with self._condition:
+            queue = self.queues.get(channel)
+            if queue is None:
+                queue = self.queues[channel] = deque()
+            if not queue:
+                self.ready.append(channel)
+            queue.append(message)
+            self._condition.notify()
+        return message.futures[0]
+
+    def depth(self):
+        with self._condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+    # WORKER
+    def start(self):
+        with self._condition:
+            if not self._stopped:
+                return self
+            self._stopped = False
+        self._thread = threading.Thread(target=self._work, name='slack-outbound', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, drain=True, timeout=10):
+        if drain:
+            self.flush(timeout)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far has been sent"""
+        deadline = self.clock() + timeout
+        with self._condition:
+            while (self.ready or self._inflight) and self.clock() < deadline:
+                self._condition.wait(0.05)
+
+    def bucket(self, method, channel=None):
+        key = (method, channel) if method in PER_CHANNEL else method
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate, capacity = self.rates.get(method, self.rates['default'])
+            bucket = self.buckets[key] = TokenBucket(rate, capacity, clock=self.clock)
+        return bucket
+
+    def _next(self):
+        """Pop the next sendable message, coalescing plain posts queued behind it for the same channel"""
+        with self._condition:
+            while not self._stopped:
+                wait = None
+                for _ in range(len(self.ready)):
+                    channel = self.ready[0]
+                    message = self.queues[channel][0]
+                    delay = self.bucket(message.method, channel).wait_time()
+                    if delay == 0:
+                        self.ready.popleft()
+                        return self._take(channel)
+                    wait = delay if wait is None else min(wait, delay)
+                    self.ready.rotate(-1)
+                self._condition.wait(wait)
+        return None
+
+    def _take(self, channel):
+        queue = self.queues[channel]
+        message = queue.popleft()
+        if message.coalescable():
+            while queue and queue[0].coalescable() and \
+                    len(message.kwargs['text']) + len(queue[0].kwargs['text']) + 1 <= self.max_length:
+                following = queue.popleft()
+                message.kwargs['text'] += '\n' + following.kwargs['text']
+                message.futures.extend(following.futures)
+                self.coalesced += 1
+        if queue:
+            self.ready.append(channel)
+        self.bucket(message.method, channel).take()
+        self._inflight += 1
+        return message
+
+    def _requeue(self, message):
+        with self._condition:
+            queue = self.queues[message.channel]
+            if not queue:
+                self.ready.append(message.channel)
+            queue.appendleft(message)
+            self._inflight -= 1
+            self._condition.notify()
+
+    def _work(self):
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            started = self.clock()
+            try:
+                response = self.slack_client.api_call(message.method, **message.kwargs)
+            except Exception as error:
+                log.warning('Slack {} failed'.format(message.method), exc_info=True)
+                for future in message.futures:
+                    future.set_exception(error)
+                self._done()
+                continue
+            if response.get('error') == 'ratelimited':
+                headers = response.get('headers', {})
+                retry_after = float(headers.get('Retry-After') or headers.get('retry-after') or 1)
+                log.info('Slack rate limited {}, retrying in {}s'.format(message.method, retry_after))
+                self.ratelimited += 1
+                self.metrics.inc('slack_ratelimited_total', method=message.method)
+                with self._condition:
+                    self.bucket(message.method, message.channel).block(retry_after)
+                self._requeue(message)
+                continue
+            self.sent += 1
+            now = self.clock()
+            self.metrics.observe('slack_api_seconds', now - started, method=message.method)
+            self.metrics.observe('slack_send_seconds', now - message.queued, method=message.method)
+            for future in message.futures:
+                future.set_result(response)
+            self._done()
+
+    def _done(self):
+        with self._condition:
+            self._inflight -= 1
+            self._condition.notify_all()
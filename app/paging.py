@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def iter_pages(fetch, page_size=50, prefetch=True):
+    """
+    Yields records from a Sonarr paged endpoint one at a time.
+    fetch(page, page_size) returns the page json ({page, pageSize, totalRecords, records}),
+    with prefetch the next page is requested while the current one is being consumed.
+    Only one or two pages are ever held in memory, stopping early never fetches the rest.
+    """
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    page = 1
+    pending = executor.submit(fetch, page, page_size) if executor else None
+    try:
+        while True:
+            data = pending.result() if executor else fetch(page, page_size)
+            records = data.get('records') or []
+            has_more = len(records) == page_size and page * page_size < data.get('totalRecords', 0)
+            if has_more and executor:
+                pending = executor.submit(fetch, page + 1, page_size)
+            for record in records:
+                yield record
+            if not has_more:
+                return
+            page += 1
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def parse_date(value):
+    """Sonarr timestamps look like 2017-01-26T01:30:00Z, fractions of a second are dropped"""
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def as_datetime(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return parse_date(value)
+
+
+def within(records, key, since=None, until=None):
+    """
+    Filters records sorted newest first by the date in record[key].
+    Stops at the first record older than since so the remaining pages are never fetched.
+    """
+    since, until = as_datetime(since), as_datetime(until)
+    for record in records:
+        when = parse_date(record[key])
+        if until is not None and when > until:
+            continue
+        if since is not None and when < since:
+            return
+        yield record
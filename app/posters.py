@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from singleflight import SingleFlight
+from transport import build_retry
+
+try:
+    from PIL import Image
+except ImportError:
+    # without Pillow posters are cached & served as fetched, only the downsizing is lost
+    Image = None
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS posters (
+    url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_posters_used ON posters (used);
+CREATE INDEX IF NOT EXISTS ix_posters_name ON posters (name);
+'''
+
+SIGNATURES = ((b'\xff\xd8\xff', 'jpg'), (b'\x89PNG\r\n\x1a\n', 'png'), (b'GIF87a', 'gif'), (b'GIF89a', 'gif'))
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+NAME = re.compile(r'^[0-9a-f]{40}\.(jpg|png|gif)$')
+
+
+def image_type(body):
+    """File extension from the magic bytes, None for anything that is not an image"""
+    for signature, extension in SIGNATURES:
+        if body.startswith(signature):
+            return extension
+    return None
+
+
+def thumbnail(body, width):
+    """(body, extension) of the image at most width pixels wide, re-encoded as JPEG when it was downsized"""
+    extension = image_type(body)
+    if extension is None:
+        raise ValueError('not an image')
+    if Image is None:
+        return body, extension
+    with Image.open(io.BytesIO(body)) as image:
+        if image.width <= width:
+            return body, extension
+        image.thumbnail((width, width * 4))
+        output = io.BytesIO()
+        image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True)
+    return output.getvalue(), 'jpg'
+
+
+class PosterStore(object):
+    """
+    Content addressed disk cache of poster thumbnails.
+    A poster is downloaded once, downsized to width pixels and written as <sha1 of the thumbnail>.<ext>, the url to
+    file index lives in SQLite (WAL, like the lookup store) so worker processes share the files. Least recently
+    used posters are evicted once the files exceed max_bytes, downloads run on a small pool and identical ones
+    in flight are joined.
+    """
+
+    def __init__(self, root, width=300, max_bytes=64 * 1024 * 1024, max_source=10 * 1024 * 1024,
+                 timeout=(3.05, 10), workers=4, download=None, touch_after=60, retry_after=600, clock=time.time):
+        self.root = root
+        self.width = width
+        self.max_bytes = max_bytes
+        self.max_source = max_source  # posters bigger than this are not downloaded
+        self.timeout = timeout
+        self.touch_after = touch_after
+        self.retry_after = retry_after  # a poster that failed is not downloaded again for this long
+        self.clock = clock
+        self.download = download or self.get
+        self.flight = SingleFlight()
+        self.broken = {}  # url -> time its download failed
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='posters')
+        self.hits = 0
+        self.misses = 0
+        self.fetched = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, 'index.db'), timeout=5, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        # TVDB & fanart hosts, never the Sonarr session so the api key stays with Sonarr
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=build_retry(2, 0.3))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def lookup(self, url):
+        """File name of the cached thumbnail for url, None when it is not cached"""
+        now = self.clock()
+        with self._lock:
+            row = self._db.execute('SELECT name, used FROM posters WHERE url = ?', (url,)).fetchone()
+            if row is None or not os.path.exists(self.path(row[0])):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if now - row[1] > self.touch_after:
+                self._db.execute('UPDATE posters SET used = ? WHERE url = ?', (now, url))
+        return row[0]
+
+    def ensure(self, url, timeout=None):
+        """File name for url, downloading it when needed, None if that fails or takes longer than timeout"""
+        name = self.lookup(url)
+        if name is not None or self.failed_recently(url):
+            return name
+        try:
+            return self.submit(url).result(timeout)
+        except Exception:
+            # a slow download keeps going in the background, the next ask finds it cached
+            return None
+
+    def prefetch(self, urls):
+        """Start downloading every poster not cached yet"""
+        for url in urls:
+            if url and self.lookup(url) is None and not self.failed_recently(url):
+                self.submit(url)
+
+    def failed_recently(self, url):
+        failed = self.broken.get(url)
+        if failed is not None and self.clock() - failed > self.retry_after:
+            self.broken.pop(url, None)
+            return False
+        return failed is not None
+
+    def submit(self, url):
+        future, leader = self.flight.join(url)
+        if leader:
+            self.executor.submit(self.finish, url, future)
+        return future
+
+    def finish(self, url, future):
+        try:
+            self.flight.finish(url, future, self.fetch, url)
+        except Exception:
+            self.failed += 1
+            self.broken[url] = self.clock()
+            log.warning('Poster {} could not be fetched'.format(url), exc_info=True)
+
+    def fetch(self, url):
+        body, extension = thumbnail(self.download(url), self.width)
+        name = '{}.{}'.format(hashlib.sha1(body).hexdigest(), extension)
+        path = self.path(name)
+        if not os.path.exists(path):
+            partial = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(partial, 'wb') as handle:
+                handle.write(body)
+            os.replace(partial, path)
+        now = self.clock()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('INSERT OR REPLACE INTO posters VALUES (?, ?, ?, ?)', (url, name, len(body), now))
+                self._evict()
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        self.fetched += 1
+        return name
+
+    def get(self, url):
+        """Download a poster, refusing ones over max_source bytes"""
+        with self.session.get(url, timeout=self.timeout, stream=True) as res:
+            res.raise_for_status()
+            chunks, size = [], 0
+            for chunk in res.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > self.max_source:
+                    raise ValueError('poster over {} bytes'.format(self.max_source))
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _evict(self):
+        # posters with identical thumbnails share a file, it is only counted & removed once
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT name, size FROM posters)'
+                                 ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, name, size in self._db.execute('SELECT url, name, size FROM posters ORDER BY used').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM posters WHERE url = ?', (url,))
+            if self._db.execute('SELECT 1 FROM posters WHERE name = ?', (name,)).fetchone() is None:
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass
+                total -= size
+
+    def read(self, name):
+        """(body, content type) of a cached file, None for names that are not ours or were evicted"""
+        if not NAME.match(name):
+            return None
+        try:
+            with open(self.path(name), 'rb') as handle:
+                return handle.read(), CONTENT_TYPES[name.rsplit('.', 1)[1]]
+        except OSError:
+            return None
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT name, size FROM posters)').fetchone()
+        return {'files': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses, 'fetched': self.fetched,
+                'failed': self.failed}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+        with self._lock:
+            self._db.close()
+
+
+class PosterServer(object):
+    """Serves GET /posters/<name> from a PosterStore so Slack loads thumbnails from us, runs as a runtime service"""
+
+    def __init__(self, store, host='127.0.0.1', port=8990, path='/posters'):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.path = path
+        self.server = None
+        self.served = 0
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2] if self.server else None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        log.info('Serving posters on {}:{}{}'.format(self.address[0], self.address[1], self.path))
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            directory, _, name = request_line[1].split('?')[0].rpartition('/') if len(request_line) == 3 \
+                else ('', '', '')
+            found = None
+            if directory == self.path:
+                found = await asyncio.get_event_loop().run_in_executor(None, self.store.read, name)
+            caching = ''
+            if found is None:
+                status, body, content_type = '404 Not Found', b'', 'text/plain'
+            elif request_line[0] != 'GET':
+                status, body, content_type = '405 Method Not Allowed', b'', 'text/plain'
+            else:
+                (body, content_type), status = found, '200 OK'
+                # a name is the hash of its content, it never changes
+                caching = 'Cache-Control: public, max-age=31536000, immutable\r\n'
+                self.served += 1
+            writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n{}'
+                         'Connection: close\r\n\r\n'.format(status, content_type, len(body), caching).encode() + body)
+            await writer.drain()
+        except Exception:
+            log.warning('Poster request failed', exc_info=True)
+        finally:
+            writer.close()
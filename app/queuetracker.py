@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# items in these states are moving, the queue is polled fast while one of them is present
+ACTIVE_STATUSES = ('Downloading', 'Queued', 'Delay')
+
+
+class Watch(object):
+    """A channel showing the queue in one message that is edited in place"""
+    __slots__ = ('channel', 'ts', 'posting', 'repost', 'expires', 'items', 'snapshot')
+
+    def __init__(self, channel, repost=False, expires=None):
+        self.channel = channel
+        self.ts = None  # of the message being edited, set once Slack answered the post
+        self.posting = None  # Future of a post still in flight
+        self.repost = repost  # new items get a new message instead of an edit, for notification channels
+        self.expires = expires
+        self.items = None  # keys of the items the message was last posted with
+        self.snapshot = None  # material() the message was last published with
+
+
+class QueueTracker(object):
+    """
+    Polls the download queue and keeps one Slack message per watching channel up to date with chat.update.
+    The message is only edited when an item is added, removed, changes status or crosses a step of progress,
+    polls come every fast seconds while something is downloading and back off to idle seconds otherwise.
+    fetch() returns [(key, label, QueueItem)] or None when the queue could not be read completely.
+    """
+
+    def __init__(self, fetch, outbound, fast=5, idle=300, step=10, max_lines=30, watch_ttl=3600,
+                 clock=time.monotonic):
+        self.fetch = fetch
+        self.outbound = outbound
+        self.fast = fast
+        self.idle = idle
+        self.step = step
+        self.max_lines = max_lines
+        self.watch_ttl = watch_ttl
+        self.clock = clock
+        self.wake = None  # set by the owner to poll as soon as possible, e.g. after a new watch
+        self.watches = {}  # channel -> Watch
+        self.delay = idle
+        self.snapshot = None
+        self.polls = 0
+        self.posts = 0
+        self.updates = 0
+        self._lock = threading.RLock()
+
+    def watch(self, channel, repost=False, ttl=None):
+        """Show the queue in channel, a repost watch never expires, others stop after watch_ttl seconds"""
+        ttl = self.watch_ttl if ttl is None else ttl
+        with self._lock:
+            watch = self.watches[channel] = Watch(channel, repost=repost,
+                                                  expires=None if repost else self.clock() + ttl)
+            if self.snapshot is not None and not repost:
+                self.publish(watch, self.snapshot, self.render(self.items))
+                self.delay = self.fast
+        if self.wake is not None:
+            self.wake()
+
+    def unwatch(self, channel):
+        with self._lock:
+            self.watches.pop(channel, None)
+
+    def material(self, items):
+        """What a change has to touch before the message is edited, progress counts in whole steps"""
+        return tuple(sorted((key, item.status, int(item.progress // self.step)) for key, label, item in items))
+
+    def render(self, items):
+        if not items:
+            return 'Download queue is empty'
+        lines = ['{} [{}] {:.0f}%'.format(label, item.status, item.progress) for key, label, item in items]
+        if len(lines) > self.max_lines:
+            lines = lines[:self.max_lines] + ['...and {} more'.format(len(lines) - self.max_lines)]
+        return "Download queue:\n```{}```".format('\n'.join(lines))
+
+    def poll(self):
+        """Scheduler job, returns the seconds until the next poll"""
+        with self._lock:
+            now = self.clock()
+            for channel, watch in list(self.watches.items()):
+                if watch.expires is not None and watch.expires <= now:
+                    del self.watches[channel]
+            if not self.watches:
+                self.snapshot = None
+                self.delay = self.idle
+                return self.delay
+        items = self.fetch()
+        with self._lock:
+            self.polls += 1
+            if items is None:
+                # a partial queue would look like downloads vanished, keep the message & try again soon
+                return self.delay
+            snapshot = self.material(items)
+            changed = snapshot != self.snapshot
+            if changed:
+                self.snapshot, self.items = snapshot, items
+            # a watch that skipped a change while its post was in flight catches up here too
+            stale = [watch for watch in self.watches.values() if watch.snapshot != snapshot]
+            if stale:
+                text = self.render(items)
+                for watch in stale:
+                    self.publish(watch, snapshot, text)
+            active = any(item.status in ACTIVE_STATUSES for key, label, item in items)
+            if not items:
+                self.delay = self.idle
+            elif changed:
+                self.delay = self.fast
+            else:
+                # nothing moved, back off, while downloads are running at most to a few fast intervals
+                self.delay = min(self.delay * 2, self.fast * 6 if active else self.idle)
+            return self.delay
+
+    def publish(self, watch, snapshot, text):
+        keys = frozenset(key for key, status, step in snapshot)
+        if watch.posting is not None and not watch.posting.done():
+            # still waiting for the ts of the first post, _posted publishes what was skipped
+            return
+        repost = watch.ts is None or (watch.repost and not keys <= watch.items)
+        watch.items, watch.snapshot = keys, snapshot
+        if repost and not keys and watch.repost:
+            # nothing to edit & nothing queued, a notification channel hears about the queue once it has items
+            return
+        if repost:
+            watch.ts = None
+            # an extra argument keeps the post from being coalesced with other messages, it is edited later
+            watch.posting = self.outbound.post(watch.channel, text, mrkdwn=True)
+            watch.posting.add_done_callback(lambda future: self._posted(watch, future))
+            self.posts += 1
+        else:
+            self.outbound.call('chat.update', channel=watch.channel, ts=watch.ts, text=text, as_user=True)
+            self.updates += 1
+        if not keys and not watch.repost:
+            # the queue drained, the last edit says so and the watch ends
+            self.watches.pop(watch.channel, None)
+
+    def _posted(self, watch, future):
+        with self._lock:
+            if future.exception() is None and future.result().get('ok'):
+                watch.ts = future.result().get('ts')
+            else:
+                # the next poll posts again
+                watch.snapshot = None
+                return
+            if self.watches.get(watch.channel) is watch and self.snapshot is not None \
+                    and watch.snapshot != self.snapshot:
+                self.publish(watch, self.snapshot, self.render(self.items))
+
+    def stats(self):
+        with self._lock:
+            return {'watches': len(self.watches), 'polls': self.polls, 'posts': self.posts,
+                    'updates': self.updates, 'delay': self.delay}
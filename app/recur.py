@@ -1,40 +1,310 @@
-from threading import Timer, Lock
-from time import sleep
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import time
+from threading import Condition, Lock, Thread
+
+log = logging.getLogger(__name__)
+
+
+class Cron(object):
+    """
+    Five field cron expression: minute hour day-of-month month day-of-week.
+    Fields accept *, numbers, ranges (1-5), lists (1,3) and steps (*/15, 0-30/10), sunday is 0.
+    """
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError('cron expression needs 5 fields: {}'.format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = \
+            [self.parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)]
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    def __repr__(self):
+        return 'Cron({!r})'.format(self.expression)
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(value) for value in part.split('-')]
+            else:
+                start = end = int(part)
+                if step != 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError('cron field {} out of range {}-{}'.format(field, low, high))
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7
+        if self.any_day or self.any_weekday:
+            return moment.day in self.days and weekday in self.weekdays
+        # like cron, a restricted day-of-month and day-of-week match on either
+        return moment.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """First matching minute strictly after moment (naive local datetime)"""
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError('cron expression never matches: {}'.format(self.expression))
+
+
+class Job(object):
+    """A scheduled function with its trigger, missed run policy and runtime metrics"""
+
+    MISSED_POLICIES = ('run_once', 'skip', 'catch_up')
+
+    def __init__(self, name, function, interval=None, cron=None, jitter=0, missed='run_once', grace=60,
+                 adaptive=False, args=(), kwargs=None):
+        if (interval is None) == (cron is None):
+            raise ValueError('job {} needs exactly one of interval or cron'.format(name))
+        if adaptive and interval is None:
+            raise ValueError('adaptive job {} needs an interval'.format(name))
+        if missed not in self.MISSED_POLICIES:
+            raise ValueError('missed must be one of {}'.format(', '.join(self.MISSED_POLICIES)))
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.cron = Cron(cron) if isinstance(cron, str) else cron
+        self.jitter = jitter
+        self.missed = missed
+        self.grace = grace
+        # an adaptive job returns the seconds until its next run, interval is the fallback
+        self.adaptive = adaptive
+        self.delay = None
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.due = None
+        self.cancelled = False
+        # metrics
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def next_due(self, after):
+        """Next wall clock time (epoch seconds) the job should run after the given time"""
+        if self.delay is not None:
+            due = after + self.delay
+        elif self.interval is not None:
+            due = after + self.interval
+        else:
+            due = time.mktime(self.cron.next_after(datetime.datetime.fromtimestamp(after)).timetuple())
+        if self.jitter:
+            due += random.uniform(0, self.jitter)
+        return due
+
+    def run(self):
+        started = time.time()
+        self.delay = None
+        try:
+            result = self.function(*self.args, **self.kwargs)
+            if self.adaptive and isinstance(result, (int, float)):
+                self.delay = max(0, result)
+        except Exception:
+            self.failures += 1
+            log.warning('Scheduled job {} failed'.format(self.name), exc_info=True)
+        finally:
+            self.last_run = started
+            self.last_duration = time.time() - started
+            self.max_duration = max(self.max_duration, self.last_duration)
+            self.total_duration += self.last_duration
+            self.runs += 1
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+            'mean_duration': self.total_duration / self.runs if self.runs else 0.0,
+            'next_run': self.due,
+        }
+
+
+class Scheduler(object):
+    """
+    Runs many jobs from a single worker thread ordered by a heap of due times.
+    Jobs run one at a time on the worker, a late wake up is handled by each job's missed run policy.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._thread = None
+        self._stopped = True
+
+    def add(self, name, function, *args, **options):
+        """
+        Schedule function, options are passed on to Job (interval or cron, jitter, missed, grace, adaptive, kwargs)
+        """
+        job = Job(name, function, args=args, **options)
+        with self._condition:
+            if name in self.jobs:
+                self.jobs[name].cancelled = True
+            self.jobs[name] = job
+            self._push(job, job.next_due(self.clock()))
+            self._condition.notify()
+        return job
+
+    def remove(self, name):
+        with self._condition:
+            job = self.jobs.pop(name, None)
+            if job:
+                job.cancelled = True
+            self._condition.notify()
+
+    def reschedule(self, name, delay=0):
+        """Move a job's next run to delay seconds from now, e.g. to run it early after something happened"""
+        with self._condition:
+            job = self.jobs.get(name)
+            if job is None:
+                return
+            self._push(job, self.clock() + delay)
+            self._condition.notify()
+
+    def stats(self):
+        return dict((name, job.stats()) for name, job in self.jobs.items())
+
+    def start(self):
+        with self._condition:
+            if not self._stopped:
+                return
+            self._stopped = False
+        self._thread = Thread(target=self._work, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if wait and self._thread:
+            self._thread.join()
+
+    def _push(self, job, due):
+        job.due = due
+        heapq.heappush(self._heap, (due, next(self._counter), job))
+
+    def _next(self):
+        """Block until a job is due, returns None once stopped"""
+        with self._condition:
+            while not self._stopped:
+                # entries of removed jobs and ones superseded by reschedule() are dropped
+                while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] != self._heap[0][2].due):
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, job = self._heap[0]
+                delay = due - self.clock()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            now = self.clock()
+            due = job.due
+            late = now - due > job.grace
+            if late and job.missed == 'skip':
+                job.skipped += 1
+                log.debug('Skipping missed run of {}'.format(job.name))
+            else:
+                job.run()
+            # catch_up keeps the original cadence so every missed occurrence runs back to back
+            after = due if late and job.missed == 'catch_up' else self.clock()
+            with self._condition:
+                # a reschedule() while the job ran already queued its next run
+                if not job.cancelled and job.due == due:
+                    self._push(job, job.next_due(after))
+
+
+_default = None
+_default_lock = Lock()
+
+
+def default_scheduler():
+    """Shared scheduler used by Periodic"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+            _default.start()
+        return _default
 
 
 class Periodic(object):
     """
-    A periodic task running in threading.Timers
+    A periodic task running on the shared scheduler thread
     """
 
     def __init__(self, interval, function, *args, **kwargs):
         self._lock = Lock()
-        self._timer = None
+        self._job = None
         self.function = function
         self.interval = interval
+        self.scheduler = kwargs.pop('scheduler', None)
+        autostart = kwargs.pop('autostart', True)
         self.args = args
         self.kwargs = kwargs
         self._stopped = True
-        if kwargs.pop('autostart', True):
+        if autostart:
             self.start()
 
-    def start(self, from_run=False):
-        self._lock.acquire()
-        if from_run or self._stopped:
-            self._stopped = False
-            self._timer = Timer(self.interval, self._run)
-            self._timer.start()
-            self._lock.release()
-
-    def _run(self):
-        self.start(from_run=True)
-        self.function(*self.args, **self.kwargs)
+    def start(self):
+        with self._lock:
+            if self._stopped:
+                self._stopped = False
+                scheduler = self.scheduler or default_scheduler()
+                self._job = scheduler.add('periodic-{}'.format(id(self)), self.function, *self.args,
+                                          interval=self.interval, kwargs=self.kwargs)
 
     def stop(self):
-        self._lock.acquire()
-        self._stopped = True
-        self._timer.cancel()
-        self._lock.release()
+        with self._lock:
+            self._stopped = True
+            if self._job:
+                (self.scheduler or default_scheduler()).remove(self._job.name)
+                self._job = None
 
 # def hello(name):
 #     print("Hello %s!" % name)
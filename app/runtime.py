@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from metrics import default_registry
+
+log = logging.getLogger(__name__)
+
+
+class Runtime(object):
+    """
+    asyncio runtime for the bot.
+    The Slack RTM websocket is watched with add_reader so events are handled as soon as they arrive,
+    and every command runs as its own task on a thread pool so one slow conversation never blocks another.
+    Given a WorkerPool, commands & conversation replies are sent to worker processes instead and this process
+    only reads Slack, runs inline commands and the services.
+    """
+
+    def __init__(self, bot, parse, max_workers=32, poll_interval=5, expire_interval=1, services=(), workers=None,
+                 metrics=None):
+        self.bot = bot
+        self.parse = parse
+        self.services = list(services)  # objects with async start() & stop() sharing the loop, e.g. webhooks
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.expire_interval = expire_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.loop = None
+        self.events = None
+        self.tasks = set()
+        self._socket = None
+        metrics = metrics or default_registry()
+        metrics.gauge('bot_tasks_inflight', lambda: len(self.tasks), 'Commands & replies running on the pool')
+        metrics.gauge('bot_events_queued', lambda: self.events.qsize() if self.events else 0,
+                      'RTM events waiting to be dispatched')
+
+    def run(self):
+        """Run the event loop until interrupted"""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        main = self.loop.create_task(self.main())
+        try:
+            # a restart stops the process with SIGTERM, shut down the same way as on ctrl-c
+            self.loop.add_signal_handler(signal.SIGTERM, main.cancel)
+        except (ValueError, RuntimeError, NotImplementedError):
+            # the loop runs off the main thread (benchmarks) or the platform has no signal handlers
+            pass
+        try:
+            self.loop.run_until_complete(main)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            log.info('Shutting down runtime')
+        finally:
+            self.stop_reading()
+            if self.workers is not None:
+                # slack is no longer read, workers finish what they were sent before exiting
+                self.workers.stop()
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+    async def main(self):
+        self.events = asyncio.Queue()
+        if self.bot.slack_client.server.websocket is None:
+            # Bot() leaves connecting to the runtime, off the loop since Slack may be slow to answer
+            await self.loop.run_in_executor(self.executor, self.bot.connect_to_slack)
+        if self.workers is not None:
+            self.workers.start()
+        self.start_reading()
+        for service in self.services:
+            await service.start()
+        poller = asyncio.ensure_future(self.poll())
+        expirer = asyncio.ensure_future(self.expire())
+        try:
+            while True:
+                event = await self.events.get()
+                try:
+                    self.handle_event(event)
+                except Exception:
+                    # one malformed event must not take the bot offline
+                    log.warning('Event {} failed'.format(event), exc_info=True)
+        finally:
+            poller.cancel()
+            expirer.cancel()
+            for service in self.services:
+                await service.stop()
+
+    # FIREHOSE
+    def start_reading(self):
+        """Watch the websocket file descriptor, reads happen only when data is ready"""
+        websocket = self.bot.slack_client.server.websocket
+        if websocket is None or websocket.sock is None:
+            log.warning('Slack websocket not connected, falling back to polling')
+            return
+        self._socket = websocket.sock
+        self.loop.add_reader(self._socket, self.drain)
+
+    def stop_reading(self):
+        if self._socket is not None:
+            self.loop.remove_reader(self._socket)
+            self._socket = None
+
+    def drain(self):
+        """Read every buffered frame off the websocket and queue the events"""
+        while True:
+            try:
+                output_list = self.bot.slack_client.rtm_read()
+            except (BlockingIOError, InterruptedError):
+                break
+            except Exception:
+                log.warning('Slack read failed, reconnecting', exc_info=True)
+                self.stop_reading()
+                self.bot.connect_to_slack()
+                self.start_reading()
+                break
+            if not output_list:
+                break
+            for output in output_list:
+                self.events.put_nowait(output)
+        # the client reconnects on its own and may have replaced the socket
+        websocket = self.bot.slack_client.server.websocket
+        if websocket is not None and websocket.sock is not self._socket:
+            self.stop_reading()
+            self.start_reading()
+
+    async def poll(self):
+        """Safety net in case the socket was swapped without a readable event, also replaces dead workers"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.drain()
+            if self.workers is not None:
+                self.workers.check()
+
+    async def expire(self):
+        """Notify users whose conversation timed out waiting on their reply"""
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            for step in self.bot.expire_conversations():
+                self.submit(step)
+
+    # DISPATCH
+    def handle_event(self, event):
+        """Route a reply to its waiting conversation, anything else is parsed as a command"""
+        if self.workers is not None:
+            self.forward(event)
+            return
+        step = self.bot.deliver_reply(event)
+        if step is not None:
+            self.submit(step)
+            return
+        for command, channel, sender in self.parse([event], self.bot.at_bot):
+            if command and channel:
+                self.submit(functools.partial(self.bot.handle_command, channel, command, sender))
+
+    def forward(self, event):
+        """Worker mode: inline commands run here, other messages go to the worker owning their channel"""
+        if not event.get('text') or 'channel' not in event or event.get('user') == self.bot.bot_id:
+            return
+        for command, channel, sender in self.parse([event], self.bot.at_bot):
+            if self.bot.runs_inline(command):
+                self.submit(functools.partial(self.bot.handle_command, channel, command, sender))
+                return
+        self.workers.send(event)
+
+    def submit(self, step):
+        task = asyncio.ensure_future(self.dispatch(step))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, step):
+        try:
+            await self.loop.run_in_executor(self.executor, step)
+        except Exception:
+            log.warning('Step {} failed'.format(step), exc_info=True)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# lookup payload fields constuct_series_json and the add show dialog use
+KEEP_FIELDS = ('title', 'tvdbId', 'titleSlug', 'year', 'images', 'seasons', 'genres', 'network', 'seriesType')
+NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """lowercase, punctuation folded to single spaces"""
+    return NON_WORD.sub(' ', text.lower()).strip()
+
+
+def trigrams(text):
+    padded = '  {} '.format(text)
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TitleIndex(object):
+    """
+    In-process trigram index over show titles from previous lookups and the library.
+    Answers prefix and typo tolerant queries ranked by trigram similarity, results are memoized per normalized query.
+    """
+
+    def __init__(self, min_score=0.45, hit_score=0.75, max_docs=20000, memo_size=512):
+        self.min_score = min_score
+        self.hit_score = hit_score
+        self.max_docs = max_docs
+        self.memo_size = memo_size
+        self._docs = OrderedDict()  # tvdbId -> (normalized title, grams, payload)
+        self._postings = {}  # gram -> set of tvdbIds
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.memo_hits = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, show):
+        if not show.get('tvdbId') or not show.get('title'):
+            return
+        payload = dict((key, show[key]) for key in KEEP_FIELDS if key in show)
+        title = normalize(show['title'])
+        grams = trigrams(title)
+        with self._lock:
+            self._remove(show['tvdbId'])
+            self._docs[show['tvdbId']] = (title, grams, payload)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(show['tvdbId'])
+            while len(self._docs) > self.max_docs:
+                self._remove(next(iter(self._docs)))
+            self._memo.clear()
+
+    def add_all(self, shows):
+        for show in shows:
+            self.add(show)
+
+    def _remove(self, tvdb_id):
+        doc = self._docs.pop(tvdb_id, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(tvdb_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def rank(self, query):
+        """Returns [(score, tvdbId)] best first for every indexed title above min_score"""
+        query = normalize(query)
+        if not query:
+            return []
+        with self._lock:
+            memo = self._memo.get(query)
+            if memo is not None:
+                self._memo.move_to_end(query)
+                self.memo_hits += 1
+                return memo
+            grams = trigrams(query)
+            overlap = {}
+            for gram in grams:
+                for tvdb_id in self._postings.get(gram, ()):
+                    overlap[tvdb_id] = overlap.get(tvdb_id, 0) + 1
+            ranked = []
+            for tvdb_id, shared in overlap.items():
+                title, title_grams = self._docs[tvdb_id][:2]
+                score = 2.0 * shared / (len(grams) + len(title_grams))
+                if title == query:
+                    score += 1.0
+                elif title.startswith(query):
+                    score += 0.5
+                if score >= self.min_score:
+                    ranked.append((round(score, 4), tvdb_id))
+            ranked.sort(key=lambda item: (-item[0], self._docs[item[1]][0]))
+            self._memo[query] = ranked
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+            return ranked
+
+    def search(self, query, limit=10):
+        """Ranked lookup payloads when the best match is confident enough to skip the remote lookup"""
+        ranked = self.rank(query)
+        if not ranked or ranked[0][0] < self.hit_score:
+            return []
+        with self._lock:
+            return [self._docs[tvdb_id][2] for score, tvdb_id in ranked[:limit] if tvdb_id in self._docs]
+
+    def order(self, query, shows):
+        """Sort remote lookup results by similarity to query, unknown titles keep their order at the end"""
+        scores = dict((tvdb_id, score) for score, tvdb_id in self.rank(query))
+        return sorted(shows, key=lambda show: -scores.get(show.get('tvdbId'), 0))
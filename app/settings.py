@@ -1,19 +1,86 @@
 from dotenv import load_dotenv, find_dotenv
 import os
 import logging
+import logging.handlers
+import queue
 
 load_dotenv(find_dotenv())
 
 SLACK_KEY = os.getenv('SLACK_KEY')
 BOT_NAME = os.getenv('BOT_NAME')
+# the bot's own slack user id is remembered here per token, '' always asks auth.test
+SLACK_IDENTITY_CACHE = os.getenv('SLACK_IDENTITY_CACHE', '.slack_identity.json')
 SONARR_HOST_URL = os.getenv('SONARR_HOST_URL')
 SONARR_API_KEY = os.getenv('SONARR_API_KEY')
+# several instances: SONARR_INSTANCES='tv,4k' with SONARR_TV_HOST_URL, SONARR_TV_API_KEY, SONARR_4K_HOST_URL...
+SONARR_INSTANCES = [name.strip() for name in os.getenv('SONARR_INSTANCES', '').split(',') if name.strip()]
+SONARR_BACKENDS = [(name, os.getenv('SONARR_{}_HOST_URL'.format(name.upper())),
+                    os.getenv('SONARR_{}_API_KEY'.format(name.upper()))) for name in SONARR_INSTANCES] or \
+                  [('sonarr', SONARR_HOST_URL, SONARR_API_KEY)]
+# add show routing, e.g. 'genres=Anime>anime; seriesType=anime>anime', unmatched shows go to the first instance
+SONARR_ROUTES = os.getenv('SONARR_ROUTES', '')
+SONARR_BACKEND_TIMEOUT = float(os.getenv('SONARR_BACKEND_TIMEOUT', 10))
+SONARR_POOL_SIZE = int(os.getenv('SONARR_POOL_SIZE', 10))
+SONARR_CONNECT_TIMEOUT = float(os.getenv('SONARR_CONNECT_TIMEOUT', 3.05))
+SONARR_READ_TIMEOUT = float(os.getenv('SONARR_READ_TIMEOUT', 30))
+SONARR_RETRIES = int(os.getenv('SONARR_RETRIES', 3))
+SONARR_CACHE_SIZE = int(os.getenv('SONARR_CACHE_SIZE', 256))
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 32))
+# worker processes commands are sharded to by channel, 0 handles them in the process reading Slack
+BOT_PROCESSES = int(os.getenv('BOT_PROCESSES', 0))
+BOT_DRAIN_TIMEOUT = float(os.getenv('BOT_DRAIN_TIMEOUT', 30))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))
+LIBRARY_DB = os.getenv('LIBRARY_DB', ':memory:')
+# series lookups kept on disk across restarts and shared by every instance & bot process, '' disables
+LOOKUP_CACHE_DB = os.getenv('LOOKUP_CACHE_DB', 'lookups.db')
+LOOKUP_CACHE_TTL = int(os.getenv('LOOKUP_CACHE_TTL', 86400))
+LOOKUP_CACHE_MAX_MB = float(os.getenv('LOOKUP_CACHE_MAX_MB', 64))
+# posters are downsized into POSTER_DIR & served at POSTER_BASE_URL (proxied to POSTER_HOST:POSTER_PORT) for Slack,
+# without a base url Slack is given the remote poster as before
+POSTER_BASE_URL = os.getenv('POSTER_BASE_URL', '')
+POSTER_HOST = os.getenv('POSTER_HOST', '127.0.0.1')
+POSTER_PORT = int(os.getenv('POSTER_PORT', 0))
+POSTER_DIR = os.getenv('POSTER_DIR', 'posters')
+POSTER_WIDTH = int(os.getenv('POSTER_WIDTH', 300))
+POSTER_CACHE_MAX_MB = float(os.getenv('POSTER_CACHE_MAX_MB', 64))
+POSTER_WAIT = float(os.getenv('POSTER_WAIT', 2))
+LIBRARY_MAX_AGE = int(os.getenv('LIBRARY_MAX_AGE', 300))
+# library changes posted at most per refresh to subscribed channels, the rest are summed up
+LIBRARY_CHANGES_LIMIT = int(os.getenv('LIBRARY_CHANGES_LIMIT', 20))
+NOTIFY_CHANNEL = os.getenv('NOTIFY_CHANNEL')
+CALENDAR_CRON = os.getenv('CALENDAR_CRON', '0 18 * * *')
+QUEUE_POLL_INTERVAL = int(os.getenv('QUEUE_POLL_INTERVAL', 300))
+# the queue is polled this often while downloads move, a shown message is edited per step of percent progress
+QUEUE_POLL_FAST = int(os.getenv('QUEUE_POLL_FAST', 5))
+QUEUE_PROGRESS_STEP = float(os.getenv('QUEUE_PROGRESS_STEP', 10))
+DISKSPACE_CRON = os.getenv('DISKSPACE_CRON', '0 * * * *')
+DISKSPACE_MIN_FREE_PERCENT = float(os.getenv('DISKSPACE_MIN_FREE_PERCENT', 10))
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 0))
+WEBHOOK_TOKEN = os.getenv('WEBHOOK_TOKEN')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+LOG_FILE = os.getenv('LOG_FILE', '../log/bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
 LOG_FORMAT = '%(asctime)s - %(name)-4s - %(levelname)-4s - %(message)s'
 
 
-logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT, filename='../log/bot.log', filemode='a')
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-formatter = logging.Formatter(LOG_FORMAT)
-ch.setFormatter(formatter)
-logging.getLogger('').addHandler(ch)
\ No newline at end of file
+def configure_logging():
+    """
+    File & console logging for the bot process, kept out of import so tools & benchmarks can import the app.
+    Records are only queued on the calling thread, a listener thread does the formatting & file writes so a slow
+    disk never stalls the event loop. Returns the listener, stop() it to flush on exit.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    fh = logging.FileHandler(LOG_FILE, mode='a')
+    fh.setFormatter(formatter)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(formatter)
+    records = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(records, fh, ch, respect_handler_level=True)
+    root = logging.getLogger('')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    return listener
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical calls that overlap in time: the first caller for a key runs the call, everyone arriving
+    while it is in flight waits on the same concurrent.futures.Future and gets its result or exception.
+    Threads block in do(), coroutines await do_async(), both kinds of caller share the same flights.
+    """
+
+    def __init__(self):
+        self.flights = {}  # key -> Future of the call in flight
+        self.calls = 0  # calls actually made
+        self.collapsed = 0  # callers served by somebody else's call
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """(future, leader), the leader has to run the call and settle the future with finish()"""
+        with self._lock:
+            future = self.flights.get(key)
+            if future is not None:
+                self.collapsed += 1
+                return future, False
+            future = self.flights[key] = Future()
+            self.calls += 1
+            return future, True
+
+    def finish(self, key, future, function, *args):
+        try:
+            result = function(*args)
+        except BaseException as error:
+            with self._lock:
+                del self.flights[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self.flights[key]
+        future.set_result(result)
+        return result
+
+    def do(self, key, function, *args):
+        future, leader = self.join(key)
+        if leader:
+            return self.finish(key, future, function, *args)
+        return future.result()
+
+    async def do_async(self, key, function, *args, executor=None):
+        """do() for coroutines, the call runs on executor (the loop's default one) when this caller leads"""
+        future, leader = self.join(key)
+        if leader:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(executor, self.finish, key, future, function, *args)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'collapsed': self.collapsed, 'in_flight': len(self.flights)}
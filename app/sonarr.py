@@ -1,104 +1,194 @@
 # -*- coding: utf-8 -*-
 
-import requests
+import json
+from urllib.parse import urlencode
+from cache import ResponseCache, LIBRARY_GROUPS
+from models import Episode, QualityProfile, QueueItem, RootFolder, Series, loads
+from paging import as_datetime, iter_pages, within
+from singleflight import SingleFlight
+from transport import Transport
+
+
+# /history filterValue for each eventType
+HISTORY_EVENT_TYPES = {'grabbed': 1, 'seriesFolderImported': 2, 'downloadFolderImported': 3, 'downloadFailed': 4,
+                       'episodeFileDeleted': 5, 'episodeFileRenamed': 6}
+
+
+class SonarrError(Exception):
+    """Sonarr refused a request, the message is Sonarr's own"""
+
+
+def error_message(res):
+    """Text of a refused request, validation errors come as a list of {'propertyName', 'errorMessage'}"""
+    try:
+        data = loads(res.content)
+    except ValueError:
+        return res.reason or str(res.status_code)
+    if isinstance(data, list):
+        return '; '.join(error.get('errorMessage', str(error)) if isinstance(error, dict) else str(error)
+                         for error in data)
+    if isinstance(data, dict):
+        return data.get('message') or data.get('error') or str(data)
+    return str(data)
 
 
 class SonarrAPI(object):
 
-    def __init__(self, host_url, api_key):
-        """Constructor requires Host-URL and API-KEY"""
+    def __init__(self, host_url, api_key, pool_size=10, connect_timeout=3.05, read_timeout=30, retries=3,
+                 backoff=0.3, cache_ttls=None, cache_size=256, lookup_store=None):
+        """
+        Constructor requires Host-URL and API-KEY, the rest tunes the pooled transport and response cache.
+        lookup_store is an optional LookupStore keeping lookup results across restarts.
+        """
         self.host_url = host_url
         self.api_key = api_key
+        self.transport = Transport(api_key, pool_size=pool_size, connect_timeout=connect_timeout,
+                                   read_timeout=read_timeout, retries=retries, backoff=backoff)
+        self.cache = ResponseCache(ttls=cache_ttls, max_entries=cache_size)
+        self.lookup_store = lookup_store
+        self.flight = SingleFlight()
 
 
     # ENDPOINT CALENDAR
-    def get_calendar(self):
-        # optional params: start (date) & end (date)
+    def get_calendar(self, start=None, end=None):
         """Gets upcoming episodes, if start/end are not supplied episodes airing today and tomorrow will be returned"""
-        res = self.request_get("{}/calendar".format(self.host_url))
-        return res.json()
+        params = {}
+        if start is not None:
+            params['start'] = as_datetime(start).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if end is not None:
+            params['end'] = as_datetime(end).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if params:
+            res = self.request_get("{}/calendar?{}".format(self.host_url, urlencode(params)))
+        else:
+            res = self.request_get("{}/calendar".format(self.host_url))
+        return self.decode(res)
 
 
     # ENDPOINT COMMAND
-    def command(self):
-        pass
-
+    def command(self, name, **body):
+        """
+        Queue a command e.g. command('RefreshSeries', seriesId=1), returns it with its id & state.
+        Raises SonarrError when Sonarr refuses it.
+        """
+        res = self.request_post("{}/command".format(self.host_url), dict(body, name=name))
+        if not res.ok:
+            raise SonarrError(error_message(res))
+        command = self.decode(res)
+        if not isinstance(command, dict) or 'id' not in command:
+            raise SonarrError('unexpected response {}'.format(command))
+        return command
+
+    def get_commands(self):
+        """Commands queued or running"""
+        res = self.request_get("{}/command".format(self.host_url))
+        return self.decode(res)
+
+    def get_command(self, command_id):
+        """The command with the matching id, finished ones included"""
+        res = self.request_get("{}/command/{}".format(self.host_url, command_id))
+        return self.decode(res)
 
 
     # ENDPOINT DISKSPACE
     def get_diskspace(self):
         """Return Information about Diskspace"""
         res = self.request_get("{}/diskspace".format(self.host_url))
-        return res.json()
+        return self.decode(res)
 
 
     # ENDPOINT EPISODE
-    def get_episodes_by_series_id(self, series_id):
+    def get_episodes_by_series_id(self, series_id, typed=False):
         """Returns all episodes for the given series"""
         res = self.request_get("{}/episode?seriesId={}".format(self.host_url, series_id))
-        return res.json()
+        return self.decode(res, Episode if typed else None)
 
     def get_episode_by_episode_id(self, episode_id):
         """Returns the episode with the matching id"""
         res = self.request_get("{}/episode/{}".format(self.host_url, episode_id))
-        return res.json()
+        return self.decode(res)
 
     def upd_episode(self, data):
-        #TEST THIS
         """Update the given episodes, currently only monitored is changed, all other modifications are ignored"""
         '''NOTE: All parameters (you should perform a GET/{id} and submit the full body with the changes,
         as other values may be editable in the future.'''
-        res = self.request_put("{}/episode".format(self.host_url, data))
-        return res.json()
+        res = self.request_put("{}/episode".format(self.host_url), data)
+        return self.decode(res)
+
+    def set_episodes_monitored(self, episodes, monitored):
+        """Monitor or unmonitor many episodes (full bodies from get_episodes_by_series_id) in one request"""
+        res = self.request_put("{}/episode/monitor".format(self.host_url),
+                               {'episodeIds': [episode['id'] for episode in episodes], 'monitored': monitored})
+        if res.status_code in (404, 405):
+            # builds without the bulk endpoint only take one full episode per request
+            return [self.upd_episode(dict(episode, monitored=monitored)) for episode in episodes]
+        return self.decode(res)
 
 
     # ENDPOINT EPISODE FILE
     def get_episode_files_by_series_id(self, series_id):
         """Returns all episode files for the given series"""
         res = self.request_get("{}/episodefile?seriesId={}".format(self.host_url, series_id))
-        return res.json()
+        return self.decode(res)
 
     # TEST THIS
     def get_episode_file_by_episode_id(self, episode_id):
         """Returns the episode file with the matching id"""
         res = self.request_get("{}/episodefile/{}".format(self.host_url, episode_id))
-        return res.json()
+        return self.decode(res)
 
     # TEST THIS
     def rem_episode_file_by_episode_id(self, episode_id):
         """Delete the given episode file"""
         res = self.request_del("{}/episodefile/{}".format(self.host_url, episode_id))
-        return res.json()
+        return self.decode(res)
 
 
     # ENDPOINT HISTORY
-    # DOES NOT WORK
-    def get_history(self):
-        """Gets history (grabs/failures/completed)"""
-        res = self.request_get("{}/history".format(self.host_url))
-        return res.json()
+    def get_history(self, page=1, page_size=20, sort_key='date', sort_dir='desc', event_type=None):
+        """Gets one page of history (grabs/failures/completed), only events of event_type when given"""
+        params = {'page': page, 'pageSize': page_size, 'sortKey': sort_key, 'sortDir': sort_dir}
+        if event_type is not None:
+            params.update(filterKey='eventType', filterValue=HISTORY_EVENT_TYPES[event_type])
+        res = self.request_get("{}/history?{}".format(self.host_url, urlencode(params)))
+        return self.decode(res)
+
+    def iter_history(self, since=None, until=None, event_type=None, page_size=50, prefetch=True):
+        """
+        Yields history records newest first, paging lazily and stopping once records are older than since.
+        Sonarr filters by event_type, records are checked again for builds that ignore the filter.
+        """
+        fetch = lambda page, size: self.get_history(page=page, page_size=size, event_type=event_type)
+        records = within(iter_pages(fetch, page_size=page_size, prefetch=prefetch), 'date', since, until)
+        for record in records:
+            if event_type is None or record.get('eventType') == event_type:
+                yield record
 
 
     # ENDPOINT WANTED MISSING
-    # DOES NOT WORK
-    def get_wanted_missing(self):
-        """Gets missing episode (episodes without files)"""
-        res = self.request_get("{}/wanted/missing/".format(self.host_url))
-        return res.json()
+    def get_wanted_missing(self, page=1, page_size=20, sort_key='airDateUtc', sort_dir='desc'):
+        """Gets one page of missing episodes (episodes without files)"""
+        params = {'page': page, 'pageSize': page_size, 'sortKey': sort_key, 'sortDir': sort_dir}
+        res = self.request_get("{}/wanted/missing?{}".format(self.host_url, urlencode(params)))
+        return self.decode(res)
+
+    def iter_wanted_missing(self, since=None, until=None, page_size=50, prefetch=True):
+        """Yields missing episodes by air date newest first, paging lazily and stopping once they aired before since"""
+        fetch = lambda page, size: self.get_wanted_missing(page=page, page_size=size)
+        return within(iter_pages(fetch, page_size=page_size, prefetch=prefetch), 'airDateUtc', since, until)
 
 
     # ENDPOINT QUEUE
-    def get_queue(self):
+    def get_queue(self, typed=False):
         """Gets current downloading info"""
         res = self.request_get("{}/queue".format(self.host_url))
-        return res.json()
+        return self.decode(res, QueueItem if typed else None)
 
 
     # ENDPOINT PROFILE
-    def get_quality_profiles(self):
+    def get_quality_profiles(self, typed=False):
         """Gets all quality profiles"""
-        res = self.request_get("{}/profile".format(self.host_url))
-        return res.json()
+        res = self.request_get("{}/profile".format(self.host_url), cache='profile')
+        return self.decode(res, QualityProfile if typed else None)
 
 
     # ENDPOINT RELEASE
@@ -108,30 +198,33 @@ class SonarrAPI(object):
 
 
     # ENDPOINT ROOTFOLDER
-    def get_root_folder(self):
+    def get_root_folder(self, typed=False):
         """Returns the Root Folder"""
-        res = self.request_get("{}/rootfolder".format(self.host_url))
-        return res.json()
+        res = self.request_get("{}/rootfolder".format(self.host_url), cache='rootfolder')
+        return self.decode(res, RootFolder if typed else None)
 
 
     # ENDPOINT SERIES
-    def get_series(self):
+    def get_series(self, typed=False):
         """Return all series in your collection"""
-        res = self.request_get("{}/series".format(self.host_url))
-        return res.json()
+        res = self.request_get("{}/series".format(self.host_url), cache='series')
+        return self.decode(res, Series if typed else None)
 
-    def get_series_by_series_id(self, series_id):
+    def get_series_by_series_id(self, series_id, typed=False):
         """Return the series with the matching ID or 404 if no matching series is found"""
-        res = self.request_get("{}/series/{}".format(self.host_url, series_id))
-        return res.json()
+        res = self.request_get("{}/series/{}".format(self.host_url, series_id), cache='series_id')
+        return self.decode(res, Series if typed else None)
 
     def constuct_series_json(self, tvdbId, quality_profile):
         """Searches for new shows on trakt and returns Series object to add"""
-        res = self.request_get("{}/series/lookup?term={}".format(self.host_url, 'tvdbId:' + str(tvdbId)))
-        s_dict = res.json()[0]
-
-        # get root folder path
-        root = self.get_root_folder()[0]['path']
+        s_dict = self.lookup('tvdbId:' + str(tvdbId))[0]
+        return self.series_json(s_dict, quality_profile)
+
+    def series_json(self, s_dict, quality_profile, root=None):
+        """Returns Series object to add built from a lookup result, without looking the show up again"""
+        if root is None:
+            # get root folder path
+            root = self.get_root_folder()[0]['path']
         series_json = {
             'title': s_dict['title'],
             'seasons': s_dict['seasons'],
@@ -139,7 +232,7 @@ class SonarrAPI(object):
             'qualityProfileId': quality_profile,
             'seasonFolder': True,
             'monitored': True,
-            'tvdbId': tvdbId,
+            'tvdbId': s_dict['tvdbId'],
             'images': s_dict['images'],
             'titleSlug': s_dict['titleSlug'],
             "addOptions": {
@@ -152,12 +245,20 @@ class SonarrAPI(object):
     def add_series(self, series_json):
         """Add a new series to your collection"""
         res = self.request_post("{}/series".format(self.host_url), data=series_json)
-        return res.json()
+        self.cache.invalidate(*LIBRARY_GROUPS)
+        return self.decode(res)
 
     def upd_series(self, data):
         """Update an existing series"""
         res = self.request_put("{}/series".format(self.host_url), data)
-        return res.json()
+        self.cache.invalidate(*LIBRARY_GROUPS)
+        return self.decode(res)
+
+    def edit_series(self, series):
+        """Update many series (full bodies from get_series) in one request through the series editor"""
+        res = self.request_put("{}/series/editor".format(self.host_url), series)
+        self.cache.invalidate(*LIBRARY_GROUPS)
+        return self.decode(res)
 
     def rem_series(self, series_id, rem_files=False):
         """Delete the series with the given ID"""
@@ -167,53 +268,90 @@ class SonarrAPI(object):
             'deleteFiles': 'true'
         }
         res = self.request_del("{}/series/{}".format(self.host_url, series_id), data)
-        return res.json()
+        self.cache.invalidate(*LIBRARY_GROUPS)
+        return self.decode(res)
 
 
     # ENDPOINT SERIES LOOKUP
-    def lookup_series(self, query):
+    def lookup_series(self, query, typed=False):
         """Searches for new shows on trakt"""
-        res = self.request_get("{}/series/lookup?term={}".format(self.host_url, query))
-        return res.json()
+        return self.lookup(query, Series if typed else None)
+
+    def lookup(self, term, model=None):
+        """/series/lookup through the lookup store when there is one, the remote lookup is the slowest call"""
+        body = self.lookup_store.get(term) if self.lookup_store is not None else None
+        if body is None:
+            res = self.request_get("{}/series/lookup?term={}".format(self.host_url, term), cache='lookup')
+            if res.ok and self.lookup_store is not None:
+                self.lookup_store.put(term, res.content)
+            body = res.content
+        data = loads(body)
+        return data if model is None else model.decode(data)
 
 
     # ENDPOINT SYSTEM-STATUS
     def get_system_status(self):
         """Returns the System Status"""
-        res = self.request_get("{}/system/status".format(self.host_url))
-        return res.json()
+        res = self.request_get("{}/system/status".format(self.host_url), cache='system_status')
+        return self.decode(res)
 
 
 
     # REQUESTS STUFF
-    def request_get(self, url, data={}):
-        """Wrapper on the requests.get"""
-        headers = {
-            'X-Api-Key': self.api_key
-        }
-        res = requests.get(url, headers=headers, json=data)
+    @staticmethod
+    def decode(res, model=None):
+        """Decode the response body, into models when a model class is given"""
+        data = loads(res.content)
+        return data if model is None else model.decode(data)
+
+    def request_get(self, url, data=None, cache=None):
+        """
+        Wrapper on the session get, responses are served from the cache when a cache group is given.
+        Identical GETs already in flight are joined rather than sent again.
+        """
+        if cache is not None and self.cache.enabled(cache):
+            entry, fresh = self.cache.lookup(url)
+            if fresh:
+                return entry.response
+        key = url if data is None else (url, json.dumps(data, sort_keys=True))
+        return self.flight.do(key, self.fetch, url, data, cache)
+
+    def fetch(self, url, data=None, cache=None):
+        """The GET behind request_get, revalidating a stale cache entry when there is one"""
+        if cache is None or not self.cache.enabled(cache):
+            res = self.transport.request('GET', url, data)
+            # read the body now, the response may be handed to several callers
+            res.content
+            return res
+
+        entry, fresh = self.cache.peek(url)
+        if fresh:
+            # stored by a flight that finished between our lookup and joining
+            return entry.response
+        headers = entry.validators() if entry else {}
+        res = self.transport.request('GET', url, data, headers=headers)
+        if res.status_code == 304:
+            refreshed = self.cache.refresh(url)
+            if refreshed is not None:
+                return refreshed
+            # evicted or invalidated while Sonarr answered, the body went with the entry
+            res = self.transport.request('GET', url, data)
+        if res.ok:
+            self.cache.store(cache, url, res)
         return res
 
     def request_post(self, url, data):
-        """Wrapper on the requests.post"""
-        headers = {
-            'X-Api-Key': self.api_key
-        }
-        res = requests.post(url, headers=headers, json=data)
-        return res
+        """Wrapper on the session post"""
+        return self.transport.request('POST', url, data)
 
     def request_put(self, url, data):
-        """Wrapper on the requests.put"""
-        headers = {
-            'X-Api-Key': self.api_key
-        }
-        res = requests.put(url, headers=headers, json=data)
-        return res
+        """Wrapper on the session put"""
+        return self.transport.request('PUT', url, data)
 
     def request_del(self, url, data):
-        """Wrapper on the requests.delete"""
-        headers = {
-            'X-Api-Key': self.api_key
-        }
-        res = requests.delete(url, headers=headers, json=data)
-        return res
+        """Wrapper on the session delete"""
+        return self.transport.request('DELETE', url, data)
+
+    def close(self):
+        """Release pooled connections"""
+        self.transport.close()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+import requests
+from urllib.parse import urlparse
+from metrics import default_registry, endpoint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+def build_retry(retries, backoff):
+    """Retry policy for idempotent verbs only, POST is never replayed"""
+    kwargs = dict(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                  raise_on_status=False)
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+
+class Transport(object):
+    """
+    Persistent, pooled HTTP session used by SonarrAPI.
+    Connections are kept alive between calls and the api key header is set once on the session.
+    Every request is timed into the sonarr_request_seconds histogram per method & endpoint.
+    """
+
+    def __init__(self, api_key, pool_size=10, connect_timeout=3.05, read_timeout=30, retries=3, backoff=0.3,
+                 metrics=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.metrics = metrics or default_registry()
+        self.metrics.describe('sonarr_request_seconds', 'Sonarr api round trip time including retries')
+        self.metrics.describe('sonarr_responses_total', 'Sonarr api responses by status code')
+        self.session = requests.Session()
+        self.session.headers.update({'X-Api-Key': api_key})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=build_retry(retries, backoff))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, data=None, **kwargs):
+        """Send a request on the pooled session, json body is only attached when data is given"""
+        kwargs.setdefault('timeout', self.timeout)
+        if data is not None:
+            kwargs['json'] = data
+        log.debug('{} {}'.format(method, url))
+        path = endpoint(urlparse(url).path)
+        started = time.monotonic()
+        status = 'error'
+        try:
+            res = self.session.request(method, url, **kwargs)
+            status = res.status_code
+            return res
+        finally:
+            self.metrics.observe('sonarr_request_seconds', time.monotonic() - started, method=method, endpoint=path)
+            self.metrics.inc('sonarr_responses_total', method=method, endpoint=path, status=status)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlparse
+
+log = logging.getLogger(__name__)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large'}
+
+
+def event_key(payload):
+    """Identity of a webhook event, Sonarr retries and duplicate connections resend the same one"""
+    episodes = tuple(sorted(episode.get('id') for episode in payload.get('episodes', [])))
+    episode_file = (payload.get('episodeFile') or {}).get('id')
+    release = (payload.get('release') or {}).get('releaseTitle')
+    return (payload.get('instanceName'), payload.get('eventType'), (payload.get('series') or {}).get('id'), episodes,
+            episode_file, release, payload.get('isUpgrade', False))
+
+
+class WebhookReceiver(object):
+    """
+    Minimal asyncio HTTP endpoint for Sonarr's Connect > Webhook notifications.
+    Events are deduplicated within dedup_window seconds and handed to on_batch(events) in batches collected over
+    batch_window seconds, on_batch runs in the default executor so it may block.
+    """
+
+    def __init__(self, on_batch, host='127.0.0.1', port=8989, path='/sonarr', token=None, batch_window=5,
+                 dedup_window=300, max_body=1024 * 1024, clock=time.monotonic):
+        self.on_batch = on_batch
+        self.host = host
+        self.port = port
+        self.path = path
+        self.token = token
+        self.batch_window = batch_window
+        self.dedup_window = dedup_window
+        self.max_body = max_body
+        self.clock = clock
+        self.server = None
+        self.pending = []
+        self.seen = OrderedDict()  # event key -> time received
+        self._flush_handle = None
+        self.received = 0
+        self.duplicates = 0
+        self.batches = 0
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()[:2] if self.server else None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        log.info('Listening for Sonarr webhooks on {}:{}{}'.format(self.address[0], self.address[1], self.path))
+        return self
+
+    async def stop(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self.flush()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    # HTTP
+    async def handle(self, reader, writer):
+        try:
+            status = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ValueError):
+            status = 400
+        except Exception:
+            log.warning('Webhook request failed', exc_info=True)
+            status = 400
+        body = json.dumps({'status': REASONS.get(status, '')}).encode()
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(status, REASONS.get(status, ''), len(body)).encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            return 400
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlparse(target)
+        if url.path != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if self.token and parse_qs(url.query).get('token', [None])[0] != self.token:
+            return 401
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body:
+            return 413
+        payload = json.loads((await reader.readexactly(length)).decode('utf-8'))
+        if not isinstance(payload, dict) or 'eventType' not in payload:
+            return 400
+        # with several instances each one's webhook url names it, ?backend=uk
+        backend = parse_qs(url.query).get('backend', [None])[0]
+        if backend and not payload.get('instanceName'):
+            payload['instanceName'] = backend
+        self.accept(payload)
+        return 200
+
+    # BATCHING
+    def accept(self, payload):
+        """Queue an event unless the same one arrived within dedup_window"""
+        now = self.clock()
+        while self.seen and next(iter(self.seen.values())) < now - self.dedup_window:
+            self.seen.popitem(last=False)
+        key = event_key(payload)
+        self.received += 1
+        if key in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen[key] = now
+        self.pending.append(payload)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.batch_window, self.flush)
+        return True
+
+    def flush(self):
+        self._flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.batches += 1
+            future = asyncio.get_event_loop().run_in_executor(None, self.on_batch, batch)
+            future.add_done_callback(self._batch_done)
+
+    @staticmethod
+    def _batch_done(future):
+        if future.exception() is not None:
+            log.warning('Webhook batch handler failed', exc_info=future.exception())
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+STOP = None  # put on a worker's inbox to have it drain & exit
+
+
+def shard(channel, count):
+    """Worker index for a channel, stable across processes & restarts unlike hash()"""
+    return zlib.crc32((channel or '').encode('utf-8')) % count
+
+
+class Worker(object):
+    """
+    The command side of the runtime in a worker process: events arrive on the inbox in channel order,
+    conversation replies are claimed on the reading thread and every step runs on a thread pool.
+    """
+
+    def __init__(self, bot, parse, inbox, threads=8, expire_interval=1, drain_timeout=30):
+        self.bot = bot
+        self.parse = parse
+        self.inbox = inbox
+        self.expire_interval = expire_interval
+        self.drain_timeout = drain_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = set()
+        self.handled = 0
+
+    def run(self):
+        while True:
+            try:
+                event = self.inbox.get(timeout=self.expire_interval)
+            except queue.Empty:
+                event = {}
+            if event is STOP:
+                break
+            if event:
+                self.handle_event(event)
+            for step in self.bot.expire_conversations():
+                self.submit(step)
+        self.drain()
+
+    def handle_event(self, event):
+        self.handled += 1
+        step = self.bot.deliver_reply(event)
+        if step is not None:
+            self.submit(step)
+            return
+        for command, channel, sender in self.parse([event], self.bot.at_bot):
+            if command and channel:
+                self.submit(functools.partial(self.bot.handle_command, channel, command, sender))
+
+    def submit(self, step):
+        future = self.executor.submit(step)
+        self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        self.pending.discard(future)
+        if future.exception() is not None:
+            log.warning('Step failed', exc_info=future.exception())
+
+    def drain(self):
+        """Finish the steps in flight, tell users still mid conversation & send what is queued for Slack"""
+        finished, unfinished = wait(list(self.pending), timeout=self.drain_timeout)
+        if unfinished:
+            log.warning('{} steps still running after {}s, leaving them'.format(len(unfinished), self.drain_timeout))
+        for step in self.bot.expire_conversations(everything=True):
+            step()
+        self.executor.shutdown(wait=False)
+        self.bot.outbound.stop(drain=True)
+
+
+def work(index, inbox, factory, parse, threads, expire_interval, drain_timeout):
+    """Worker process entry point, factory builds the bot in the child"""
+    # ctrl-c reaches the whole process group, the front decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker = Worker(factory(), parse, inbox, threads=threads, expire_interval=expire_interval,
+                    drain_timeout=drain_timeout)
+    log.info('Worker {} ready'.format(index))
+    worker.run()
+    log.info('Worker {} drained after {} events'.format(index, worker.handled))
+
+
+class WorkerPool(object):
+    """
+    Worker processes for the commands of a large workspace, each one owns the channels sharded to it so a
+    conversation's messages always reach the process holding it, in order. Workers are spawned rather than
+    forked since the front already runs threads, and one that dies is replaced on its inbox.
+    """
+
+    def __init__(self, count, factory, parse, threads=8, expire_interval=1, drain_timeout=30, context=None):
+        self.count = count
+        self.factory = factory
+        self.parse = parse
+        self.threads = threads
+        self.expire_interval = expire_interval
+        self.drain_timeout = drain_timeout
+        self.context = context or multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(count)]
+        self.processes = [None] * count
+        self.sent = [0] * count
+        self.restarts = 0
+
+    def start(self):
+        for index in range(self.count):
+            self.spawn(index)
+        return self
+
+    def spawn(self, index):
+        process = self.context.Process(target=work, name='bot-worker-{}'.format(index),
+                                       args=(index, self.inboxes[index], self.factory, self.parse, self.threads,
+                                             self.expire_interval, self.drain_timeout), daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def send(self, event):
+        """Queue an event on the worker serving its channel, returns the worker index"""
+        index = shard(event.get('channel'), self.count)
+        self.inboxes[index].put(event)
+        self.sent[index] += 1
+        return index
+
+    def check(self):
+        """Replace workers that died, events already queued for them wait on the inbox"""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                log.warning('Worker {} exited with {}, restarting'.format(index, process.exitcode))
+                self.restarts += 1
+                self.spawn(index)
+
+    def stop(self, timeout=None):
+        """Drain: workers finish everything queued & in flight before exiting, stragglers are terminated"""
+        timeout = self.drain_timeout + 5 if timeout is None else timeout
+        for inbox, process in zip(self.inboxes, self.processes):
+            if process is not None and process.is_alive():
+                inbox.put(STOP)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                # workers ignore SIGTERM so a service manager's stop reaches the front only
+                log.warning('Worker {} did not drain in {}s, killing it'.format(index, timeout))
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+            self.processes[index] = None
+
+    def stats(self):
+        return {'workers': sum(1 for process in self.processes if process is not None and process.is_alive()),
+                'sent': sum(self.sent), 'restarts': self.restarts}
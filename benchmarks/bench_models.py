@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Parse time & memory of a synthetic /series response decoded into dicts versus slotted models.
+
+    python benchmarks/bench_models.py [--size 5000] [--repeat 5]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'app'))
+
+import models  # noqa: E402
+from models import Series  # noqa: E402
+from synthetic import library  # noqa: E402
+
+
+def stdlib_loads(body):
+    return json.loads(body.decode('utf-8'))
+
+
+def retained(build):
+    """Bytes still allocated once build() returns, i.e. what a caller holding the result keeps alive"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    body = json.dumps(library(args.size)).encode('utf-8')
+    cases = [
+        ('json -> dicts', lambda: stdlib_loads(body)),
+        ('json -> models', lambda: list(Series.decode(stdlib_loads(body)))),
+    ]
+    if models.orjson is not None:
+        cases += [
+            ('orjson -> dicts', lambda: models.orjson.loads(body)),
+            ('orjson -> models', lambda: list(Series.decode(models.orjson.loads(body)))),
+        ]
+    cases.append(('loads -> lazy models', lambda: Series.decode(models.loads(body))))
+
+    print('{} series, {:.1f} MB response'.format(args.size, len(body) / 1024.0 ** 2))
+    print('{:<22} {:>10} {:>12}'.format('case', 'ms', 'retained MB'))
+    for name, build in cases:
+        seconds = min(timeit.repeat(build, number=1, repeat=args.repeat))
+        print('{:<22} {:>10.1f} {:>12.1f}'.format(name, seconds * 1000, retained(build) / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+    main()
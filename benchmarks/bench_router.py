@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Command parsing & routing over a synthetic RTM firehose: mostly typing, presence & read events, channel chatter
+and a few commands addressed to the bot. Compares the previous parse_slack_output + if/elif chain, which only
+returned the first command of a batch, with the compiled router.
+
+    python benchmarks/bench_router.py [--events 100000] [--batch 20] [--repeat 5]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'app'))
+
+from commands import CommandRouter  # noqa: E402
+from main import parse_slack_output  # noqa: E402
+
+AT_BOT = '<@UBOT>'
+COMMANDS = ['help', 'get shows', 'get shows breaking', 'add show the wire', 'add shows atlanta; fargo',
+            'get history 20', 'get missing fargo', 'get airing', 'subscribe', 'stats', 'what is this']
+NAMES = [('help', False), ('get shows', False), ('add shows', False), ('add show', False), ('get history', False),
+         ('get missing', False), ('get airing', True), ('subscribe', True), ('unsubscribe', True), ('stats', True),
+         ('quality_profiles', True)]
+
+
+def firehose(count, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for index in range(count):
+        roll = rng.random()
+        if roll < 0.6:
+            events.append({'type': rng.choice(['user_typing', 'presence_change', 'channel_marked', 'pong']),
+                           'channel': 'C{}'.format(index % 50), 'user': 'U{}'.format(index % 500)})
+        elif roll < 0.95:
+            events.append({'type': 'message', 'channel': 'C{}'.format(index % 50), 'user': 'U{}'.format(index % 500),
+                           'text': ' '.join(rng.choice(['lunch', 'deploy', 'today', 'the', 'build', 'is', 'green'])
+                                            for _ in range(rng.randint(3, 25)))})
+        else:
+            events.append({'type': 'message', 'channel': 'C{}'.format(index % 50), 'user': 'U{}'.format(index % 500),
+                           'text': '{} {}'.format(AT_BOT, rng.choice(COMMANDS))})
+    return events
+
+
+# the code this replaced, kept verbatim apart from returning names instead of running commands
+def legacy_parse(slack_rtm_output, AT_BOT):
+    output_list = slack_rtm_output
+    if output_list and len(output_list) > 0:
+        for output in output_list:
+            if output and 'text' in output and AT_BOT in output['text']:
+                command = output['text'].split(AT_BOT)[1].strip().lower()
+                channel = output['channel']
+                sender = output['user']
+                return command, channel, sender
+    return None, None, None
+
+
+def legacy_route(command):
+    if command.startswith('help'):
+        return 'help'
+    elif command.lower().startswith('get shows'):
+        return 'get shows'
+    elif command.lower().startswith('add shows'):
+        return 'add shows'
+    elif command.lower().startswith('add show'):
+        return 'add show'
+    elif command.lower().startswith('get history'):
+        return 'get history'
+    elif command.lower().startswith('get missing'):
+        return 'get missing'
+    elif command.lower() == 'get airing':
+        return 'get airing'
+    elif command.lower() == 'subscribe':
+        return 'subscribe'
+    elif command.lower() == 'unsubscribe':
+        return 'unsubscribe'
+    elif command.lower() == 'stats':
+        return 'stats'
+    elif command.lower() == 'quality_profiles':
+        return 'quality_profiles'
+    return None
+
+
+def legacy(batches):
+    routed = 0
+    for batch in batches:
+        command, channel, sender = legacy_parse(batch, AT_BOT)
+        if command and legacy_route(command):
+            routed += 1
+    return routed
+
+
+def legacy_per_event(batches):
+    """What the runtime did to avoid dropping commands, one parse call per event"""
+    routed = 0
+    for batch in batches:
+        for event in batch:
+            command, channel, sender = legacy_parse([event], AT_BOT)
+            if command and legacy_route(command):
+                routed += 1
+    return routed
+
+
+def compiled(batches, router):
+    routed = 0
+    for batch in batches:
+        for command, channel, sender in parse_slack_output(batch, AT_BOT):
+            if router.match(command)[0] is not None:
+                routed += 1
+    return routed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=20, help='events returned by one rtm_read')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    events = firehose(args.events)
+    batches = [events[index:index + args.batch] for index in range(0, len(events), args.batch)]
+    router = CommandRouter()
+    for name, exact in NAMES:
+        router.add(name, None, exact=exact)
+    addressed = sum(1 for event in events if AT_BOT in event.get('text', ''))
+
+    print('{} events in batches of {}, {} addressed to the bot'.format(len(events), args.batch, addressed))
+    for name, run in (('legacy', lambda: legacy(batches)), ('legacy per event', lambda: legacy_per_event(batches)),
+                      ('compiled', lambda: compiled(batches, router))):
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        print('{:<18} {:>8.1f}ms {:>8.2f}us/event {:>6} commands routed'.format(
+            name, best * 1000, best / len(events) * 1e6, run()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Cold start of the bot: each run is a fresh interpreter that imports main, builds the Bot against a fake Slack
+workspace of --members users and starts the runtime, timed until the RTM socket is being read.
+The first run starts without a cached Slack identity, the others reuse the one it saved.
+
+    python benchmarks/bench_startup.py [--members 20000] [--latency 0.05] [--runs 5] [--target 0.5]
+
+Exits 1 when a run with a cached identity is slower than --target seconds.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+BOT_NAME = 'bench_bot'
+
+
+def child(members, latency, member_cost):
+    """One cold start, prints the phase timings & Slack calls as json"""
+    started = time.perf_counter()
+    import main
+    from runtime import Runtime
+    from fake_slack import FakeSlack
+    imported = time.perf_counter()
+
+    slack = FakeSlack(bot_name=BOT_NAME, latency=latency, members=members, member_cost=member_cost)
+    bot = main.Bot(slack_client=slack)
+    built = time.perf_counter()
+    runtime = Runtime(bot, parse=main.parse_slack_output)
+    threading.Thread(target=runtime.run, daemon=True).start()
+    while runtime._socket is None:
+        time.sleep(0.001)
+    ready = time.perf_counter()
+    print(json.dumps({'import_s': imported - started, 'bot_s': built - imported, 'connect_s': ready - built,
+                      'total_s': ready - started, 'bot_id': bot.bot_id,
+                      'slack_calls': [method for _, method, _ in slack.calls]}))
+
+
+def run(args):
+    from fake_sonarr import FakeSonarr
+
+    sonarr = FakeSonarr()
+    sonarr.start()
+    identity = os.path.join(tempfile.mkdtemp(), 'slack_identity.json')
+    env = dict(os.environ, SLACK_KEY='bench', BOT_NAME=BOT_NAME, NOTIFY_CHANNEL='', SONARR_HOST_URL=sonarr.url,
+               SONARR_API_KEY=sonarr.api_key, SLACK_IDENTITY_CACHE=identity,
+               LOOKUP_CACHE_DB=os.path.join(os.path.dirname(identity), 'lookups.db'))
+    runs = []
+    try:
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            output = subprocess.check_output([sys.executable, __file__, '--child', '--members', str(args.members),
+                                              '--latency', str(args.latency), '--member-cost',
+                                              str(args.member_cost)], env=env, cwd=os.path.join(ROOT, 'app'))
+            result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            result['process_s'] = time.perf_counter() - started
+            runs.append(result)
+        sonarr_requests = sonarr.count()
+    finally:
+        sonarr.stop()
+    return runs, sonarr_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=20000, help='users in the fake Slack workspace')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per Slack API call')
+    parser.add_argument('--member-cost', type=float, default=0.00002,
+                        help='seconds to transfer & decode one user of users.list or rtm.start')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target', type=float, default=0.5, help='seconds allowed for a start with a cached identity')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.members, args.latency, args.member_cost)
+        return
+
+    runs, sonarr_requests = run(args)
+    print('{} workspace users, {}s per Slack call, {} Sonarr requests during startup'.format(
+        args.members, args.latency, sonarr_requests))
+    print('{:<8}{:>10}{:>10}{:>10}{:>10}{:>10}  slack calls'.format('run', 'import', 'bot', 'connect', 'total',
+                                                                    'process'))
+    for index, result in enumerate(runs):
+        print('{:<8}{import_s:>10.3f}{bot_s:>10.3f}{connect_s:>10.3f}{total_s:>10.3f}{process_s:>10.3f}  {}'.format(
+            'cold' if index == 0 else 'cached', ', '.join(result['slack_calls']), **result))
+    cached = [result['total_s'] for result in runs[1:]]
+    if cached and max(cached) > args.target:
+        print('Cached start slower than the {}s target'.format(args.target))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
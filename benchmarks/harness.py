@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+End-to-end command benchmarks against a local fake Sonarr (own process) and a fake Slack client.
+
+Commands go in as RTM events through the asyncio runtime and are timed until the bot's reply is posted.
+For each scenario the harness reports cold & steady-state latency, throughput with concurrent users,
+Sonarr round trips per command and peak traced memory of the bot process.
+
+    python benchmarks/harness.py --size 2000 --latency 0.002
+    python benchmarks/harness.py --save benchmarks/baselines/reference.json
+    python benchmarks/harness.py --compare benchmarks/baselines/reference.json   # exits 1 on regressions
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, 'app'))
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+sys.path.insert(0, HERE)
+
+from fake_slack import FakeSlack  # noqa: E402
+from fake_sonarr import FakeSonarr  # noqa: E402
+from synthetic import library  # noqa: E402
+
+BOT_NAME = 'bench_bot'
+LOOKUP_TERMS = 5  # distinct titles for the lookup scenario, repeats are served by the title index
+
+
+# FAKE SONARR PROCESS
+def term(kind, index):
+    """A made up title per index, numbered titles look alike to the fuzzy title index"""
+    rng = random.Random('{}-{}'.format(kind, index))
+    return '{} {}'.format(kind, ''.join(rng.choice(string.ascii_lowercase) for _ in range(10)))
+
+
+def lookup_results(term, tvdb_base):
+    return [{'title': '{} {}'.format(term.title(), ('', 'US', 'UK')[number]).strip(), 'tvdbId': tvdb_base + number, 'year': 2018,
+             'titleSlug': '{}-{}'.format(term.replace(' ', '-'), number), 'seasons': [{'seasonNumber': 1,
+             'monitored': True}], 'images': [{'coverType': 'poster', 'url': '/poster.jpg'}]}
+            for number in range(3)]
+
+
+def calendar(series, count=40):
+    """An episode airing today for each of the first count shows, as /calendar embeds them"""
+    today = datetime.date.today().isoformat()
+    return [{'id': show['id'] * 1000, 'seriesId': show['id'], 'series': {'title': show['title']},
+             'seasonNumber': 1, 'episodeNumber': index + 1, 'title': 'Episode {}'.format(index + 1),
+             'airDate': today, 'hasFile': False, 'monitored': True} for index, show in enumerate(series[:count])]
+
+
+def serve(connection, size, latency, titles):
+    """Child process: run FakeSonarr and answer 'url', 'requests' & 'stop' over the pipe"""
+    series = library(size)
+    fake = FakeSonarr(series=series, latency=latency)
+    for index in range(titles):
+        fake.lookup[term('show', index)] = lookup_results(term('show', index), 900000 + index * 10)
+        fake.lookup[term('lookup', index)] = lookup_results(term('lookup', index), 500000 + index * 10)
+    fake.calendar = calendar(series)
+    # the episode store syncs from /episode, it has to find the same episodes airing today
+    for episode in fake.calendar:
+        fake.episodes[episode['seriesId']] = [dict((key, value) for key, value in episode.items() if key != 'series')]
+    fake.start()
+    while True:
+        command = connection.recv()
+        if command == 'url':
+            connection.send((fake.url, fake.api_key))
+        elif command == 'requests':
+            connection.send(fake.count())
+        elif command == 'stop':
+            fake.stop()
+            connection.send(True)
+            return
+
+
+class SonarrProcess(object):
+    """FakeSonarr in its own process so json encoding on the server side neither competes for the bot's GIL
+    nor shows up in the bot's memory numbers"""
+
+    def __init__(self, size, latency, titles):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child, size, latency, titles), daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.url, self.api_key = self.ask('url')
+        return self
+
+    def ask(self, command):
+        self.connection.send(command)
+        return self.connection.recv()
+
+    def requests(self):
+        return self.ask('requests')
+
+    def stop(self):
+        self.ask('stop')
+        self.process.join(5)
+
+
+# BOT UNDER TEST
+def start_bot(sonarr, workers):
+    state = tempfile.mkdtemp()
+    os.environ.update({'SONARR_HOST_URL': sonarr.url, 'SONARR_API_KEY': sonarr.api_key, 'BOT_NAME': BOT_NAME,
+                       'SLACK_KEY': 'bench', 'NOTIFY_CHANNEL': '',
+                       'SLACK_IDENTITY_CACHE': os.path.join(state, 'slack_identity.json'),
+                       'LOOKUP_CACHE_DB': os.path.join(state, 'lookups.db')})
+    import main
+    from runtime import Runtime
+
+    slack = FakeSlack(bot_name=BOT_NAME)
+    bot = main.Bot(slack_client=slack)
+    # the fake has no rate limits, pacing outbound posts to Slack's would only measure the token buckets
+    bot.outbound.rates = dict((method, (10000.0, 10000)) for method in bot.outbound.rates)
+    runtime = Runtime(bot, parse=main.parse_slack_output, max_workers=workers)
+    thread = threading.Thread(target=runtime.run, name='runtime', daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while runtime._socket is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return bot, slack
+
+
+def warm_up(bot, size, timeout=600):
+    """First library refresh plus the episode store sync it triggers, so background traffic is done"""
+    started = time.monotonic()
+    bot.library.refresh()
+    while len(bot.episodes.signatures) < size and time.monotonic() - started < timeout:
+        time.sleep(0.05)
+    return time.monotonic() - started
+
+
+# SCENARIOS, each runs one command for iteration i and returns once the final reply is posted
+def get_shows(bot, slack, i, channel, user):
+    started = time.monotonic()
+    slack.message('@get shows', channel, user)
+    slack.wait_for(channel, 'Already Subscribed', after=started)
+
+
+def lookup(bot, slack, i, channel, user):
+    started = time.monotonic()
+    slack.message('@add show {}'.format(term('lookup', i % LOOKUP_TERMS)), channel, user)
+    slack.wait_for(channel, 'The following shows were found', after=started)
+    bot.conversations.cancel(user, channel)
+
+
+def add_show(bot, slack, i, channel, user):
+    started = time.monotonic()
+    slack.message('@add show {}'.format(term('show', i)), channel, user)
+    slack.wait_for(channel, 'The following shows were found', after=started)
+    slack.message('1', channel, user)
+    slack.wait_for(channel, 'Do you want to subscribe', after=started)
+    slack.message('yes', channel, user)
+    slack.wait_for(channel, 'Successfully subcribed', after=started)
+
+
+def post_calendar(bot, slack, i, channel, user):
+    started = time.monotonic()
+    bot.post_calendar(channel)
+    slack.wait_for(channel, 'Airing today', after=started)
+
+
+SCENARIOS = (('get shows', get_shows), ('lookup', lookup), ('add show', add_show), ('calendar', post_calendar))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(scenario, bot, slack, sonarr, offset, iterations, concurrency):
+    """Sequential pass for latency & round trips, concurrent pass for throughput, traced pass for memory"""
+    latencies = []
+    before = sonarr.requests()
+    for i in range(iterations):
+        started = time.monotonic()
+        scenario(bot, slack, offset + i, 'C{}'.format(offset + i), 'U{}'.format(offset + i))
+        latencies.append(time.monotonic() - started)
+    round_trips = (sonarr.requests() - before) / float(iterations)
+
+    offset += iterations
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: scenario(bot, slack, i, 'C{}'.format(i), 'U{}'.format(i)),
+                      range(offset, offset + iterations)))
+    throughput = iterations / (time.monotonic() - started)
+
+    offset += iterations
+    tracemalloc.start()
+    for i in range(offset, offset + 3):
+        scenario(bot, slack, i, 'C{}'.format(i), 'U{}'.format(i))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'first_ms': latencies[0] * 1000, 'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000, 'throughput': throughput, 'round_trips': round_trips,
+            'peak_kb': peak / 1024.0}
+
+
+def run(args):
+    # sequential, concurrent & traced passes each use their own shows, channels & users
+    per_scenario = args.iterations * 2 + 3
+    sonarr = SonarrProcess(args.size, args.latency, len(SCENARIOS) * per_scenario).start()
+    try:
+        bot, slack = start_bot(sonarr, args.workers)
+        warm = warm_up(bot, args.size)
+        results = {'meta': {'size': args.size, 'latency': args.latency, 'iterations': args.iterations,
+                            'concurrency': args.concurrency, 'python': platform.python_version(),
+                            'warm_up_s': round(warm, 2)},
+                   'scenarios': {}}
+        for name, scenario in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            offset = len(results['scenarios']) * per_scenario
+            results['scenarios'][name] = measure(scenario, bot, slack, sonarr, offset, args.iterations,
+                                                 args.concurrency)
+        bot.outbound.stop()
+        return results
+    finally:
+        sonarr.stop()
+
+
+# REPORTING
+METRICS = (('first_ms', '{:.1f}'), ('p50_ms', '{:.1f}'), ('p95_ms', '{:.1f}'), ('throughput', '{:.1f}/s'),
+           ('round_trips', '{:.2f}'), ('peak_kb', '{:.0f}'))
+
+
+def report(results):
+    meta = results['meta']
+    print('{size} series, {latency}s sonarr latency, {iterations} iterations, {concurrency} concurrent users, '
+          'warm up {warm_up_s}s'.format(**meta))
+    print('{:<12}'.format('scenario') + ''.join('{:>14}'.format(name) for name, _ in METRICS))
+    for name, values in results['scenarios'].items():
+        print('{:<12}'.format(name) + ''.join('{:>14}'.format(fmt.format(values[metric]))
+                                              for metric, fmt in METRICS))
+
+
+def compare(results, baseline, tolerance, noise_ms=1.0):
+    """Print changes against a saved baseline, returns the regressions found"""
+    regressions = []
+    for name, values in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            continue
+        for metric, _ in METRICS:
+            if metric == 'first_ms':
+                continue
+            old, new = base[metric], values[metric]
+            change = (new - old) / old if old else 0
+            if metric == 'throughput':
+                # the concurrent pass is short, allow it twice the slack
+                worse = change < -2 * tolerance
+            elif metric == 'round_trips':
+                worse = new > old + 0.01
+            elif metric.endswith('_ms'):
+                worse = change > tolerance and new - old > noise_ms
+            else:
+                worse = change > tolerance
+            print('{:<12} {:<12} {:>12.2f} -> {:>12.2f} {:>+8.1%}{}'.format(name, metric, old, new, change,
+                                                                         '  REGRESSION' if worse else ''))
+            if worse:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2000, help='series in the fake library')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every sonarr response')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=32, help='runtime thread pool size')
+    parser.add_argument('--only', action='append', help='run only this scenario, may be repeated')
+    parser.add_argument('--save', help='write results to this json file')
+    parser.add_argument('--compare', help='baseline json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        if regressions:
+            print('{} regression(s)'.format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
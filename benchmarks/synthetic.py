@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Sonarr payloads shaped like real v2 api responses, for benchmarks"""
+
+import datetime
+import random
+
+NETWORKS = ('HBO', 'AMC', 'FX', 'BBC One', 'Netflix', 'NBC', 'CBS', 'Showtime')
+GENRES = ('Drama', 'Comedy', 'Crime', 'Documentary', 'Animation', 'Science-Fiction', 'Thriller')
+WORDS = ('the', 'last', 'dark', 'house', 'city', 'night', 'black', 'river', 'crown', 'wire', 'good', 'place',
+         'office', 'mirror', 'lost', 'fargo', 'atlanta', 'show', 'world', 'west', 'true', 'detective', 'state')
+
+
+def title(rng, index):
+    return '{} {}'.format(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title(), index)
+
+
+def images(slug):
+    return [{'coverType': cover, 'url': '/MediaCover/{}/{}.jpg?lastWrite=636000000000000000'.format(slug, cover)}
+            for cover in ('fanart', 'banner', 'poster')]
+
+
+def season(number, rng):
+    episodes = rng.randint(6, 24)
+    files = rng.randint(0, episodes)
+    return {'seasonNumber': number, 'monitored': rng.random() > 0.2,
+            'statistics': {'previousAiring': '2017-05-21T01:00:00Z', 'episodeFileCount': files,
+                           'episodeCount': episodes, 'totalEpisodeCount': episodes,
+                           'sizeOnDisk': files * 1500000000, 'percentOfEpisodes': 100.0 * files / episodes}}
+
+
+def series(index, rng):
+    name = title(rng, index)
+    slug = name.lower().replace(' ', '-')
+    seasons = [season(number, rng) for number in range(rng.randint(1, 12))]
+    episodes = sum(s['statistics']['episodeCount'] for s in seasons)
+    files = sum(s['statistics']['episodeFileCount'] for s in seasons)
+    return {
+        'id': index + 1, 'title': name, 'sortTitle': name.lower(), 'cleanTitle': slug.replace('-', ''),
+        'alternateTitles': [{'title': '{} ({})'.format(name, rng.randint(1990, 2018)), 'seasonNumber': -1}],
+        'seasonCount': len(seasons), 'totalEpisodeCount': episodes, 'episodeCount': episodes,
+        'episodeFileCount': files, 'sizeOnDisk': files * 1500000000, 'status': rng.choice(('continuing', 'ended')),
+        'overview': ' '.join(rng.choice(WORDS) for _ in range(60)), 'network': rng.choice(NETWORKS),
+        'airTime': '21:00', 'images': images(slug), 'seasons': seasons, 'year': rng.randint(1990, 2018),
+        'path': '/tv/{}'.format(name), 'profileId': 1, 'qualityProfileId': 1, 'seasonFolder': True,
+        'monitored': rng.random() > 0.1, 'useSceneNumbering': False, 'runtime': 60, 'tvdbId': 100000 + index,
+        'tvRageId': 0, 'tvMazeId': index, 'firstAired': '2008-01-20T08:00:00Z',
+        'lastInfoSync': '2018-03-01T12:00:00.0000000Z', 'seriesType': 'standard', 'titleSlug': slug,
+        'imdbId': 'tt{:07d}'.format(index), 'certification': 'TV-14', 'genres': rng.sample(GENRES, 2), 'tags': [],
+        'added': '2016-01-01T00:00:00Z', 'ratings': {'votes': rng.randint(0, 5000), 'value': 8.1},
+        'qualityCutoffNotMet': False,
+    }
+
+
+def library(size=5000, seed=0):
+    """A /series response body for a library of size shows"""
+    rng = random.Random(seed)
+    return [series(index, rng) for index in range(size)]
+
+
+def episodes(series_id, seasons=5, per_season=10, start_ordinal=736000):
+    """A /episode?seriesId= response body"""
+    result = []
+    for number in range(1, seasons + 1):
+        for episode in range(1, per_season + 1):
+            ordinal = start_ordinal + len(result) * 7
+            result.append({'id': series_id * 1000 + len(result), 'seriesId': series_id, 'episodeFileId': 0,
+                           'seasonNumber': number, 'episodeNumber': episode, 'title': 'Episode {}'.format(episode),
+                           'airDate': '{:%Y-%m-%d}'.format(datetime.date.fromordinal(ordinal)),
+                           'overview': 'An episode', 'hasFile': episode % 3 == 0, 'monitored': True,
+                           'absoluteEpisodeNumber': len(result) + 1, 'unverifiedSceneNumbering': False})
+    return result
@@ -0,0 +1,53 @@
+import os
+import sys
+
+# app modules import each other as top level modules (see app/main.py)
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'app'))
+sys.path.insert(0, HERE)
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def sonarr():
+    from fake_sonarr import FakeSonarr
+    with FakeSonarr() as fake:
+        yield fake
+
+
+@pytest.fixture
+def api(sonarr):
+    from sonarr import SonarrAPI
+    client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key, retries=2, backoff=0)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def bot(sonarr, monkeypatch):
+    """A Bot on one FakeSonarr instance & a FakeSlack, bot.slack_client.calls records what it sent"""
+    import main
+    import settings
+    from fake_slack import FakeSlack
+    monkeypatch.setattr(settings, 'BOT_NAME', 'sonarr_bot')
+    monkeypatch.setattr(settings, 'SLACK_IDENTITY_CACHE', '')
+    monkeypatch.setattr(settings, 'LOOKUP_CACHE_DB', '')
+    monkeypatch.setattr(settings, 'SONARR_BACKENDS', [('sonarr', sonarr.url, sonarr.api_key)])
+    return main.Bot(slack_client=FakeSlack(bot_name='sonarr_bot'))
+
+
+class Clock(object):
+    """Settable clock for code that takes a clock callable"""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def posted(bot):
+    """Texts the bot posted so far, once its outbound queue is flushed"""
+    bot.outbound.flush()
+    return [kwargs.get('text') for _, method, kwargs in bot.slack_client.calls if method == 'chat.postMessage']
@@ -0,0 +1,122 @@
+import socket
+import threading
+import time
+from collections import deque
+
+
+class _Websocket(object):
+    def __init__(self, sock):
+        self.sock = sock
+
+
+class _Server(object):
+    def __init__(self):
+        self.websocket = None
+
+
+class FakeSlack(object):
+    """
+    Stand-in for slackclient.SlackClient.
+    RTM events pushed with push() become readable on a real socket so the runtime's add_reader path is exercised,
+    Web API calls are recorded with the time they were made and answered with canned responses.
+    members pads the workspace with that many other users, listed before the bot, and member_cost is the extra
+    seconds each user returned by users.list or rtm.start costs to transfer & decode.
+    """
+
+    def __init__(self, bot_name='sonarr_bot', bot_id='UBOT', latency=0, members=0, member_cost=0):
+        self.bot_name = bot_name
+        self.bot_id = bot_id
+        self.latency = latency
+        self.member_cost = member_cost
+        self.members = [{'id': 'U{:08d}'.format(index), 'name': 'user{}'.format(index)} for index in range(members)]
+        self.members.append({'id': bot_id, 'name': bot_name})
+        self.server = _Server()
+        self.calls = []  # (monotonic time, method, kwargs)
+        self.events = deque()
+        self._condition = threading.Condition()
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+
+    # RTM
+    def rtm_connect(self, with_team_state=True, **kwargs):
+        # rtm.start sends the whole team state, users included, rtm.connect only the websocket url
+        if with_team_state:
+            self.api_call('rtm.start')
+            time.sleep(self.member_cost * len(self.members))
+        else:
+            self.api_call('rtm.connect')
+        self.server.websocket = _Websocket(self._reader)
+        return True
+
+    def push(self, event):
+        """Deliver an RTM event as if it had arrived on the websocket"""
+        with self._condition:
+            self.events.append(event)
+        self._writer.send(b'.')
+
+    def message(self, text, channel='C1', user='U1'):
+        """Push a message event, text addressed to the bot when it starts with @"""
+        if text.startswith('@'):
+            text = '<@{}> {}'.format(self.bot_id, text[1:])
+        self.push({'type': 'message', 'text': text, 'channel': channel, 'user': user})
+
+    def rtm_read(self):
+        self._reader.recv(4096)  # raises BlockingIOError when nothing is waiting, like the real websocket
+        with self._condition:
+            events, self.events = list(self.events), deque()
+        return events
+
+    # WEB API
+    def api_call(self, method, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._condition:
+            self.calls.append((time.monotonic(), method, kwargs))
+            self._condition.notify_all()
+        if method == 'users.list':
+            start = int(kwargs.get('cursor') or 0)
+            end = start + kwargs['limit'] if kwargs.get('limit') else len(self.members)
+            time.sleep(self.member_cost * len(self.members[start:end]))
+            return {'ok': True, 'members': self.members[start:end], 'headers': {},
+                    'response_metadata': {'next_cursor': str(end) if end < len(self.members) else ''}}
+        if method == 'auth.test':
+            return {'ok': True, 'user_id': self.bot_id, 'user': self.bot_name, 'headers': {}}
+        return {'ok': True, 'ts': '{:.6f}'.format(time.time()), 'channel': kwargs.get('channel'), 'headers': {}}
+
+    def posts(self, channel=None):
+        with self._condition:
+            return [kwargs for _, method, kwargs in self.calls
+                    if method == 'chat.postMessage' and (channel is None or kwargs.get('channel') == channel)]
+
+    def wait_for(self, channel, text, after=0, timeout=10):
+        """Block until a message containing text is posted to channel, returns the time it was posted"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for posted, method, kwargs in self.calls:
+                    if posted >= after and method == 'chat.postMessage' and kwargs.get('channel') == channel \
+                            and text in kwargs.get('text', ''):
+                        return posted
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AssertionError('Nothing containing {!r} posted to {}'.format(text, channel))
+                self._condition.wait(remaining)
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+
+
+class RecordingSlack(object):
+    """Web API only stand-in answering every call, the first ratelimit_first calls are rate limited"""
+
+    def __init__(self, ratelimit_first=0):
+        self.calls = []  # (method, kwargs)
+        self.ratelimit_first = ratelimit_first
+
+    def api_call(self, method, **kwargs):
+        if self.ratelimit_first:
+            self.ratelimit_first -= 1
+            return {'ok': False, 'error': 'ratelimited', 'headers': {'Retry-After': '0.05'}}
+        self.calls.append((method, kwargs))
+        return {'ok': True, 'ts': str(len(self.calls))}
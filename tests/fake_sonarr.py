@@ -0,0 +1,228 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+HISTORY_EVENT_TYPES = {1: 'grabbed', 2: 'seriesFolderImported', 3: 'downloadFolderImported', 4: 'downloadFailed',
+                       5: 'episodeFileDeleted', 6: 'episodeFileRenamed'}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeSonarr(object):
+    """
+    Local stand-in for the Sonarr v2 api.
+    Counts tcp connections and requests so tests can prove keep-alive reuse,
+    latency seconds are added to every response to mimic a remote Sonarr.
+    """
+
+    def __init__(self, api_key='test-key', series=None, profiles=None, root_folders=None, latency=0):
+        self.api_key = api_key
+        self.series = series if series is not None else []
+        self.profiles = profiles if profiles is not None else [{'id': 1, 'name': 'HD-1080p'}]
+        self.root_folders = root_folders if root_folders is not None else [{'id': 1, 'path': '/tv/'}]
+        self.lookup = {}
+        self.history = []
+        self.missing = []
+        self.queue = []
+        self.calendar = []
+        self.episodes = {}  # series id -> episodes
+        self.diskspace = []
+        self.commands = []
+        self.bulk_monitor = True  # False mimics builds without PUT /episode/monitor
+        self.latency = latency
+        self.connections = 0
+        self.requests = []
+        self.fail_next = []
+        self.etags = False
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/api'.format(self._server.server_address[1])
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, method=None, path=None):
+        return len([r for r in self.requests
+                    if (method is None or r[0] == method) and (path is None or r[1] == path)])
+
+    # ROUTES
+    def route(self, method, path, query, body):
+        if path == '/api/series' and method == 'GET':
+            return 200, self.series
+        if path == '/api/series' and method == 'POST':
+            body = dict(body, id=len(self.series) + 1)
+            self.series.append(body)
+            return 201, body
+        if path == '/api/series' and method == 'PUT':
+            return 202, body
+        if path == '/api/series/editor' and method == 'PUT':
+            edited = dict((show['id'], show) for show in body)
+            self.series = [edited.get(show.get('id'), show) for show in self.series]
+            return 202, body
+        if path.startswith('/api/series/lookup'):
+            return 200, self.lookup.get(query.get('term', [''])[0], [])
+        if path.startswith('/api/series/'):
+            series_id = int(path.rsplit('/', 1)[1])
+            matches = [s for s in self.series if s.get('id') == series_id]
+            if method == 'DELETE':
+                self.series = [s for s in self.series if s.get('id') != series_id]
+                return 200, {}
+            return (200, matches[0]) if matches else (404, {'message': 'NotFound'})
+        if path == '/api/profile':
+            return 200, self.profiles
+        if path == '/api/rootfolder':
+            return 200, self.root_folders
+        if path == '/api/history':
+            history = self.history
+            if query.get('filterKey') == ['eventType']:
+                event_type = HISTORY_EVENT_TYPES[int(query['filterValue'][0])]
+                history = [record for record in history if record.get('eventType') == event_type]
+            return 200, self.page(history, query)
+        if path == '/api/wanted/missing':
+            return 200, self.page(self.missing, query)
+        if path == '/api/queue':
+            return 200, self.queue
+        if path == '/api/calendar':
+            return 200, self.calendar
+        if path == '/api/episode/monitor' and method == 'PUT' and self.bulk_monitor:
+            wanted = set(body['episodeIds'])
+            changed = [episode for episodes in self.episodes.values() for episode in episodes
+                       if episode['id'] in wanted]
+            for episode in changed:
+                episode['monitored'] = body['monitored']
+            return 202, changed
+        if path == '/api/episode' and method == 'PUT':
+            for episodes in self.episodes.values():
+                for index, episode in enumerate(episodes):
+                    if episode['id'] == body['id']:
+                        episodes[index] = body
+            return 202, body
+        if path == '/api/episode':
+            return 200, self.episodes.get(int(query.get('seriesId', ['0'])[0]), [])
+        if path == '/api/command' and method == 'POST':
+            command = dict(body, id=len(self.commands) + 1, state='queued')
+            self.commands.append(command)
+            return 201, command
+        if path == '/api/command':
+            # like Sonarr only commands still queued or running are listed
+            return 200, [command for command in self.commands if command['state'] in ('queued', 'started')]
+        if path.startswith('/api/command/'):
+            return 200, self.commands[int(path.rsplit('/', 1)[1]) - 1]
+        if path == '/api/diskspace':
+            return 200, self.diskspace
+        if path == '/api/system/status':
+            return 200, {'version': '2.0.0.5344'}
+        return 404, {'message': 'NotFound'}
+
+    @staticmethod
+    def page(records, query):
+        """Sonarr paging envelope, records are expected to be stored in the requested sort order"""
+        page = int(query.get('page', ['1'])[0])
+        size = int(query.get('pageSize', ['10'])[0])
+        return {'page': page, 'pageSize': size, 'totalRecords': len(records),
+                'records': records[(page - 1) * size:page * size]}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers & body go out in separate writes, without this delayed acks add ~40ms per request
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                parsed = urlparse(self.path)
+                with fake._lock:
+                    fake.requests.append((method, parsed.path))
+                    status = fake.fail_next.pop(0) if fake.fail_next else None
+                if self.headers.get('X-Api-Key') != fake.api_key:
+                    status, payload = 401, {'error': 'Unauthorized'}
+                elif status is None:
+                    status, payload = fake.route(method, parsed.path, parse_qs(parsed.query),
+                                                 json.loads(raw.decode()) if raw else None)
+                else:
+                    payload = {'error': 'injected'}
+                if fake.latency:
+                    time.sleep(fake.latency)
+                out = json.dumps(payload).encode()
+                etag = '"{}"'.format(hashlib.md5(out).hexdigest()) if fake.etags and method == 'GET' else None
+                if etag and self.headers.get('If-None-Match') == etag:
+                    status, out = 304, b''
+                self.send_response(status)
+                if etag:
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
+
+
+class StubSonarr(object):
+    """In-process stand-in for the few SonarrAPI reads the library & episode store make, calls lists them"""
+
+    def __init__(self, series=(), episodes=None):
+        self.series = list(series)
+        self.episodes = episodes or {}  # series id -> episodes
+        self.calls = []  # (method, series id or None)
+
+    def get_series(self):
+        self.calls.append(('get_series', None))
+        return self.series
+
+    def get_series_by_series_id(self, series_id):
+        self.calls.append(('get_series_by_series_id', series_id))
+        for show in self.series:
+            if show['id'] == series_id:
+                return show
+        return {'message': 'NotFound'}
+
+    def get_episodes_by_series_id(self, series_id):
+        self.calls.append(('get_episodes_by_series_id', series_id))
+        return self.episodes[series_id]
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from backends import Backend, Backends, library_path, parse_routes
+from models import Series
+
+
+def test_parse_routes():
+    assert parse_routes('genres=Anime>anime; network = BBC One > uk;') == [('genres', 'anime', 'anime'),
+                                                                        ('network', 'bbc one', 'uk')]
+    assert parse_routes('') == []
+    with pytest.raises(ValueError):
+        parse_routes('genres=Anime')
+
+
+def test_library_path_per_backend():
+    assert library_path('../data/library.db', 'uk', shared=True) == '../data/library-uk.db'
+    assert library_path('../data/library.db', 'uk', shared=False) == '../data/library.db'
+    assert library_path(':memory:', 'uk', shared=True) == ':memory:'
+
+
+def test_route_by_rule_or_name():
+    backends = Backends([Backend('tv', None), Backend('anime', None), Backend('uk', None)],
+                        routes=parse_routes('genres=anime>anime; network=BBC One>uk'))
+    anime = Series.from_json({'title': 'Mushishi', 'genres': ['Animation', 'Anime']})
+    british = Series.from_json({'title': 'Sherlock', 'network': 'BBC One', 'genres': ['Drama']})
+    other = Series.from_json({'title': 'Fargo', 'network': 'FX'})
+    assert backends.route(anime).name == 'anime'
+    assert backends.route(british).name == 'uk'
+    assert backends.route(other).name == 'tv'
+    assert backends.route(anime, requested='uk').name == 'uk'
+    with pytest.raises(ValueError):
+        Backends([Backend('tv', None)], routes=parse_routes('genres=anime>anime'))
+
+
+def test_gather_reports_slow_and_failing_backends():
+    release = threading.Event()
+
+    def call(backend):
+        if backend.name == 'slow':
+            release.wait(5)
+        if backend.name == 'broken':
+            raise IOError('connection refused')
+        return backend.name.upper()
+
+    backends = Backends([Backend('tv', None), Backend('slow', None), Backend('broken', None)], timeout=0.2)
+    try:
+        gathered = backends.gather(call)
+        assert [(backend.name, result) for backend, result in gathered] == [('tv', 'TV')]
+        assert gathered.failed == [('slow', 'timed out'), ('broken', 'failed')]
+        assert 'slow (timed out), broken (failed)' in gathered.note()
+    finally:
+        release.set()
+        backends.shutdown()
+
+
+def test_a_backend_with_calls_still_running_is_skipped_until_they_return():
+    release = threading.Event()
+    calls = []
+
+    def call(backend):
+        calls.append(backend.name)
+        if backend.name == 'slow':
+            release.wait(5)
+        return backend.name.upper()
+
+    backends = Backends([Backend('tv', None), Backend('slow', None)], timeout=0.1, max_workers=1)
+    try:
+        assert backends.gather(call).failed == [('slow', 'timed out')]
+        for _ in range(3):
+            gathered = backends.gather(call)
+            # the other backend's pool is untouched by the hung call
+            assert [result for backend, result in gathered] == ['TV']
+            assert gathered.failed == [('slow', 'still busy')]
+        assert calls.count('slow') == 1 and backends.busy(backends.get('slow'))
+        release.set()
+        deadline = time.monotonic() + 2
+        while backends.busy(backends.get('slow')) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        gathered = backends.gather(call)
+        assert [result for backend, result in gathered] == ['TV', 'SLOW'] and not gathered.failed
+    finally:
+        release.set()
+        backends.shutdown()
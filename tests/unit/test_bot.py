@@ -0,0 +1,224 @@
+import datetime
+import time
+
+from conftest import posted
+
+
+def day(offset):
+    return (datetime.date.today() + datetime.timedelta(days=offset)).isoformat()
+
+
+class HeldPool(object):
+    """Stands in for the bot's batch pool so the episode store sync runs only when a test says so"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        self.pending.append((fn, args))
+
+    def run(self):
+        for fn, args in self.pending:
+            fn(*args)
+        self.pending = []
+
+
+def fargo(sonarr):
+    sonarr.series = [{'id': 1, 'title': 'Fargo', 'tvdbId': 11, 'monitored': True, 'seasons': [],
+                      'episodeCount': 3, 'episodeFileCount': 1}]
+    sonarr.episodes[1] = [
+        {'id': 1, 'seasonNumber': 1, 'episodeNumber': 1, 'title': 'Pilot', 'airDate': day(-7), 'monitored': True,
+         'hasFile': True},
+        {'id': 2, 'seasonNumber': 1, 'episodeNumber': 2, 'title': 'Second', 'airDate': day(-3), 'monitored': True,
+         'hasFile': False},
+        {'id': 3, 'seasonNumber': 1, 'episodeNumber': 3, 'title': 'Third', 'airDate': day(0), 'monitored': True,
+         'hasFile': False},
+    ]
+    sonarr.calendar = [dict(sonarr.episodes[1][2], series={'title': 'Fargo'}),
+                       dict(sonarr.episodes[1][2], id=4, episodeNumber=4, title='Fourth', airDate=day(1),
+                            series={'title': 'Fargo'})]
+
+
+def test_airing_and_missing_read_sonarr_until_the_episode_store_synced(bot, sonarr):
+    fargo(sonarr)
+    pool = bot.batch_pool = HeldPool()
+    bot.get_airing('C1')
+    bot.get_missing('C1', 'fargo')
+    assert not bot.episodes.synced and pool.pending
+    answer = 'Airing today:\n```Fargo S01E03 - Third```\nMissing from Fargo:\n```Fargo S01E02 - Second```'
+    assert '\n'.join(posted(bot)) == answer
+    assert sonarr.count('GET', '/api/calendar') == 1 and sonarr.count('GET', '/api/episode') == 1
+
+    pool.run()
+    assert bot.episodes.synced
+    bot.slack_client.calls = []
+    bot.get_airing('C1')
+    bot.get_missing('C1', 'fargo')
+    assert '\n'.join(posted(bot)) == answer
+    # the synced store answers, its one fetch was the sync's
+    assert sonarr.count('GET', '/api/calendar') == 1 and sonarr.count('GET', '/api/episode') == 2
+
+
+def test_an_empty_synced_store_does_not_fall_back(bot, sonarr):
+    sonarr.calendar = [{'id': 9, 'seasonNumber': 1, 'episodeNumber': 1, 'airDate': day(0), 'title': 'Gone',
+                        'series': {'title': 'Removed'}}]
+    bot.batch_pool = HeldPool()
+    bot.library.ensure_fresh()
+    bot.batch_pool.run()
+    bot.get_airing('C1')
+    bot.get_missing('C1', 'removed')
+    assert '\n'.join(posted(bot)) == 'Nothing airing today\nNo subscribed shows match `removed`'
+    assert sonarr.count('GET', '/api/calendar') == 0
+
+
+def lookup(title, tvdb_id):
+    return {'title': title, 'tvdbId': tvdb_id, 'seasons': [], 'images': [], 'titleSlug': title.lower()}
+
+
+def reply(bot, text, channel='C1', user='U1'):
+    step = bot.deliver_reply({'type': 'message', 'text': text, 'channel': channel, 'user': user})
+    assert step is not None, 'no conversation was waiting for {!r}'.format(text)
+    step()
+
+
+def test_add_shows_resolves_concurrently_and_confirms_once(bot, sonarr):
+    sonarr.series = [dict(lookup('Fargo', 11), id=1, monitored=True)]
+    sonarr.lookup = {'fargo': [lookup('Fargo', 11)], 'atlanta': [lookup('Atlanta', 22)],
+                     'atlanta fx': [lookup('Atlanta', 22)], 'the wire': [lookup('The Wire', 33)]}
+    sonarr.profiles = [{'id': 1, 'name': 'HD-1080p'}, {'id': 2, 'name': 'SD'}]
+    active, peak = [0], [0]
+    route = sonarr.route
+
+    def slow_lookup(method, path, query, body):
+        if not path.startswith('/api/series/lookup'):
+            return route(method, path, query, body)
+        with sonarr._lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with sonarr._lock:
+            active[0] -= 1
+        return route(method, path, query, body)
+
+    sonarr.route = slow_lookup
+    bot.add_shows_interaction('C1', 'atlanta; the wire\nfargo; atlanta fx; nothing here', 'U1')
+    assert peak[0] > 1
+    confirmation, = posted(bot)
+    assert '(1) - Atlanta\n(2) - The Wire```' in confirmation
+    assert 'Already subscribed to: Fargo' in confirmation and 'No shows found for: nothing here' in confirmation
+    assert 'quality profile `HD-1080p` or with the name of another profile: SD' in confirmation
+    assert sonarr.count('POST', '/api/series') == 0
+
+    reply(bot, 'SD')
+    assert sorted((show['title'], show['qualityProfileId']) for show in sonarr.series[1:]) == \
+        [('Atlanta', 2), ('The Wire', 2)]
+    assert posted(bot)[-1].endswith('Subscription results:\n```Atlanta - subscribed\nThe Wire - subscribed```')
+    assert bot.library.find_by_tvdb(22) is not None and bot.library.find_by_tvdb(33) is not None
+
+
+def test_add_shows_reports_each_failure_and_no_means_none(bot, sonarr):
+    sonarr.lookup = {'atlanta': [lookup('Atlanta', 22)], 'the wire': [lookup('The Wire', 33)]}
+    route = sonarr.route
+
+    def refuse_the_wire(method, path, query, body):
+        if method == 'POST' and path == '/api/series' and body['title'] == 'The Wire':
+            return 400, [{'propertyName': 'Path', 'errorMessage': 'Path is already configured for another series'}]
+        return route(method, path, query, body)
+
+    sonarr.route = refuse_the_wire
+    bot.add_shows_interaction('C1', 'atlanta; the wire', 'U1')
+    reply(bot, 'yes')
+    assert posted(bot)[-1].endswith('Subscription results:\n```Atlanta - subscribed\nThe Wire - failed```')
+    assert [show['qualityProfileId'] for show in sonarr.series] == [1]
+
+    bot.add_shows_interaction('C2', 'the wire', 'U1')
+    reply(bot, 'no', channel='C2')
+    assert posted(bot)[-1].endswith('I did not subscribe to any of those shows')
+    assert sonarr.count('POST', '/api/series') == 2
+
+
+def test_a_subscribed_show_does_not_hide_the_others_with_its_title(bot, sonarr):
+    sonarr.series = [dict(lookup('The Office (US)', 73244), id=1, monitored=True)]
+    sonarr.lookup = {'the office': [lookup('The Office (US)', 73244), lookup('The Office (UK)', 78107)],
+                     'atlanta': [lookup('Atlanta', 22)]}
+    bot.library.ensure_fresh()
+    bot.add_show_interaction('C1', 'the office', 'U1')
+    assert '(1) - The Office (US)' in posted(bot)[-1] and '(2) - The Office (UK)' in posted(bot)[-1]
+    reply(bot, '2')
+    assert posted(bot)[-1].endswith('Do you want to subscribe to `The Office (UK)`?')
+    assert sonarr.count('GET', '/api/series/lookup') == 1
+
+    # a show that is not subscribed is still answered from the index
+    bot.find_series('atlanta')
+    assert bot.find_series('atlanta')[0].title == 'Atlanta' and sonarr.count('GET', '/api/series/lookup') == 2
+
+
+def library_of_shows(sonarr):
+    sonarr.series = [dict(lookup('Fargo', 11), id=1, status='ended', monitored=True),
+                     dict(lookup('The Wire', 33), id=2, status='ended', monitored=False),
+                     dict(lookup('Atlanta', 22), id=3, status='continuing', monitored=True)]
+    sonarr.episodes[1] = [{'id': index, 'seasonNumber': 1 + index // 4, 'episodeNumber': index, 'monitored': True,
+                           'hasFile': index % 2 == 0, 'airDate': day(-10 + index)} for index in range(1, 13)]
+
+
+def test_monitor_and_unmonitor_a_season(bot, sonarr):
+    library_of_shows(sonarr)
+    for args in ('fargo', 'fargo season', 'fargo season two'):
+        bot.handle_command('C1', 'unmonitor ' + args, 'U1')
+    bot.handle_command('C1', 'unmonitor fargo season 2', 'U1')
+    bot.handle_command('C1', 'unmonitor FARGO Season 2', 'U1')
+    bot.handle_command('C1', 'monitor fargo season 9', 'U1')
+    bot.handle_command('C1', 'monitor nope season 1', 'U1')
+    bot.handle_command('C1', 'monitor fargo season 2', 'U1')
+    assert '\n'.join(posted(bot)).split('\n') == ['Which season? e.g. `unmonitor fargo season 2`'] * 3 + [
+        'Unmonitored 4 episodes of Fargo season 2', 'Every episode of Fargo season 2 is already unmonitored',
+        'Fargo has no season 9', 'No subscribed shows match `nope`', 'Monitored 4 episodes of Fargo season 2']
+    assert sonarr.count('PUT', '/api/episode/monitor') == 2
+    assert [episode['monitored'] for episode in sonarr.episodes[1]] == [True] * 12
+
+
+def test_unmonitor_ended_edits_only_monitored_ended_shows(bot, sonarr):
+    library_of_shows(sonarr)
+    bot.handle_command('C1', 'unmonitor ended', 'U1')
+    bot.handle_command('C1', 'unmonitor ended', 'U1')
+    assert '\n'.join(posted(bot)) == 'Stopped monitoring 1 ended shows:\n```Fargo```\nNo monitored show has ended'
+    assert [show['monitored'] for show in sonarr.series] == [False, False, True]
+    assert sonarr.count('PUT', '/api/series/editor') == 1
+    assert bot.library.shows(monitored_only=True) == [('Atlanta', [])]
+
+
+def test_search_missing_queues_one_search_and_reports_refusals(bot, sonarr):
+    library_of_shows(sonarr)
+    bot.handle_command('C1', 'search missing fargo', 'U1')
+    bot.handle_command('C1', 'search missing atlanta', 'U1')
+    bot.handle_command('C1', 'search missing', 'U1')
+    command, = sonarr.commands
+    # episodes 1 to 9 aired, the odd ones have no file
+    assert command['name'] == 'EpisodeSearch' and command['episodeIds'] == [1, 3, 5, 7, 9]
+    command['state'] = 'completed'
+    bot.backends.default.commands.poll()
+    assert '\n'.join(posted(bot)).split('\n') == [
+        'Started searching for 5 missing episodes of Fargo', 'Nothing missing from Atlanta',
+        'Which show? e.g. `search missing fargo`', 'Searching for 5 missing episodes of Fargo finished']
+
+    route = sonarr.route
+    sonarr.route = lambda method, path, query, body: (
+        (400, [{'propertyName': 'EpisodeIds', 'errorMessage': 'Episodes are not monitored'}])
+        if method == 'POST' and path == '/api/command' else route(method, path, query, body))
+    bot.handle_command('C1', 'search missing fargo', 'U1')
+    assert posted(bot)[-1].endswith('Sonarr did not start searching for 5 missing episodes of Fargo: '
+                                    'Episodes are not monitored')
+
+
+def test_conversations_left_at_shutdown_are_told_to_retry(bot):
+    now = [100.0]
+    bot.conversations.clock = lambda: now[0]
+    bot.conversations.expect('U1', 'C1', bot.confirm_shows_reply, ttl=10)
+    bot.conversations.expect('U2', 'C2', bot.confirm_shows_reply, ttl=60)
+    now[0] = 150.0
+    steps = bot.expire_conversations(everything=True)
+    for step in steps:
+        step()
+    assert [step.func.__name__ for step in steps] == ['conversation_timeout', 'conversation_restart']
+    assert posted(bot) == ['No response detected...', 'Bot is restarting, please run the command again']
+    assert len(bot.conversations) == 0
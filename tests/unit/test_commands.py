@@ -0,0 +1,56 @@
+from commands import CommandRouter
+from main import Bot, parse_slack_output
+
+
+def test_longest_command_wins_and_arguments_keep_case():
+    router = CommandRouter()
+    calls = []
+    router.add('add show', lambda bot, channel, args, sender: calls.append(('add show', args)))
+    router.add('add shows', lambda bot, channel, args, sender: calls.append(('add shows', args)))
+    assert router.dispatch(None, 'C1', 'Add Shows Atlanta; Fargo', 'U1') == 'add shows'
+    assert router.dispatch(None, 'C1', 'add  show The Wire', 'U1') == 'add show'
+    assert router.dispatch(None, 'C1', 'add showstopper', 'U1') is None
+    assert calls == [('add shows', 'Atlanta; Fargo'), ('add show', 'The Wire')]
+
+
+def test_exact_commands_take_no_arguments():
+    router = CommandRouter()
+    router.add('stats', lambda bot, channel, args, sender: None, exact=True)
+    assert router.match('stats')[0].name == 'stats'
+    assert router.match('stats please') == (None, None)
+
+
+def test_decorator_extends_the_bot():
+    @Bot.commands.command('ping', 'Replies pong')
+    def ping(bot, channel, args, sender):
+        bot.append((channel, args))
+
+    try:
+        seen = []
+        assert Bot.commands.dispatch(seen, 'C1', 'ping twice', 'U1') == 'ping'
+        assert seen == [('C1', 'twice')]
+        assert ('ping', 'Replies pong') in Bot.commands.help()
+        assert Bot.commands.match('get shows fargo')[0].name == 'get shows'
+    finally:
+        Bot.commands.remove('ping')
+
+
+def test_every_message_in_a_batch_is_parsed():
+    events = [{'type': 'user_typing', 'channel': 'C1', 'user': 'U1'},
+              {'type': 'message', 'text': '<@UBOT> get shows', 'channel': 'C1', 'user': 'U1'},
+              {'type': 'message', 'text': 'lunch?', 'channel': 'C2', 'user': 'U2'},
+              {'type': 'message', 'text': 'hey <@UBOT>  Add Show Fargo', 'channel': 'C3', 'user': 'U3'},
+              {'type': 'presence_change', 'text': '<@UBOT> help', 'user': 'U4'}]
+    assert list(parse_slack_output(events, '<@UBOT>')) == [('get shows', 'C1', 'U1'), ('Add Show Fargo', 'C3', 'U3')]
+
+
+def test_bulk_commands_route_by_longest_name():
+    assert Bot.commands.match('unmonitor ended')[0].name == 'unmonitor ended'
+    assert Bot.commands.match('unmonitor fargo season 2') == (Bot.commands.match('unmonitor x')[0], 'fargo season 2')
+    assert Bot.commands.match('search missing the wire')[1] == 'the wire'
+
+
+def test_mentions_without_a_user_are_skipped():
+    events = [{'type': 'message', 'subtype': 'bot_message', 'text': '<@UBOT> get shows', 'channel': 'C1'},
+              {'type': 'message', 'text': '<@UBOT> stats', 'channel': 'C1', 'user': 'U1'}]
+    assert list(parse_slack_output(events, '<@UBOT>')) == [('stats', 'C1', 'U1')]
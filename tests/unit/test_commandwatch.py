@@ -0,0 +1,58 @@
+import threading
+import time
+
+from commandwatch import CommandWatcher, command_state
+
+
+class Commands(object):
+    """Sonarr's command endpoints, finished commands leave the listing"""
+
+    def __init__(self):
+        self.states = {}
+        self.listings = 0
+        self.reads = 0
+
+    def get_commands(self):
+        self.listings += 1
+        return [{'id': command_id, 'state': state} for command_id, state in self.states.items()
+                if state in ('queued', 'started')]
+
+    def get_command(self, command_id):
+        self.reads += 1
+        return {'id': command_id, 'state': self.states[command_id]}
+
+
+def test_one_listing_per_poll_and_reads_only_for_finished_commands():
+    api = Commands()
+    now = [0.0]
+    watcher = CommandWatcher(api, timeout=100, clock=lambda: now[0])
+    done = []
+    watcher._thread = True  # polled by hand
+    for command_id in range(1, 11):
+        api.states[command_id] = 'started'
+        watcher.watch({'id': command_id, 'state': 'queued'}, done.append)
+    assert watcher.poll() is False
+    api.states[3] = 'completed'
+    api.states[4] = 'failed'
+    assert watcher.poll() is True
+    assert sorted((command['id'], command_state(command)) for command in done) == [(3, 'completed'), (4, 'failed')]
+    assert api.listings == 2 and api.reads == 2
+    now[0] = 200
+    watcher.poll()
+    assert len(watcher) == 0 and len(done) == 10
+    assert set(command_state(command) for command in done[2:]) == {'timeout'}
+
+
+def test_thread_runs_only_while_commands_are_watched():
+    api = Commands()
+    api.states[1] = 'started'
+    finished = threading.Event()
+    watcher = CommandWatcher(api, interval=0.01, max_interval=0.02)
+    watcher.watch({'id': 1, 'status': 'queued'}, lambda command: finished.set())
+    api.states[1] = 'completed'
+    assert finished.wait(2)
+    watcher.watch({'id': 2, 'status': 'completed'}, lambda command: None)  # already finished, no thread
+    deadline = time.time() + 2
+    while watcher._thread is not None and time.time() < deadline:
+        time.sleep(0.01)
+    assert watcher._thread is None and len(watcher) == 0
@@ -0,0 +1,43 @@
+from conftest import Clock
+from conversation import Conversations
+
+
+def test_reply_is_claimed_once():
+    conversations = Conversations(ttl=10, clock=Clock())
+    conversations.expect('U1', 'C1', handler=print, state={'step': 1})
+    pending = conversations.claim('U1', 'C1')
+    assert pending.state == {'step': 1}
+    assert conversations.claim('U1', 'C1') is None
+
+
+def test_conversations_are_keyed_by_user_and_channel():
+    conversations = Conversations(ttl=10, clock=Clock())
+    conversations.expect('U1', 'C1', handler=print, state='a')
+    conversations.expect('U1', 'C2', handler=print, state='b')
+    assert conversations.claim('U2', 'C1') is None
+    assert conversations.claim('U1', 'C2').state == 'b'
+    assert ('U1', 'C1') in conversations
+
+
+def test_expired_steps_are_returned_once():
+    clock = Clock()
+    conversations = Conversations(ttl=10, clock=clock)
+    conversations.expect('U1', 'C1', handler=print, state='old')
+    clock.now = 5
+    # replacing a step pushes its deadline back
+    conversations.expect('U1', 'C1', handler=print, state='new')
+    clock.now = 11
+    assert conversations.expired() == []
+    clock.now = 15
+    expired = conversations.expired()
+    assert [(key, pending.state) for key, pending in expired] == [(('U1', 'C1'), 'new')]
+    assert conversations.expired() == []
+    assert len(conversations) == 0
+
+
+def test_late_reply_is_not_claimed():
+    clock = Clock()
+    conversations = Conversations(ttl=10, clock=clock)
+    conversations.expect('U1', 'C1', handler=print)
+    clock.now = 10
+    assert conversations.claim('U1', 'C1') is None
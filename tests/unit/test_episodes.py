@@ -0,0 +1,60 @@
+import datetime
+
+from episodes import EpisodeStore
+from fake_sonarr import StubSonarr
+
+
+def episode(episode_id, season, number, air_date, has_file=False, monitored=True):
+    return {'id': episode_id, 'seasonNumber': season, 'episodeNumber': number, 'airDate': air_date,
+            'hasFile': has_file, 'monitored': monitored, 'title': 'Episode {}'.format(number)}
+
+
+def stub():
+    return StubSonarr(episodes={
+        1: [episode(11, 1, 1, '2026-10-10', has_file=True), episode(12, 1, 2, '2026-10-17'),
+            episode(13, 1, 3, '2026-10-24')],
+        2: [episode(21, 3, 1, '2026-10-17', monitored=False), episode(22, 3, 2, None)],
+    })
+
+
+def series(episode_count=3, last_sync='2026-10-01T00:00:00Z'):
+    return [{'id': 1, 'title': 'Atlanta', 'episodeCount': episode_count, 'lastInfoSync': last_sync},
+            {'id': 2, 'title': 'Fargo', 'episodeCount': 2, 'lastInfoSync': last_sync}]
+
+
+def test_only_changed_series_are_refetched():
+    sonarr = stub()
+    store = EpisodeStore(sonarr)
+    assert sorted(store.sync(series())) == [1, 2]
+    assert store.sync(series()) == []
+    assert store.sync(series(episode_count=4)) == [1]
+    assert sorted(series_id for method, series_id in sonarr.calls) == [1, 1, 2]
+    assert len(store) == 5
+
+
+def test_airing_by_date():
+    store = EpisodeStore(stub())
+    store.sync(series())
+    airing = store.airing(datetime.date(2026, 10, 17))
+    assert [(title, row['id']) for title, row in airing] == [('Atlanta', 12), ('Fargo', 21)]
+    week = store.airing(datetime.date(2026, 10, 10), datetime.date(2026, 10, 24))
+    assert [row['id'] for title, row in week] == [11, 12, 21, 13]
+
+
+def test_missing_and_webhook_downloads():
+    store = EpisodeStore(stub())
+    store.sync(series())
+    today = datetime.date(2026, 10, 18)
+    assert [row['id'] for row in store.missing(1, today=today)] == [12]
+    store.mark_downloaded(1, [12])
+    assert store.missing(1, today=today) == []
+    # unmonitored & unaired episodes are never missing
+    assert store.missing(2, today=today) == []
+
+
+def test_removed_series_leave_the_indexes():
+    store = EpisodeStore(stub())
+    store.sync(series())
+    store.sync(series()[:1])
+    assert store.find_series('fargo') is None
+    assert [title for title, row in store.airing(datetime.date(2026, 10, 17))] == ['Atlanta']
@@ -0,0 +1,79 @@
+from fake_sonarr import StubSonarr
+from library import Change, Library, describe_change
+
+
+def make_show(series_id, title, seasons, monitored=True):
+    return {'id': series_id, 'tvdbId': 1000 + series_id, 'title': title, 'monitored': monitored,
+            'status': 'continuing',
+            'seasons': [{'seasonNumber': number, 'monitored': number in seasons} for number in range(4)]}
+
+
+def test_shows_are_served_locally():
+    sonarr = StubSonarr([make_show(1, 'Breaking Bad', [1, 2]), make_show(2, 'Atlanta', [3])])
+    library = Library(sonarr)
+    assert library.shows() == [('Atlanta', [3]), ('Breaking Bad', [1, 2])]
+    assert library.shows(query='break') == [('Breaking Bad', [1, 2])]
+    assert library.shows(query='100%') == []
+    assert len(sonarr.calls) == 1
+
+
+def test_refresh_only_writes_changes():
+    sonarr = StubSonarr([make_show(1, 'Breaking Bad', [1]), make_show(2, 'Atlanta', [3])])
+    library = Library(sonarr)
+    assert library.refresh() == 2
+    assert library.refresh() == 0
+    sonarr.series = [make_show(1, 'Breaking Bad', [1, 2])]
+    assert library.refresh() == 2
+    assert library.shows() == [('Breaking Bad', [1, 2])]
+
+
+def test_duplicate_check_by_tvdb_id():
+    library = Library(StubSonarr([make_show(1, 'Breaking Bad', [1])]))
+    assert library.find_by_tvdb(1001) == (1, 'Breaking Bad')
+    assert library.find_by_tvdb(1002) is None
+    library.upsert(make_show(2, 'Atlanta', [1]))
+    assert library.find_by_tvdb(1002) == (2, 'Atlanta')
+
+
+def test_refresh_reports_changes():
+    sonarr = StubSonarr([make_show(1, 'Breaking Bad', [1]), make_show(2, 'Atlanta', [3])])
+    library = Library(sonarr)
+    seen = []
+    library.watch(seen.extend)
+    library.refresh()
+    assert seen == []  # filling an empty mirror is not news
+    sonarr.series = [make_show(1, 'Breaking Bad', [1, 3]), make_show(3, 'Fargo', [1])]
+    sonarr.series[0]['status'] = 'ended'
+    library.refresh()
+    assert seen == [Change('season_monitored', 1, 'Breaking Bad', 3), Change('status', 1, 'Breaking Bad', 'ended'),
+                    Change('added', 3, 'Fargo', None), Change('removed', 2, 'Atlanta', None)]
+    assert describe_change(seen[0]) == 'Season 3 of `Breaking Bad` now monitored'
+
+
+def test_refresh_series_reads_only_those_series():
+    sonarr = StubSonarr([make_show(1, 'Breaking Bad', [1]), make_show(2, 'Atlanta', [3])])
+    library = Library(sonarr)
+    library.refresh()
+    seen = []
+    library.watch(seen.extend)
+    sonarr.series = [make_show(1, 'Breaking Bad', [1], monitored=False)]
+    calls = len(sonarr.calls)
+    assert library.refresh_series([1, 2]) == 2
+    assert len(sonarr.calls) - calls == 2
+    assert seen == [Change('unmonitored', 1, 'Breaking Bad', None), Change('removed', 2, 'Atlanta', None)]
+    assert library.shows() == [('Breaking Bad', [1])]
+
+
+def test_follower_reads_the_mirror_another_process_refreshes(tmp_path):
+    path = str(tmp_path / 'library.db')
+    sonarr = StubSonarr([make_show(1, 'Breaking Bad', [1]), make_show(2, 'Atlanta', [3])])
+    front = Library(sonarr, path=path)
+    worker_sonarr = StubSonarr([])
+    worker = Library(worker_sonarr, path=path, follower=True)
+    assert worker.shows() == [] and not worker_sonarr.calls
+    front.refresh()
+    assert worker.shows() == [('Atlanta', [3]), ('Breaking Bad', [1])]
+    assert worker.find_by_tvdb(1001) == (1, 'Breaking Bad')
+    sonarr.series.pop()
+    front.refresh()
+    assert len(worker) == 1 and not worker_sonarr.calls
@@ -0,0 +1,51 @@
+import os
+
+from conftest import Clock
+from lookupstore import LookupStore
+
+
+def test_bodies_survive_reopening(tmpdir):
+    path = str(tmpdir.join('lookups.db'))
+    store = LookupStore(path)
+    body = b'[{"title": "Fargo", "tvdbId": 269613}]' * 50
+    store.put('Fargo', body)
+    store.close()
+    store = LookupStore(path)
+    assert store.get('  fargo ') == body
+    assert store.stats()['bytes'] < len(body)  # stored compressed
+    assert store.get('atlanta') is None
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_expired_entries_are_misses(tmpdir):
+    clock = Clock(1000.0)
+    store = LookupStore(str(tmpdir.join('lookups.db')), ttl=60, clock=clock)
+    store.put('fargo', b'[]')
+    clock.now += 59
+    assert store.get('fargo') == b'[]'
+    clock.now += 1
+    assert store.get('fargo') is None
+
+
+def test_least_recently_used_evicted_over_size(tmpdir):
+    clock = Clock(1000.0)
+    store = LookupStore(str(tmpdir.join('lookups.db')), max_bytes=2500, touch_after=0, clock=clock)
+    for term in ('one', 'two', 'three'):
+        clock.now += 1
+        store.put(term, os.urandom(1000))  # random bytes don't compress
+    assert len(store) == 2
+    clock.now += 1
+    assert store.get('two') is not None
+    clock.now += 1
+    store.put('four', os.urandom(1000))
+    assert store.get('three') is None
+    assert store.get('two') is not None
+
+
+def test_processes_share_one_file(tmpdir):
+    path = str(tmpdir.join('lookups.db'))
+    first, second = LookupStore(path), LookupStore(path)
+    first.put('fargo', b'[1]')
+    assert second.get('fargo') == b'[1]'
+    second.put('fargo', b'[2]')
+    assert first.get('fargo') == b'[2]'
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+from fake_sonarr import FakeSonarr
+from metrics import MetricsServer, Registry, endpoint
+from outbound import Outbound
+from transport import Transport
+
+
+class Slack(object):
+    def api_call(self, method, **kwargs):
+        return {'ok': True}
+
+
+def test_histogram_quantiles_and_exposition():
+    registry = Registry()
+    registry.describe('bot_command_seconds', 'Command time')
+    for value in (0.001, 0.002, 0.003, 0.2):
+        registry.observe('bot_command_seconds', value, command='get shows')
+    registry.inc('sonarr_responses_total', status=200)
+    registry.gauge('slack_outbound_depth', lambda: 3)
+    registry.gauge('broken', lambda: 1 / 0)
+
+    histogram = registry.histogram('bot_command_seconds', command='get shows')
+    assert histogram.count == 4 and 0 < histogram.quantile(0.5) <= 0.005
+    assert 0.1 < histogram.quantile(0.95) <= 0.25
+    assert registry.summary('bot_command_seconds', 'command')[0][:2] == ('get shows', 4)
+
+    text = registry.render()
+    assert '# HELP bot_command_seconds Command time\n# TYPE bot_command_seconds histogram' in text
+    assert 'bot_command_seconds_bucket{command="get shows",le="0.005"} 3' in text
+    assert 'bot_command_seconds_bucket{command="get shows",le="+Inf"} 4' in text
+    assert 'sonarr_responses_total{status="200"} 1' in text
+    assert 'slack_outbound_depth 3' in text and 'broken' not in text
+
+
+def test_sonarr_requests_and_slack_sends_are_timed():
+    registry = Registry()
+    with FakeSonarr() as fake:
+        transport = Transport(fake.api_key, metrics=registry)
+        transport.request('GET', '{}/series/12'.format(fake.url))
+        transport.request('GET', '{}/series/13'.format(fake.url))
+        transport.close()
+    assert endpoint('/api/series/12') == '/api/series/{id}'
+    assert registry.histogram('sonarr_request_seconds', method='GET', endpoint='/api/series/{id}').count == 2
+    assert registry.counters[Registry.key('sonarr_responses_total', {'method': 'GET', 'endpoint': '/api/series/{id}',
+                                                                     'status': 404})] == 2
+
+    outbound = Outbound(Slack(), metrics=registry).start()
+    outbound.post('C1', 'hello').result(2)
+    outbound.stop()
+    assert registry.histogram('slack_send_seconds', method='chat.postMessage').count == 1
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.gauge('library_series', lambda: 12)
+    loop = asyncio.new_event_loop()
+    server = MetricsServer(registry, port=0)
+    loop.run_until_complete(server.start())
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection(*server.address)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    try:
+        assert loop.run_until_complete(get('/metrics')).endswith('library_series 12\n')
+        assert loop.run_until_complete(get('/elsewhere')).startswith('HTTP/1.1 404')
+    finally:
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+
+def test_a_slow_gauge_does_not_block_the_event_loop():
+    registry = Registry()
+    release = threading.Event()
+    registry.gauge('library_series', lambda: 12 if release.wait(2) else 0)
+    loop = asyncio.new_event_loop()
+    server = MetricsServer(registry, port=0)
+    loop.run_until_complete(server.start())
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection(*server.address)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    async def scenario():
+        scrape = asyncio.ensure_future(get('/metrics'))
+        # the loop still answers while the scrape waits on the gauge
+        other = await asyncio.wait_for(get('/elsewhere'), 1)
+        assert not scrape.done()
+        release.set()
+        return other, await scrape
+
+    try:
+        other, scraped = loop.run_until_complete(scenario())
+    finally:
+        loop.run_until_complete(server.stop())
+        loop.close()
+    assert other.startswith('HTTP/1.1 404') and scraped.endswith('library_series 12\n')
@@ -0,0 +1,58 @@
+import models
+import pytest
+from models import Series, loads
+
+SHOW = {'id': 3, 'title': 'Atlanta', 'tvdbId': 318017, 'titleSlug': 'atlanta', 'monitored': True,
+        'overview': 'Earn and his cousin Alfred try to make their way in the world.',
+        'ratings': {'votes': 120, 'value': 8.6},
+        'images': [{'coverType': 'banner', 'url': '/banner.jpg'}, {'coverType': 'poster', 'url': '/poster.jpg'}],
+        'seasons': [{'seasonNumber': 1, 'monitored': True, 'statistics': {'episodeFileCount': 10}},
+                    {'seasonNumber': 2, 'monitored': False, 'statistics': {'episodeFileCount': 0}}]}
+
+
+@pytest.fixture(autouse=True)
+def library(sonarr):
+    sonarr.series = [SHOW]
+
+
+def test_typed_series_keep_only_modelled_fields(api):
+    show = api.get_series(typed=True)[0]
+    assert (show.id, show.title, show.tvdb_id) == (3, 'Atlanta', 318017)
+    assert show.poster == '/poster.jpg'
+    assert show.monitored_seasons() == [1]
+    assert not hasattr(show, 'overview') and not hasattr(show, '__dict__')
+    # dict style reads by json key keep older callers working
+    assert show['titleSlug'] == 'atlanta' and show.get('ratings', 'n/a') == 'n/a'
+    assert api.get_series() == [SHOW]
+
+
+def test_models_are_built_on_first_access():
+    payload = [dict(SHOW, id=number) for number in range(3)]
+    shows = Series.decode(payload)
+    assert len(shows) == 3 and payload[1] is not None
+    assert shows[1].id == 1
+    assert payload[1] is None and payload[0] is not None
+    assert shows[1] is shows[1]
+    assert [show.id for show in shows[:2]] == [0, 1]
+
+
+def test_queue_items_and_reference_data(sonarr, api):
+    sonarr.queue = [{'id': 7, 'status': 'Downloading', 'size': 1000.0, 'sizeleft': 250.0, 'series': SHOW,
+                   'episode': {'id': 70, 'seasonNumber': 2, 'episodeNumber': 4, 'title': 'Woods'}}]
+    item = api.get_queue(typed=True)[0]
+    assert (item.series_title, item.progress) == ('Atlanta', 75)
+    assert (item.episode.get('seasonNumber'), item.episode.get('episodeNumber')) == (2, 4)
+    assert api.get_quality_profiles(typed=True)[0].name == 'HD-1080p'
+    assert api.get_root_folder(typed=True)[0].path == '/tv/'
+
+
+def test_add_payload_round_trips_through_model(api):
+    series_json = api.series_json(Series.from_json(SHOW).to_json(), quality_profile=1)
+    assert series_json['images'][1] == {'coverType': 'poster', 'url': '/poster.jpg'}
+    assert series_json['seasons'][1] == {'seasonNumber': 2, 'monitored': False}
+    assert series_json['path'] == '/tv/Atlanta'
+
+
+def test_stdlib_decoder_without_orjson(monkeypatch):
+    monkeypatch.setattr(models, 'orjson', None)
+    assert loads(b'{"title": "Fargo \\u00e9"}') == {'title': u'Fargo \xe9'}
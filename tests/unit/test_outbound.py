@@ -0,0 +1,82 @@
+import time
+
+from fake_slack import RecordingSlack
+from outbound import Outbound, TokenBucket, chunk_text
+
+
+def test_chunks_keep_code_blocks_balanced():
+    text = 'Already Subscribed to:\n```{}```'.format('\n'.join('Show {} - Seasons: 1'.format(i) for i in range(400)))
+    chunks = chunk_text(text, max_length=500)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.count('```') % 2 == 0 for chunk in chunks)
+    assert ''.join(chunks).replace('```', '').replace('\n', '') == text.replace('```', '').replace('\n', '')
+
+
+def test_short_text_is_untouched():
+    assert chunk_text('hello') == ['hello']
+
+
+def test_adjacent_posts_to_a_channel_are_coalesced():
+    slack = RecordingSlack()
+    outbound = Outbound(slack)
+    futures = [outbound.post('C1', 'one'), outbound.post('C1', 'two'), outbound.post('C2', 'other'),
+               outbound.post('C1', 'three')]
+    outbound.start().stop()
+    texts = sorted((kwargs['channel'], kwargs['text']) for method, kwargs in slack.calls)
+    assert texts == [('C1', 'one\ntwo\nthree'), ('C2', 'other')]
+    assert all(future.result()['ok'] for future in futures)
+    assert outbound.coalesced == 2
+
+
+def test_attachments_are_never_coalesced():
+    slack = RecordingSlack()
+    outbound = Outbound(slack)
+    outbound.post('C1', 'one')
+    outbound.post('C1', 'two', attachments=[{'title': 'x'}])
+    outbound.post('C1', 'three')
+    outbound.start().stop()
+    assert [kwargs['text'] for method, kwargs in slack.calls] == ['one', 'two', 'three']
+
+
+def test_ratelimited_calls_are_retried_after_delay():
+    slack = RecordingSlack(ratelimit_first=1)
+    outbound = Outbound(slack, rates={'chat.update': (100.0, 1)}).start()
+    future = outbound.call('chat.update', channel='C1', ts='1', text='50%')
+    assert future.result(timeout=2)['ok']
+    outbound.stop()
+    assert outbound.ratelimited == 1
+    assert slack.calls == [('chat.update', {'channel': 'C1', 'ts': '1', 'text': '50%'})]
+
+
+def test_token_bucket_paces_after_burst():
+    now = [0.0]
+    bucket = TokenBucket(rate=1.0, capacity=2, clock=lambda: now[0])
+    for _ in range(2):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert bucket.wait_time() == 1.0
+    now[0] = 1.0
+    assert bucket.wait_time() == 0
+    bucket.block(5)
+    assert bucket.wait_time() == 5
+
+
+def test_posts_are_paced_per_channel():
+    slack = RecordingSlack()
+    # the clock never moves, only tokens already in a bucket can be spent
+    outbound = Outbound(slack, rates={'chat.postMessage': (1.0, 1), 'chat.update': (1.0, 1)}, clock=lambda: 0.0)
+    for channel in ('C1', 'C2', 'C3'):
+        outbound.post(channel, 'hello', attachments=[])
+        outbound.post(channel, 'again', attachments=[])
+    outbound.call('chat.update', channel='C4', ts='1', text='one')
+    outbound.call('chat.update', channel='C5', ts='1', text='two')
+    outbound.start()
+    deadline = time.monotonic() + 2
+    while len(slack.calls) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    outbound.stop(drain=False)
+    # each channel's first post goes out at once, updates share one workspace wide bucket
+    assert [(method, kwargs['channel']) for method, kwargs in slack.calls] == [
+        ('chat.postMessage', 'C1'), ('chat.postMessage', 'C2'), ('chat.postMessage', 'C3'), ('chat.update', 'C4')]
@@ -0,0 +1,50 @@
+import datetime
+import itertools
+
+import pytest
+
+
+def history_record(index, day):
+    return {'id': index, 'eventType': 'grabbed' if index % 2 else 'downloadFolderImported',
+            'date': '2026-10-{:02d}T12:00:00.5Z'.format(day)}
+
+
+@pytest.fixture(autouse=True)
+def history(sonarr):
+    sonarr.history = [history_record(index, 30 - index // 10) for index in range(200)]
+    sonarr.missing = [{'id': index, 'airDateUtc': '2026-10-{:02d}T01:00:00Z'.format(20 - index)}
+                      for index in range(20)]
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_history_pages_lazily(sonarr, api, prefetch):
+    records = list(itertools.islice(api.iter_history(page_size=10, prefetch=prefetch), 15))
+    assert [record['id'] for record in records] == list(range(15))
+    # two pages consumed, at most one prefetched
+    assert sonarr.count('GET', '/api/history') <= 3
+
+
+def test_history_filters_by_event_and_stops_at_since(sonarr, api):
+    records = list(api.iter_history(since=datetime.date(2026, 10, 29), event_type='grabbed', page_size=10))
+    assert [record['id'] for record in records] == [1, 3, 5, 7, 9, 11, 13, 15, 17, 19]
+    assert sonarr.count('GET', '/api/history') <= 4
+
+
+def test_sonarr_filters_history_by_event(sonarr, api):
+    sonarr.history = [dict(history_record(index, 30), eventType='downloadFolderImported') for index in range(500)]
+    sonarr.history[450]['eventType'] = 'grabbed'
+    records = list(itertools.islice(api.iter_history(event_type='grabbed', page_size=10), 10))
+    # one request answers with the only grab instead of walking 50 pages of imports
+    assert [record['id'] for record in records] == [450]
+    assert sonarr.count('GET', '/api/history') == 1
+
+
+def test_walks_every_page(sonarr, api):
+    assert len(list(api.iter_history(page_size=30))) == 200
+
+
+def test_missing_within_range(sonarr, api):
+    missing = list(api.iter_wanted_missing(since='2026-10-10T00:00:00Z', until=datetime.date(2026, 10, 18),
+                                           page_size=4))
+    assert [episode['airDateUtc'][:10] for episode in missing] == \
+        ['2026-10-{:02d}'.format(day) for day in range(17, 9, -1)]
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+from posters import PosterServer, PosterStore, image_type, thumbnail
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+
+
+def image(size, marker=b''):
+    return b'\xff\xd8\xff' + marker + b'\x00' * size
+
+
+def test_identical_posters_share_a_file_and_eviction_is_lru(tmp_path):
+    bodies = {'a': image(400, b'a'), 'b': image(400, b'a'), 'c': image(400, b'c'), 'd': image(400, b'd')}
+    now = [0.0]
+    store = PosterStore(str(tmp_path), max_bytes=1000, download=bodies.__getitem__, clock=lambda: now[0])
+    for url in 'abc':
+        now[0] += 100
+        assert store.ensure(url) is not None
+    assert store.ensure('a') == store.ensure('b')
+    assert store.stats()['files'] == 2
+    now[0] += 100
+    store.lookup('a')  # a & b share the file, a is now the most recently used
+    store.ensure('d')
+    # c was the least recently used file, b's row goes too but the file stays for a
+    assert store.lookup('c') is None and store.lookup('b') is None
+    assert store.lookup('a') is not None and store.lookup('d') is not None
+    assert sorted(path.name for path in tmp_path.glob('*.jpg')) == sorted([store.lookup('a'), store.lookup('d')])
+    store.close()
+
+
+def test_prefetch_is_joined_by_ensure_and_failures_fall_back(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def download(url):
+        calls.append(url)
+        if url == 'broken':
+            return b'<html>not found</html>'
+        started.set()
+        release.wait(2)
+        return image(10)
+
+    store = PosterStore(str(tmp_path), download=download)
+    store.prefetch(['slow', '', 'broken'])
+    assert started.wait(2)
+    assert store.ensure('slow', timeout=0.01) is None
+    release.set()
+    assert store.ensure('slow', timeout=2).endswith('.jpg')
+    assert store.ensure('broken', timeout=2) is None
+    assert sorted(calls) == ['broken', 'slow'] and store.stats()['failed'] == 1
+    store.close()
+
+
+def test_thumbnail_keeps_unknown_sizes_without_pillow():
+    assert image_type(PNG) == 'png' and image_type(b'GIF89a...') == 'gif' and image_type(b'text') is None
+    with pytest.raises(ValueError):
+        thumbnail(b'text', 300)
+
+
+def test_thumbnail_downsizes_with_pillow():
+    Image = pytest.importorskip('PIL.Image')
+    output = io.BytesIO()
+    Image.new('RGB', (1000, 1500), 'red').save(output, 'PNG')
+    body, extension = thumbnail(output.getvalue(), 300)
+    assert extension == 'jpg' and Image.open(io.BytesIO(body)).size == (300, 450)
+
+
+def test_server_serves_cached_files_only(tmp_path):
+    store = PosterStore(str(tmp_path), download=lambda url: PNG)
+    name = store.ensure('poster')
+    server = PosterServer(store, port=0)
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection(*server.address)
+        writer.write('GET {} HTTP/1.1\r\nHost: bot\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def scenario():
+        await server.start()
+        try:
+            return [await get(path) for path in ('/posters/' + name, '/posters/index.db', '/posters/../index.db')]
+        finally:
+            await server.stop()
+
+    loop = asyncio.new_event_loop()
+    try:
+        found, private, escaped = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+    assert found.startswith(b'HTTP/1.1 200') and found.endswith(PNG) and b'immutable' in found
+    assert b'Content-Type: image/png' in found
+    assert private.startswith(b'HTTP/1.1 404') and escaped.startswith(b'HTTP/1.1 404')
+    store.close()
@@ -0,0 +1,111 @@
+import threading
+
+from fake_slack import RecordingSlack
+from models import QueueItem
+from outbound import Outbound
+from queuetracker import QueueTracker
+
+
+def item(id, sizeleft, status='Downloading'):
+    return QueueItem.from_json({'id': id, 'status': status, 'size': 1000, 'sizeleft': sizeleft,
+                                'series': {'title': 'Show {}'.format(id)}, 'episode': {}})
+
+
+def tracker_for(queue, **options):
+    slack = RecordingSlack()
+    outbound = Outbound(slack).start()
+    fetch = lambda: None if queue is None else [(entry.id, 'Show {}'.format(entry.id), entry) for entry in queue]
+    return QueueTracker(fetch, outbound, **options), slack, outbound
+
+
+def test_message_is_edited_only_on_material_progress():
+    queue = [item(1, 1000)]
+    tracker, slack, outbound = tracker_for(queue, fast=5, idle=300, step=10)
+    assert tracker.poll() == 300  # nobody watching, the queue is not read
+    assert tracker.polls == 0
+    tracker.watch('C1')
+    assert tracker.poll() == 5
+    outbound.flush()
+    queue[0] = item(1, 990)  # 1%, same step
+    assert tracker.poll() == 10
+    assert tracker.poll() == 20
+    queue[0] = item(1, 850)  # 15%
+    assert tracker.poll() == 5
+    outbound.flush()
+    assert [method for method, kwargs in slack.calls] == ['chat.postMessage', 'chat.update']
+    assert slack.calls[1][1]['ts'] == '1' and '15%' in slack.calls[1][1]['text']
+    # once the queue drains the message says so and the watch ends
+    del queue[:]
+    assert tracker.poll() == 300
+    outbound.stop()
+    assert slack.calls[-1][0] == 'chat.update' and 'empty' in slack.calls[-1][1]['text']
+    assert tracker.stats()['watches'] == 0 and tracker.stats()['posts'] == 1
+    assert tracker.poll() == 300 and tracker.polls == 5
+
+
+def test_notify_watch_posts_new_items_and_skips_partial_reads():
+    queue = [item(1, 500)]
+    tracker, slack, outbound = tracker_for(queue)
+    woken = []
+    tracker.wake = lambda: woken.append(True)
+    tracker.watch('C9', repost=True)
+    assert woken == [True]
+    tracker.poll()
+    outbound.flush()
+    queue.append(item(2, 1000, status='Queued'))
+    tracker.poll()
+    outbound.flush()
+    queue.pop(0)
+    tracker.poll()
+    outbound.stop()
+    # a new download is a new message, one finishing edits the latest
+    assert [method for method, kwargs in slack.calls] == ['chat.postMessage', 'chat.postMessage', 'chat.update']
+    assert slack.calls[2][1]['ts'] == '2'
+    tracker.fetch = lambda: None
+    polls = tracker.polls
+    tracker.poll()
+    assert tracker.polls == polls + 1 and tracker.stats()['watches'] == 1
+
+
+def test_a_change_skipped_while_posting_is_published_once_the_post_lands():
+    queue = [item(1, 1000)]
+    release = threading.Event()
+
+    class SlowSlack(RecordingSlack):
+        def api_call(self, method, **kwargs):
+            if method == 'chat.postMessage':
+                release.wait(2)
+            return super(SlowSlack, self).api_call(method, **kwargs)
+
+    slack = SlowSlack()
+    outbound = Outbound(slack).start()
+    tracker = QueueTracker(lambda: [(entry.id, 'Show {}'.format(entry.id), entry) for entry in queue], outbound)
+    tracker.watch('C1')
+    tracker.poll()
+    queue[0] = item(1, 500)
+    tracker.poll()  # the post has no ts yet, the 50% edit waits for it
+    release.set()
+    outbound.flush()
+    outbound.stop()
+    assert [method for method, kwargs in slack.calls] == ['chat.postMessage', 'chat.update']
+    assert slack.calls[1][1]['ts'] == '1' and '50%' in slack.calls[1][1]['text']
+    assert tracker.stats()['updates'] == 1
+
+
+def test_notify_watch_stays_quiet_until_the_queue_has_items():
+    queue = []
+    tracker, slack, outbound = tracker_for(queue)
+    tracker.watch('C9', repost=True)
+    tracker.poll()
+    tracker.poll()
+    outbound.flush()
+    assert slack.calls == []
+    queue.append(item(1, 1000))
+    tracker.poll()
+    del queue[:]
+    outbound.flush()
+    tracker.poll()
+    outbound.stop()
+    # once there is a message, the drained queue is still edited into it
+    assert [method for method, kwargs in slack.calls] == ['chat.postMessage', 'chat.update']
+    assert 'empty' in slack.calls[1][1]['text']
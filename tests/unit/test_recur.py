@@ -0,0 +1,115 @@
+import datetime
+import threading
+import time
+
+import pytest
+from recur import Cron, Job, Periodic, Scheduler
+
+
+def test_cron_next_after():
+    cron = Cron('30 18 * * *')
+    assert cron.next_after(datetime.datetime(2026, 10, 18, 18, 30)) == datetime.datetime(2026, 10, 19, 18, 30)
+    assert cron.next_after(datetime.datetime(2026, 10, 18, 9, 0)) == datetime.datetime(2026, 10, 18, 18, 30)
+
+
+def test_cron_steps_ranges_and_weekdays():
+    assert Cron('*/15 * * * *').next_after(datetime.datetime(2026, 10, 18, 9, 16)) == \
+        datetime.datetime(2026, 10, 18, 9, 30)
+    # 2026-10-18 is a sunday, next weekday 9am is monday
+    assert Cron('0 9 * * 1-5').next_after(datetime.datetime(2026, 10, 18, 12, 0)) == \
+        datetime.datetime(2026, 10, 19, 9, 0)
+    assert Cron('0 0 1 1,7 *').next_after(datetime.datetime(2026, 10, 18)) == datetime.datetime(2027, 1, 1)
+
+
+@pytest.mark.parametrize('expression', ['* * *', '60 * * * *', '5-1 * * * *'])
+def test_cron_rejects_bad_expressions(expression):
+    with pytest.raises(ValueError):
+        Cron(expression)
+
+
+def test_many_jobs_share_one_thread():
+    scheduler = Scheduler()
+    threads = set()
+    done = threading.Event()
+
+    def tick():
+        threads.add(threading.current_thread().name)
+        if sum(job.runs for job in scheduler.jobs.values()) >= 6:
+            done.set()
+
+    for index in range(3):
+        scheduler.add('job-{}'.format(index), tick, interval=0.01)
+    before = threading.active_count()
+    scheduler.start()
+    assert done.wait(2)
+    scheduler.stop()
+    assert threads == {'scheduler'}
+    assert threading.active_count() <= before + 1
+    assert all(stats['failures'] == 0 for stats in scheduler.stats().values())
+
+
+def test_failures_are_counted_and_job_keeps_running():
+    scheduler = Scheduler()
+    job = scheduler.add('broken', lambda: 1 / 0, interval=0.01)
+    scheduler.start()
+    deadline = time.time() + 2
+    while job.runs < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert job.failures == job.runs >= 2
+
+
+def test_missed_run_policies():
+    now = [1000.0]
+    scheduler = Scheduler(clock=lambda: now[0])
+    skip = Job('skip', lambda: None, interval=60, missed='skip', grace=5)
+    catch_up = Job('catch_up', lambda: None, interval=60, missed='catch_up', grace=5)
+    assert skip.next_due(0) == 60
+    for job in (skip, catch_up):
+        scheduler._push(job, 100.0)
+    scheduler._stopped = False
+    worker = threading.Thread(target=scheduler._work)
+    worker.start()
+    deadline = time.time() + 2
+    while (skip.skipped + skip.runs < 1 or catch_up.runs < 1) and time.time() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    worker.join()
+    assert skip.skipped == 1 and skip.runs == 0
+    assert skip.due == 1060.0
+    # catch up keeps the original cadence so the next occurrence is already overdue
+    assert catch_up.runs >= 1
+
+
+def test_adaptive_delay_and_reschedule():
+    now = [1000.0]
+    delays = [5, None]
+    scheduler = Scheduler(clock=lambda: now[0])
+    job = scheduler.add('queue', lambda: delays.pop(0), interval=300, adaptive=True)
+    assert job.due == 1300.0
+    job.run()
+    assert job.next_due(now[0]) == 1005.0
+    job.run()
+    # no delay returned, back to the interval
+    assert job.next_due(now[0]) == 1300.0
+    scheduler.reschedule('queue', 0)
+    scheduler._stopped = False
+    assert scheduler._next() is job
+    # the superseded entry at 1300 is dropped rather than run again
+    now[0] = 1400.0
+    scheduler._push(scheduler.add('other', lambda: None, interval=60), 1350.0)
+    assert scheduler._next().name == 'other'
+    assert all(entry[2].name == 'other' for entry in scheduler._heap)
+    with pytest.raises(ValueError):
+        Job('bad', lambda: None, cron='* * * * *', adaptive=True)
+
+
+def test_periodic_start_is_idempotent():
+    scheduler = Scheduler()
+    calls = []
+    periodic = Periodic(0.01, calls.append, 'x', scheduler=scheduler, autostart=False)
+    periodic.start()
+    periodic.start()
+    assert len(scheduler.jobs) == 1
+    periodic.stop()
+    assert scheduler.jobs == {}
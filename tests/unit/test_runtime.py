@@ -0,0 +1,132 @@
+import asyncio
+import functools
+import socket
+import threading
+import time
+
+from runtime import Runtime
+
+
+class FakeSlack(object):
+    """Slack client whose websocket is one end of a socketpair"""
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.server = self
+        self.websocket = self
+        self.pending = []
+
+    def push(self, *events):
+        self.pending.extend(events)
+        self.peer.send(b'x')
+
+    def rtm_read(self):
+        try:
+            self.sock.recv(1024)
+        except BlockingIOError:
+            pass
+        events, self.pending = self.pending, []
+        return events
+
+
+class FakeBot(object):
+    at_bot = '<@B1>'
+
+    def __init__(self):
+        self.slack_client = FakeSlack()
+        self.replies = []
+        self.handled = []
+        self.started = threading.Barrier(2, timeout=2)
+
+    def deliver_reply(self, output):
+        if output.get('reply'):
+            return functools.partial(self.replies.append, output)
+        return None
+
+    def handle_command(self, channel, command, sender):
+        # both commands must be in flight at once to pass the barrier
+        self.started.wait()
+        self.handled.append((channel, command, sender))
+
+
+def parse(output_list, at_bot):
+    for output in output_list:
+        if at_bot in output.get('text', ''):
+            yield output['text'].split(at_bot)[1].strip(), output['channel'], output['user']
+
+
+def run_until(runtime, predicate, timeout=2):
+    async def wait():
+        runtime.events = asyncio.Queue()
+        runtime.start_reading()
+        deadline = time.time() + timeout
+        while not predicate() and time.time() < deadline:
+            try:
+                event = await asyncio.wait_for(runtime.events.get(), 0.01)
+                runtime.handle_event(event)
+            except asyncio.TimeoutError:
+                pass
+        if runtime.tasks:
+            await asyncio.wait(runtime.tasks)
+    runtime.loop = asyncio.new_event_loop()
+    try:
+        runtime.loop.run_until_complete(wait())
+    finally:
+        runtime.stop_reading()
+        runtime.loop.close()
+
+
+def test_commands_from_different_channels_run_concurrently():
+    bot = FakeBot()
+    runtime = Runtime(bot, parse=parse)
+    bot.slack_client.push({'text': '<@B1> get shows', 'channel': 'C1', 'user': 'U1'},
+                          {'text': '<@B1> help', 'channel': 'C2', 'user': 'U2'})
+    run_until(runtime, lambda: len(bot.handled) == 2)
+    assert sorted(bot.handled) == [('C1', 'get shows', 'U1'), ('C2', 'help', 'U2')]
+
+
+def test_replies_are_routed_before_command_parsing():
+    bot = FakeBot()
+    runtime = Runtime(bot, parse=parse)
+    bot.slack_client.push({'text': 'yes', 'channel': 'C1', 'user': 'U1', 'reply': True})
+    run_until(runtime, lambda: bot.replies)
+    assert bot.replies[0]['text'] == 'yes'
+    assert bot.handled == []
+
+
+def test_a_failing_event_does_not_stop_the_runtime():
+    bot = FakeBot()
+    bot.slack_client.server.websocket = bot.slack_client
+    deliver = bot.deliver_reply
+
+    def deliver_reply(output):
+        if output.get('broken'):
+            raise KeyError('user')
+        return deliver(output)
+
+    bot.deliver_reply = deliver_reply
+    runtime = Runtime(bot, parse=parse)
+    bot.slack_client.push({'text': 'oops', 'broken': True},
+                          {'text': '<@B1> get shows', 'channel': 'C1', 'user': 'U1'},
+                          {'text': '<@B1> help', 'channel': 'C2', 'user': 'U2'})
+
+    async def scenario():
+        main = asyncio.ensure_future(runtime.main())
+        deadline = time.time() + 2
+        while len(bot.handled) < 2 and time.time() < deadline:
+            await asyncio.sleep(0.01)
+        main.cancel()
+        try:
+            await main
+        except asyncio.CancelledError:
+            pass
+
+    runtime.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(runtime.loop)
+    try:
+        runtime.loop.run_until_complete(scenario())
+    finally:
+        runtime.stop_reading()
+        runtime.loop.close()
+    assert sorted(bot.handled) == [('C1', 'get shows', 'U1'), ('C2', 'help', 'U2')]
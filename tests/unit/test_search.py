@@ -0,0 +1,52 @@
+from search import TitleIndex, normalize
+
+
+def shows(*titles):
+    return [{'title': title, 'tvdbId': index + 1, 'titleSlug': normalize(title).replace(' ', '-'), 'images': []}
+            for index, title in enumerate(titles)]
+
+
+def make_index():
+    index = TitleIndex()
+    index.add_all(shows('Breaking Bad', 'Better Call Saul', 'The Office (US)', 'The Office', 'Atlanta'))
+    return index
+
+
+def test_typo_tolerant_match():
+    assert [show['title'] for show in make_index().search('breakng bad')][:1] == ['Breaking Bad']
+
+
+def test_prefix_match():
+    assert make_index().search('better ca')[0]['title'] == 'Better Call Saul'
+
+
+def test_exact_title_ranks_first():
+    assert [show['title'] for show in make_index().search('the office')] == ['The Office', 'The Office (US)']
+
+
+def test_unknown_title_is_a_miss():
+    assert make_index().search('stranger things') == []
+
+
+def test_results_are_memoized_by_normalized_query():
+    index = make_index()
+    index.search('Breaking Bad')
+    index.search('  breaking   BAD!')
+    assert index.memo_hits == 1
+    index.add_all(shows('Breaking Point'))
+    index.search('breaking bad')
+    assert index.memo_hits == 1
+
+
+def test_order_ranks_remote_results():
+    index = TitleIndex()
+    remote = shows('Atlanta', 'Breaking Bad')
+    index.add_all(remote)
+    assert [show['title'] for show in index.order('breaking bad', remote)] == ['Breaking Bad', 'Atlanta']
+
+
+def test_max_docs_evicts_oldest():
+    index = TitleIndex(max_docs=2)
+    index.add_all(shows('Breaking Bad', 'Atlanta', 'Fargo'))
+    assert len(index) == 2
+    assert index.search('breaking bad') == []
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_threads_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return 'shows'
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(flight.do, '/series', slow) for _ in range(5)]
+        while flight.stats()['collapsed'] < 4:
+            pass
+        release.set()
+        assert [future.result() for future in futures] == ['shows'] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {'calls': 1, 'collapsed': 4, 'in_flight': 0}
+    # finished flights are not reused
+    assert flight.do('/series', lambda: 'fresh') == 'fresh'
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(2)
+        raise IOError('sonarr down')
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(flight.do, '/series', failing) for _ in range(3)]
+        while flight.stats()['collapsed'] < 2:
+            pass
+        release.set()
+        for future in futures:
+            with pytest.raises(IOError):
+                future.result()
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_coroutines_and_threads_share_flights():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return 'lookup'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async('/lookup', slow))
+        while not flight.stats()['in_flight']:
+            await asyncio.sleep(0.001)
+        followers = [asyncio.ensure_future(flight.do_async('/lookup', slow)) for _ in range(2)]
+        thread = asyncio.get_event_loop().run_in_executor(None, flight.do, '/lookup', slow)
+        while flight.stats()['collapsed'] < 3:
+            await asyncio.sleep(0.001)
+        release.set()
+        return await asyncio.gather(leader, thread, *followers)
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(main()) == ['lookup'] * 4
+    finally:
+        loop.close()
+    assert len(calls) == 1
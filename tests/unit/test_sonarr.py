@@ -0,0 +1,163 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from lookupstore import LookupStore
+from sonarr import SonarrAPI, SonarrError
+
+
+def test_add_show_flow_reuses_one_connection(sonarr, api):
+    sonarr.lookup['tvdbId:1'] = [{'title': 'Show', 'tvdbId': 1, 'seasons': [], 'images': [], 'titleSlug': 'show'}]
+    api.get_quality_profiles()
+    series_json = api.constuct_series_json(tvdbId=1, quality_profile=1)
+    api.add_series(series_json)
+    api.get_series()
+    assert len(sonarr.requests) == 5
+    assert sonarr.connections == 1
+
+
+def test_api_key_header_sent(sonarr, api):
+    assert api.get_system_status() == {'version': '2.0.0.5344'}
+    assert api.transport.session.headers['X-Api-Key'] == sonarr.api_key
+
+
+def test_idempotent_get_is_retried(sonarr, api):
+    sonarr.fail_next = [503, 503]
+    assert api.get_root_folder() == [{'id': 1, 'path': '/tv/'}]
+    assert sonarr.count('GET', '/api/rootfolder') == 3
+
+
+def test_post_is_not_retried(sonarr, api):
+    sonarr.fail_next = [503]
+    res = api.request_post('{}/series'.format(sonarr.url), data={'title': 'Show'})
+    assert res.status_code == 503
+    assert sonarr.count('POST', '/api/series') == 1
+
+
+def test_reference_data_is_cached(sonarr, api):
+    api.get_quality_profiles()
+    api.get_quality_profiles()
+    api.get_root_folder()
+    api.get_root_folder()
+    assert sonarr.count('GET', '/api/profile') == 1
+    assert sonarr.count('GET', '/api/rootfolder') == 1
+    assert api.cache.stats()['hits'] == 2
+
+
+def test_cached_payload_is_not_shared(sonarr, api):
+    api.get_quality_profiles()[0]['name'] = 'changed'
+    assert api.get_quality_profiles()[0]['name'] == 'HD-1080p'
+
+
+def test_lru_bounds_parameterized_lookups(sonarr):
+    client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key, cache_size=2)
+    for query in ('a', 'b', 'c'):
+        client.lookup_series(query)
+    client.lookup_series('a')
+    assert sonarr.count('GET', '/api/series/lookup') == 4
+    assert client.cache.stats()['evictions'] == 2
+
+
+def test_stale_entry_revalidated_with_etag(sonarr):
+    sonarr.etags = True
+    now = [0]
+    client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key)
+    client.cache.clock = lambda: now[0]
+    assert client.get_quality_profiles() == sonarr.profiles
+    now[0] = 7200
+    assert client.get_quality_profiles() == sonarr.profiles
+    assert sonarr.count('GET', '/api/profile') == 2
+    assert client.cache.stats()['revalidated'] == 1
+
+
+def test_entry_evicted_before_its_304_is_fetched_again(sonarr):
+    sonarr.etags = True
+    now = [0]
+    client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key)
+    client.cache.clock = lambda: now[0]
+    client.get_quality_profiles()
+    route = sonarr.route
+
+    def evict(method, path, query, body):
+        if path == '/api/profile':
+            client.cache.invalidate()
+        return route(method, path, query, body)
+
+    sonarr.route = evict
+    now[0] = 7200
+    assert client.get_quality_profiles() == sonarr.profiles
+    sonarr.route = route
+    assert sonarr.count('GET', '/api/profile') == 3
+    assert client.cache.stats()['revalidated'] == 0
+    assert client.get_quality_profiles() == sonarr.profiles and sonarr.count('GET', '/api/profile') == 3
+
+
+def test_mutations_invalidate_library(sonarr, api):
+    api.get_series()
+    api.get_quality_profiles()
+    api.add_series({'title': 'Show', 'tvdbId': 1})
+    assert [s['title'] for s in api.get_series()] == ['Show']
+    api.get_quality_profiles()
+    assert sonarr.count('GET', '/api/series') == 2
+    assert sonarr.count('GET', '/api/profile') == 1
+
+
+def test_lookups_are_stored_across_clients(sonarr, tmpdir):
+    sonarr.lookup['fargo'] = [{'title': 'Fargo', 'tvdbId': 269613}]
+    path = str(tmpdir.join('lookups.db'))
+    for _ in range(2):
+        client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key, lookup_store=LookupStore(path))
+        assert client.lookup_series('fargo', typed=True)[0].tvdb_id == 269613
+        client.close()
+    assert sonarr.count('GET', '/api/series/lookup') == 1
+
+
+def test_concurrent_identical_gets_are_coalesced(sonarr):
+    sonarr.latency = 0.2
+    client = SonarrAPI(host_url=sonarr.url, api_key=sonarr.api_key)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: client.get_diskspace(), range(4)))
+    client.close()
+    assert all(result == results[0] for result in results)
+    assert sonarr.count('GET', '/api/diskspace') == 1
+    assert client.flight.stats()['collapsed'] == 3
+
+
+def test_bulk_edits_are_one_request(sonarr, api):
+    sonarr.series = [{'id': index, 'title': 'Show {}'.format(index), 'status': 'ended', 'monitored': True}
+                   for index in range(1, 51)]
+    sonarr.episodes[1] = [{'id': index, 'seasonNumber': 1, 'monitored': True} for index in range(1, 21)]
+    api.edit_series([dict(show, monitored=False) for show in api.get_series()])
+    assert not any(show['monitored'] for show in api.get_series())
+    api.set_episodes_monitored(api.get_episodes_by_series_id(1), False)
+    assert sonarr.count('PUT') == 2
+    # builds without the bulk endpoint get one full episode per request
+    sonarr.bulk_monitor = False
+    api.set_episodes_monitored(api.get_episodes_by_series_id(1)[:3], True)
+    assert sonarr.count('PUT', '/api/episode') == 3
+    assert [episode['monitored'] for episode in sonarr.episodes[1][:4]] == [True, True, True, False]
+
+
+def test_commands_are_queued_and_read_back(sonarr, api):
+    command = api.command('EpisodeSearch', episodeIds=[1, 2, 3])
+    assert command['id'] == 1 and command['state'] == 'queued'
+    assert [queued['name'] for queued in api.get_commands()] == ['EpisodeSearch']
+    sonarr.commands[0]['state'] = 'completed'
+    assert api.get_commands() == [] and api.get_command(1)['episodeIds'] == [1, 2, 3]
+
+
+def test_refused_commands_raise_with_sonarrs_message(sonarr, api):
+    route = sonarr.route
+
+    def refuse(method, path, query, body):
+        if method == 'POST' and path == '/api/command':
+            return 400, [{'propertyName': 'EpisodeIds', 'errorMessage': 'Must not be empty'},
+                         {'propertyName': 'Name', 'errorMessage': 'Unknown command'}]
+        return route(method, path, query, body)
+
+    sonarr.route = refuse
+    with pytest.raises(SonarrError, match='^Must not be empty; Unknown command$'):
+        api.command('EpisodeSearch', episodeIds=[])
+    sonarr.route = route
+    sonarr.fail_next = [500]
+    with pytest.raises(SonarrError, match='injected'):
+        api.command('RescanSeries')
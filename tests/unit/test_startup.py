@@ -0,0 +1,41 @@
+import main
+import settings
+from fake_slack import FakeSlack
+
+
+class NoAuthSlack(FakeSlack):
+    """A token auth.test refuses, the bot has to find itself among the workspace users"""
+
+    def api_call(self, method, **kwargs):
+        response = super(NoAuthSlack, self).api_call(method, **kwargs)
+        return {'ok': False, 'error': 'not_allowed_token_type'} if method == 'auth.test' else response
+
+
+def methods(slack):
+    return [method for _, method, _ in slack.calls]
+
+
+def test_identity_from_auth_test_then_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(settings, 'BOT_NAME', 'sonarr_bot')
+    monkeypatch.setattr(settings, 'SLACK_IDENTITY_CACHE', str(tmpdir.join('identity.json')))
+    monkeypatch.setattr(settings, 'LOOKUP_CACHE_DB', '')
+    slack = FakeSlack(bot_name='sonarr_bot', members=1000)
+    bot = main.Bot(slack_client=slack)
+    assert bot.bot_id == 'UBOT'
+    assert bot.connection is False
+    assert methods(slack) == ['auth.test']
+
+    slack = FakeSlack(bot_name='sonarr_bot')
+    assert main.Bot(slack_client=slack).bot_id == 'UBOT'
+    assert methods(slack) == []
+
+
+def test_users_are_paged_until_found(monkeypatch):
+    monkeypatch.setattr(settings, 'BOT_NAME', 'sonarr_bot')
+    monkeypatch.setattr(settings, 'SLACK_IDENTITY_CACHE', '')
+    monkeypatch.setattr(settings, 'LOOKUP_CACHE_DB', '')
+    slack = NoAuthSlack(bot_name='sonarr_bot', members=450)
+    bot = main.Bot(slack_client=slack)
+    assert bot.bot_id == 'UBOT'
+    assert methods(slack) == ['auth.test', 'users.list', 'users.list', 'users.list']
+    assert all(kwargs.get('limit') == 200 for _, method, kwargs in slack.calls if method == 'users.list')
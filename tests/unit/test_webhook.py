@@ -0,0 +1,67 @@
+import asyncio
+import http.client
+import json
+import os
+import threading
+
+import pytest
+from webhook import WebhookReceiver
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', 'webhooks')
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name + '.json')) as payload:
+        return json.load(payload)
+
+
+@pytest.fixture
+def receiver():
+    batches = []
+    received = threading.Event()
+
+    def on_batch(events):
+        batches.append(events)
+        received.set()
+
+    loop = asyncio.new_event_loop()
+    receiver = WebhookReceiver(on_batch, port=0, token='secret', batch_window=0.2)
+    loop.run_until_complete(receiver.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    receiver.batches_received = batches
+    receiver.batch_ready = received
+    yield receiver
+    asyncio.run_coroutine_threadsafe(receiver.stop(), loop).result(2)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(2)
+    loop.close()
+
+
+def send(receiver, payload, path='/sonarr?token=secret', method='POST'):
+    host, port = receiver.address
+    connection = http.client.HTTPConnection(host, port, timeout=2)
+    body = json.dumps(payload) if payload is not None else None
+    connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+
+def test_recorded_payloads_are_batched_and_deduplicated(receiver):
+    for name in ('grab', 'download', 'upgrade', 'rename', 'download'):
+        assert send(receiver, load(name)) == 200
+    assert receiver.batch_ready.wait(2)
+    assert len(receiver.batches_received) == 1
+    events = receiver.batches_received[0]
+    assert [event['eventType'] for event in events] == ['Grab', 'Download', 'Download', 'Rename']
+    assert receiver.duplicates == 1
+
+
+def test_rejects_bad_requests(receiver):
+    assert send(receiver, load('grab'), path='/sonarr?token=wrong') == 401
+    assert send(receiver, load('grab'), path='/elsewhere?token=secret') == 404
+    assert send(receiver, None, method='GET') == 405
+    assert send(receiver, {'no': 'event'}) == 400
+    assert receiver.received == 0
+
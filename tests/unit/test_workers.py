@@ -0,0 +1,112 @@
+import functools
+import os
+import queue
+import time
+
+from runtime import Runtime
+from workers import STOP, Worker, WorkerPool, shard
+
+
+def parse(output_list, at_bot):
+    for output in output_list:
+        if at_bot in output.get('text', ''):
+            yield output['text'].split(at_bot)[1].strip(), output['channel'], output['user']
+
+
+class Outbound(object):
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self, drain=True):
+        self.stopped = True
+
+
+class RecordingBot(object):
+    at_bot = '<@B1>'
+    bot_id = 'B1'
+
+    def __init__(self, results=None):
+        self.results = results
+        self.handled = []
+        self.waiting = ['C9']
+        self.outbound = Outbound()
+
+    def deliver_reply(self, output):
+        return None
+
+    def handle_command(self, channel, command, sender):
+        self.handled.append((channel, command))
+        if self.results is not None:
+            self.results.put((os.getpid(), channel, command))
+
+    def expire_conversations(self, everything=False):
+        if not everything:
+            return []
+        waiting, self.waiting = self.waiting, []
+        return [functools.partial(self.handle_command, channel, 'timed out', None) for channel in waiting]
+
+    def runs_inline(self, command):
+        return command == 'subscribe'
+
+
+def test_shard_is_stable_and_spreads_channels():
+    assert shard('C123', 4) == shard('C123', 4)
+    assert len(set(shard('C{}'.format(index), 4) for index in range(100))) == 4
+
+
+def test_worker_drains_queued_events_and_conversations():
+    bot = RecordingBot()
+    inbox = queue.Queue()
+    for index in range(5):
+        inbox.put({'text': '<@B1> get shows {}'.format(index), 'channel': 'C1', 'user': 'U1'})
+    inbox.put(STOP)
+    Worker(bot, parse, inbox, threads=1).run()
+    assert bot.handled == [('C1', 'get shows {}'.format(index)) for index in range(5)] + [('C9', 'timed out')]
+    assert bot.outbound.stopped
+
+
+def test_front_runs_inline_commands_and_forwards_the_rest():
+    bot = RecordingBot()
+    sent = []
+    runtime = Runtime(bot, parse=parse, workers=type('Pool', (), {'send': staticmethod(sent.append)})())
+    steps = []
+    runtime.submit = steps.append
+    for event in ({'text': '<@B1> subscribe', 'channel': 'C1', 'user': 'U1'},
+                  {'text': '<@B1> get shows', 'channel': 'C1', 'user': 'U1'},
+                  {'text': 'yes', 'channel': 'C2', 'user': 'U2'},
+                  {'text': 'my own message', 'channel': 'C2', 'user': 'B1'},
+                  {'type': 'user_typing', 'channel': 'C2', 'user': 'U2'}):
+        runtime.handle_event(event)
+    assert len(steps) == 1 and steps[0].args == ('C1', 'subscribe', 'U1')
+    assert [event['text'] for event in sent] == ['<@B1> get shows', 'yes']
+
+
+def test_pool_keeps_each_channel_on_one_process_in_order():
+    pool = WorkerPool(2, None, parse, threads=1, drain_timeout=5)
+    results = pool.context.Queue()
+    pool.factory = functools.partial(RecordingBot, results)
+    pool.start()
+    channels = ['C{}'.format(index) for index in range(6)]
+    for index in range(4):
+        for channel in channels:
+            pool.send({'text': '<@B1> get history {}'.format(index), 'channel': channel, 'user': 'U1'})
+    pool.stop(timeout=30)
+    handled = [results.get(timeout=5) for _ in range(len(channels) * 4 + 2)]
+    assert pool.stats() == {'workers': 0, 'sent': 24, 'restarts': 0}
+    for channel in channels:
+        mine = [(pid, command) for pid, where, command in handled if where == channel]
+        assert len(set(pid for pid, command in mine)) == 1
+        assert [command for pid, command in mine] == ['get history {}'.format(index) for index in range(4)]
+
+
+class StuckBot(RecordingBot):
+    def handle_command(self, channel, command, sender):
+        time.sleep(60)
+
+
+def test_pool_kills_workers_that_do_not_drain_in_time():
+    pool = WorkerPool(1, StuckBot, parse, threads=1, drain_timeout=60).start()
+    pool.send({'text': '<@B1> get shows', 'channel': 'C1', 'user': 'U1'})
+    started = time.monotonic()
+    pool.stop(timeout=1)
+    assert time.monotonic() - started < 10 and pool.stats()['workers'] == 0